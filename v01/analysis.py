@@ -1,70 +1,24 @@
 import sqlite3
 import networkx as nx
 import folium
-from haversine import haversine
 import storage
+# collaboration distances of the graph
+from geodistance import edge_lengths, edge_length_stats
+from network import load_graph, calculate_graph_metrics, cached_graph_metrics, print_metric_runtimes
+from incremental import update_graph_metrics
+from bundledmap import create_bundled_map
 from folium.plugins import MarkerCluster
 
-# Create NetworkX graph from department data and shared articles
-def create_graph(departments, article_dept_links):
-    G = nx.Graph()
-    
-    # Add departments as nodes
-    for dept in departments:
-        dept_id, name, lat, lon = dept
-        G.add_node(dept_id, name=name, lat=lat, lon=lon)
-    
-    # Add edges based on shared articles
-    for link in article_dept_links:
-        dept1_id, dept2_id, article_id, journal_title = link
-        if G.has_edge(dept1_id, dept2_id):
-            G[dept1_id][dept2_id]['weight'] += 1
-            G[dept1_id][dept2_id]['articles'].append((article_id, journal_title))
-        else:
-            G.add_edge(dept1_id, dept2_id, weight=1, articles=[(article_id, journal_title)])
-    
-    return G
-
-# Calculate graph metrics
-def calculate_graph_metrics(G):
-    cliques = list(nx.find_cliques(G))
-    connectivity = nx.node_connectivity(G)
-    avg_clustering = nx.average_clustering(G, weight='weight')
-    density = nx.density(G)
-    assortativity = nx.degree_assortativity_coefficient(G, weight='weight')
-    transitivity = nx.transitivity(G)
-    
-    # Calculate per-node metrics
-    degree_centrality = nx.degree_centrality(G)
-    betweenness_centrality = nx.betweenness_centrality(G, weight='weight', normalized=True)
-    closeness_centrality = nx.closeness_centrality(G)
-    
-    try:
-        eigenvector_centrality = nx.eigenvector_centrality(G, weight='weight', max_iter=500)
-    except nx.exception.PowerIterationFailedConvergence:
-        eigenvector_centrality = {node: None for node in G.nodes()}
-    
-    metrics = {
-        "Number of cliques": len(cliques),
-        "Network connectivity": connectivity,
-        "Average clustering coefficient": avg_clustering,
-        "Graph density": density,
-        "Assortativity coefficient": assortativity,
-        "Transitivity": transitivity,
-        "Degree centrality": degree_centrality,
-        "Betweenness centrality": betweenness_centrality,
-        "Closeness centrality": closeness_centrality,
-        "Eigenvector centrality": eigenvector_centrality,
-        "Cliques": cliques
-    }
-    
-    return metrics
+def _format_metric(value):
+    return f"{value:.4f}" if value is not None else "N/A"
 
 # Create Folium map with department connections and metrics
 def create_map(G, metrics):
     # Create base map with clustering
     m = folium.Map(location=[0, 0], zoom_start=2)
     marker_cluster = MarkerCluster().add_to(m)
+    # nodes are departments or, on a site level graph, sites
+    label = G.graph.get("level", "department").capitalize()
     
     # Add nodes to map with metrics
     for node in G.nodes(data=True):
@@ -73,15 +27,16 @@ def create_map(G, metrics):
         name = node_data['name']
         lat = node_data['lat']
         lon = node_data['lon']
-        degree = metrics['Degree centrality'][node_id]
-        betweenness = metrics['Betweenness centrality'][node_id]
-        closeness = metrics['Closeness centrality'][node_id]
-        eigenvector = metrics['Eigenvector centrality'][node_id]
+        # metrics left out of the profile (or cut short by their budget) show as N/A
+        degree = metrics.get('Degree centrality', {}).get(node_id)
+        betweenness = metrics.get('Betweenness centrality', {}).get(node_id)
+        closeness = metrics.get('Closeness centrality', {}).get(node_id)
+        eigenvector = metrics.get('Eigenvector centrality', {}).get(node_id)
         
-        popup_text = (f"Department: {name}<br>"
-                      f"Degree Centrality: {degree:.4f}<br>"
-                      f"Betweenness Centrality: {betweenness:.4f}<br>"
-                      f"Closeness Centrality: {closeness:.4f}<br>"
+        popup_text = (f"{label}: {name}<br>"
+                      f"Degree Centrality: {_format_metric(degree)}<br>"
+                      f"Betweenness Centrality: {_format_metric(betweenness)}<br>"
+                      f"Closeness Centrality: {_format_metric(closeness)}<br>"
                       f"Eigenvector Centrality: {eigenvector if eigenvector is not None else 'N/A'}")
         
         folium.Marker(
@@ -96,7 +51,7 @@ def create_map(G, metrics):
         dept1 = G.nodes[edge[0]]
         dept2 = G.nodes[edge[1]]
         points = [(dept1['lat'], dept1['lon']), (dept2['lat'], dept2['lon'])]
-        for article_id, journal_title in edge[2]['articles']:
+        for journal_title in edge[2]['journals']:
             if journal_title not in journal_layers:
                 journal_layers[journal_title] = folium.FeatureGroup(name=journal_title)
             folium.PolyLine(points, color='green', weight=edge[2]['weight']).add_to(journal_layers[journal_title])
@@ -105,7 +60,8 @@ def create_map(G, metrics):
         m.add_child(layer)
     
     # Add cliques as separate layers
-    for i, clique in enumerate(metrics["Cliques"]):
+    # the fast profile only counts the cliques
+    for i, clique in enumerate(metrics.get("Cliques", [])):
         clique_layer = folium.FeatureGroup(name=f'Clique {i+1}')
         for node_id in clique:
             node_data = G.nodes[node_id]
@@ -118,15 +74,20 @@ def create_map(G, metrics):
     
     folium.LayerControl().add_to(m)
 
-    # Add overall graph metrics to map as a separate layer
+    add_graph_metrics_marker(m, metrics)
+    
+    return m
+
+# Add overall graph metrics to map as a separate layer
+def add_graph_metrics_marker(m, metrics):
     metrics_popup = folium.Popup(
         f"Graph Metrics:<br>"
-        f"Number of cliques: {metrics['Number of cliques']}<br>"
-        f"Network connectivity: {metrics['Network connectivity']}<br>"
-        f"Average clustering coefficient: {metrics['Average clustering coefficient']:.4f}<br>"
-        f"Graph density: {metrics['Graph density']:.4f}<br>"
-        f"Assortativity coefficient: {metrics['Assortativity coefficient']:.4f}<br>"
-        f"Transitivity: {metrics['Transitivity']:.4f}",
+        f"Number of cliques: {metrics.get('Number of cliques', 'N/A')}<br>"
+        f"Network connectivity: {metrics.get('Network connectivity', 'N/A')}<br>"
+        f"Average clustering coefficient: {_format_metric(metrics.get('Average clustering coefficient'))}<br>"
+        f"Graph density: {_format_metric(metrics.get('Graph density'))}<br>"
+        f"Assortativity coefficient: {_format_metric(metrics.get('Assortativity coefficient'))}<br>"
+        f"Transitivity: {_format_metric(metrics.get('Transitivity'))}",
         max_width=300
     )
     folium.Marker(
@@ -134,19 +95,50 @@ def create_map(G, metrics):
         popup=metrics_popup,
         icon=folium.Icon(color='red')
     ).add_to(m)
-    
-    return m
+
+# Build the graph over sites (departments within storage.SITE_DISTANCE km merged) instead of departments,
+# this (re)writes the site assignments of pubmed.db before every run
+SITE_LEVEL = False
+# network.PROFILES entry used for the metrics: "exact" or "fast" for large graphs
+METRIC_PROFILE = "exact"
+# Processes for the metrics, network.WORKERS to use every core
+METRIC_WORKERS = 1
+# Keep the graph and exact metrics between runs (incremental.STATE_PATH) and only apply the new rows (without a WINDOW)
+INCREMENTAL = False
+# Reuse the metrics stored in the GraphMetrics table while the data has not changed
+METRICS_CACHE = True
+# "bundled" draws the network as one GeoJSON layer aggregated per zoom level (bundledmap.BUNDLE_LEVELS),
+# "detailed" as the Leaflet markers and lines of create_map
+MAP_MODE = "bundled"
+# Only count the articles published within (start, end), publishedDate integers such as (20240101, 20241231)
+WINDOW = None
 
 # Main execution
-departments = storage.retrieve_all_departments()
-article_dept_links = storage.get_article_department_links()
-print(article_dept_links)
-G = create_graph(departments, article_dept_links)
-metrics = calculate_graph_metrics(G)
-map_ = create_map(G, metrics)
+if __name__ == "__main__":
+    storage.instantiate()
+    if SITE_LEVEL:
+        storage.assign_sites()
+    level = 'site' if SITE_LEVEL else 'department'
+    if INCREMENTAL and WINDOW is None:
+        G, metrics, report = update_graph_metrics(level)
+        print(report)
+    elif METRICS_CACHE:
+        G = load_graph(level, WINDOW)
+        metrics = cached_graph_metrics(level, profile=METRIC_PROFILE, workers=METRIC_WORKERS, G=G, window=WINDOW)
+    else:
+        G = load_graph(level, WINDOW)
+        metrics = calculate_graph_metrics(G, profile=METRIC_PROFILE, workers=METRIC_WORKERS)
+    print(G)
+    print("Collaboration distances:", edge_length_stats(edge_lengths(G), [weight for _, _, weight in G.edges(data='weight')]))
+    print_metric_runtimes(metrics)
+    if MAP_MODE == "bundled":
+        map_ = create_bundled_map(G, metrics)
+        add_graph_metrics_marker(map_, metrics)
+    else:
+        map_ = create_map(G, metrics)
 
-# Save map to HTML file
-map_.save("department_network_map.html")
+    # Save map to HTML file
+    map_.save("department_network_map.html")
 
 # If you want to display the map directly in a Jupyter Notebook, you can use:
 # from IPython.display import IFrame
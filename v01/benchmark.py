@@ -0,0 +1,819 @@
+import os
+import sys
+import json
+import gzip
+import time
+import random
+import tempfile
+# storage library for this project
+import storage
+import medline
+import network
+import sparsenetwork
+import incremental
+import keplerglexport
+import geodistance
+import numpy as np
+import networkx as nx
+
+# Synthetic article shaped like the output of fetchArticles.getByArticleID after geolocation
+def make_article(i, n_authors=30):
+    return {
+        "articleTitle": f"Synthetic article {i}",
+        "journalTitle": "Benchmark Journal",
+        "datePublished": "2024 Jun 1",
+        "abstract": "Lorem ipsum " * 40,
+        "authorsList": [f"Author {i}-{j}" for j in range(n_authors)],
+        "departmentList": [[f"Department {j % 7}, University {i % 50}, City, Country.", [10.0 + j, 20.0 + i % 50]]
+                           for j in range(n_authors)]
+    }
+
+# The original ingest path: every row is its own insert and commit
+def legacy_ingest(articles):
+    for article in articles:
+        article_id = storage.insert_article(article['articleTitle'], article['journalTitle'],
+                                            article['datePublished'], article['abstract'])
+        for author, department in zip(article['authorsList'], article['departmentList']):
+            author_id = storage.insert_author(author)
+            department_id = storage.insert_department(department[0], department[1][0], department[1][1])
+            storage.tie_article_author_department(article_id, author_id, department_id)
+
+def _fresh_database(directory, name):
+    storage.connect(os.path.join(directory, name))
+    storage.instantiate()
+
+# Articles/sec of the per-row path against ingest_articles, with and without WAL
+def bench_ingest(n_articles=200, n_authors=30, batch_size=storage.INGEST_BATCH_SIZE):
+    n_articles, n_authors, batch_size = int(n_articles), int(n_authors), int(batch_size)
+    articles = [make_article(i, n_authors) for i in range(n_articles)]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        _fresh_database(directory, "legacy.db")
+        start = time.perf_counter()
+        legacy_ingest(articles)
+        results["per-row commit"] = n_articles / (time.perf_counter() - start)
+
+        _fresh_database(directory, "batched.db")
+        start = time.perf_counter()
+        storage.ingest_articles(articles, batch_size=batch_size)
+        results[f"ingest_articles (batch {batch_size})"] = n_articles / (time.perf_counter() - start)
+
+        _fresh_database(directory, "batched_wal.db")
+        storage.set_journal_mode('WAL')
+        start = time.perf_counter()
+        storage.ingest_articles(articles, batch_size=batch_size)
+        results[f"ingest_articles (batch {batch_size}, WAL)"] = n_articles / (time.perf_counter() - start)
+
+        # a bulk load refreshes the rollup tables once at the end instead of after every batch
+        _fresh_database(directory, "bulk_wal.db")
+        storage.set_journal_mode('WAL')
+        start = time.perf_counter()
+        storage.ingest_articles(articles, batch_size=batch_size, refresh_rollups=False)
+        storage.refresh_rollups()
+        results[f"ingest_articles (batch {batch_size}, WAL, one rollup refresh)"] = n_articles / (time.perf_counter() - start)
+        assert storage.check_rollups()
+    storage.connect()
+
+    print(f"## Ingest of {n_articles} articles x {n_authors} authors")
+    for name, rate in results.items():
+        print(f"# {name}: {rate:.1f} articles/sec")
+    return results
+
+SAMPLE_MEDLINE_RECORD = '''PMID- {pmid}
+OWN - NLM
+STAT- MEDLINE
+DP  - 2024 Jun 1
+TI  - Synthetic record {pmid}: a title long enough to wrap onto a continuation line
+      like most real titles do.
+PG  - 1-12
+LID - 10.1016/j.cell.{pmid} [doi]
+AB  - Background sentence of the abstract that goes on for a while and keeps going so
+      that the record has the usual couple of continuation lines. Methods sentence.
+      Results sentence with numbers 1.2 (95% CI 0.9-1.5). Conclusion sentence.
+CI  - Copyright (c) 2024. Published by Elsevier Inc.
+FAU - Doe, Jane
+AU  - Doe J
+AD  - Department of Medicine, David Geffen School of Medicine, University of California,
+      Los Angeles, CA, USA.
+AD  - Department of Epidemiology, Fielding School of Public Health, Los Angeles, CA, USA.
+FAU - Roe, Richard
+AU  - Roe R
+AD  - Department of Metabolism, Digestion and Reproduction, Imperial College London,
+      London, UK.
+FAU - Smith, Ann
+AU  - Smith A
+LA  - eng
+PT  - Journal Article
+JT  - Cell
+JID - 0413066
+'''
+
+# Records/sec and MB/sec of the streaming MEDLINE parser over a dump file
+# (a synthetic one of n_records records when no path is given)
+def bench_medline(path=None, n_records=50000):
+    with tempfile.TemporaryDirectory() as directory:
+        if path is None:
+            path = os.path.join(directory, "dump.medline")
+            with open(path, "w") as f:
+                for pmid in range(n_records):
+                    f.write(SAMPLE_MEDLINE_RECORD.format(pmid=pmid) + "\n")
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            count = sum(1 for _ in medline.parse(f))
+        elapsed = time.perf_counter() - start
+    print(f"## MEDLINE parse of {count} records ({size / 1e6:.1f} MB)")
+    print(f"# {count / elapsed:.0f} records/sec, {size / 1e6 / elapsed:.1f} MB/sec")
+    return count / elapsed
+
+# Full-scan radius query, as get_departments_within_radius was before the R*Tree
+def scan_departments_within_radius(center_lat, center_lon, radius):
+    return {name: (lat, lon) for _, name, lat, lon in storage.retrieve_all_departments()
+            if storage.haversine(center_lat, center_lon, lat, lon) <= radius}
+
+# Radius and k-nearest queries over n_departments random departments: full scan against the R*Tree
+def bench_radius(n_departments=50000, n_queries=200, radius=100.0):
+    n_departments, n_queries, radius = int(n_departments), int(n_queries), float(radius)
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        _fresh_database(directory, "radius.db")
+        storage.ingest_articles([{
+            "articleTitle": "Departments", "journalTitle": None, "datePublished": None, "abstract": None,
+            "authorsList": ["Author"] * n_departments,
+            "departmentList": [[f"Department {i}", [rng.uniform(-60, 70), rng.uniform(-180, 180)]]
+                               for i in range(n_departments)]
+        }])
+        centers = [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(n_queries)]
+        results = {}
+        for name, query in [("full scan", scan_departments_within_radius),
+                            ("R*Tree", storage.get_departments_within_radius)]:
+            start = time.perf_counter()
+            for lat, lon in centers:
+                query(lat, lon, radius)
+            results[name] = (time.perf_counter() - start) / n_queries * 1e3
+        start = time.perf_counter()
+        for lat, lon in centers:
+            storage.get_nearest_departments(lat, lon, 10)
+        results["R*Tree 10 nearest"] = (time.perf_counter() - start) / n_queries * 1e3
+    storage.connect()
+
+    print(f"## Radius queries ({radius:.0f} km) over {n_departments} departments")
+    for name, milliseconds in results.items():
+        print(f"# {name}: {milliseconds:.2f} ms/query")
+    return results
+
+# Scalar storage.haversine loops against the NumPy kernels: one-to-many distances, all pairs within
+# threshold km (blocked, float64 and float32) and the notebook proximity merge
+def bench_distance(n_points=5000, threshold=1.0):
+    n_points, threshold = int(n_points), float(threshold)
+    rng = np.random.default_rng(0)
+    lats, lons = rng.uniform(-60, 70, n_points), rng.uniform(-180, 180, n_points)
+    results = {}
+
+    start = time.perf_counter()
+    scalar = [storage.haversine(lats[0], lons[0], lat, lon) for lat, lon in zip(lats, lons)]
+    results["one-to-many, scalar"] = time.perf_counter() - start
+    start = time.perf_counter()
+    vectorized = geodistance.haversine_many(lats[0], lons[0], lats, lons)
+    results["one-to-many, NumPy"] = time.perf_counter() - start
+    assert np.allclose(scalar, vectorized)
+
+    # the scalar all-pairs loop is quadratic in Python, time it on a sample and extrapolate
+    sample = min(n_points, 1000)
+    start = time.perf_counter()
+    for i in range(sample):
+        for j in range(i + 1, sample):
+            storage.haversine(lats[i], lons[i], lats[j], lons[j])
+    results["all pairs, scalar (extrapolated)"] = (time.perf_counter() - start) * (n_points / sample) ** 2
+    for dtype in (np.float64, np.float32):
+        start = time.perf_counter()
+        pairs = geodistance.pairs_within(lats, lons, threshold, dtype=dtype)
+        results[f"all pairs, blocked {np.dtype(dtype).name}"] = time.perf_counter() - start
+
+    departments = [(i, f"Department {i}", float(lat), float(lon)) for i, (lat, lon) in enumerate(zip(lats, lons))]
+    start = time.perf_counter()
+    merged = geodistance.merge_departments_by_proximity(departments, threshold)
+    results["proximity merge, k-d tree"] = time.perf_counter() - start
+
+    # collaboration distances: the notebooks' per-edge haversine package loop against geodistance.edge_lengths
+    from haversine import haversine
+    G = nx.gnm_random_graph(n_points, 4 * n_points, seed=0)
+    for i in G:
+        G.nodes[i]['lat'], G.nodes[i]['lon'] = float(lats[i]), float(lons[i])
+    start = time.perf_counter()
+    loop_lengths = [haversine((G.nodes[u]['lat'], G.nodes[u]['lon']), (G.nodes[v]['lat'], G.nodes[v]['lon'])) for u, v in G.edges()]
+    results["edge lengths, haversine package loop"] = time.perf_counter() - start
+    start = time.perf_counter()
+    lengths = geodistance.edge_lengths(G)
+    stats = geodistance.edge_length_stats(lengths)
+    results["edge lengths + stats, NumPy"] = time.perf_counter() - start
+    # the package uses the mean Earth radius 6371.0088 km, EARTH_RADIUS is 6371
+    assert np.allclose(loop_lengths, lengths, rtol=1e-5)
+    assert np.isclose(stats["mean_km"], np.mean(loop_lengths), rtol=1e-5)
+
+    print(f"## Distances over {n_points} points ({len(pairs[0])} pairs within {threshold} km, {len(merged)} merged groups, "
+          f"{G.number_of_edges()} edges of mean length {stats['mean_km']:.0f} km)")
+    for name, seconds in results.items():
+        print(f"# {name}: {seconds * 1e3:.2f} ms")
+    return results
+
+# The notebook's proximity merge with its inner loop vectorized: each unvisited department absorbs every
+# later unvisited one within distance_threshold km, quadratic in the number of departments
+def rowwise_merge_departments_by_proximity(departments, distance_threshold=1.0):
+    lats = np.array([dept[2] for dept in departments])
+    lons = np.array([dept[3] for dept in departments])
+    visited = np.zeros(len(departments), dtype=bool)
+    merged_departments = []
+    for i, dept in enumerate(departments):
+        if visited[i]:
+            continue
+        later = np.arange(i, len(departments))[~visited[i:]]
+        members = later[geodistance.haversine_many(lats[i], lons[i], lats[later], lons[later]) <= distance_threshold]
+        visited[members] = True
+        merged_departments.append((dept[1], dept[2], dept[3], [departments[m][0] for m in members]))
+    return merged_departments
+
+# Site assignment over n_departments departments scattered around n_cities city centres: the row-wise
+# merge (timed on a sample and extrapolated) against k-d tree clustering and a full storage.assign_sites
+def bench_sites(n_departments=100000, n_cities=5000, distance_threshold=1.0):
+    n_departments, n_cities, distance_threshold = int(n_departments), int(n_cities), float(distance_threshold)
+    rng = np.random.default_rng(0)
+    centres = np.column_stack((rng.uniform(-60, 70, n_cities), rng.uniform(-180, 180, n_cities)))
+    # departments within a few km of their city centre
+    points = centres[rng.integers(0, n_cities, n_departments)] + rng.normal(0, 0.02, (n_departments, 2))
+    departments = [(i, f"Department {i}", float(lat), float(lon)) for i, (lat, lon) in enumerate(points)]
+    results = {}
+
+    sample = min(n_departments, 10000)
+    start = time.perf_counter()
+    rowwise_merge_departments_by_proximity(departments[:sample], distance_threshold)
+    results["row-wise merge (extrapolated)"] = (time.perf_counter() - start) * (n_departments / sample) ** 2
+    start = time.perf_counter()
+    labels = geodistance.cluster_by_proximity(points[:, 0], points[:, 1], distance_threshold)
+    results["k-d tree clustering"] = time.perf_counter() - start
+    start = time.perf_counter()
+    geodistance.merge_departments_by_proximity(departments, distance_threshold)
+    results["merge_departments_by_proximity"] = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        _fresh_database(directory, "sites.db")
+        storage.ingest_articles([{
+            "articleTitle": "Departments", "journalTitle": None, "datePublished": None, "abstract": None,
+            "authorsList": ["Author"] * n_departments,
+            "departmentList": [[name, [lat, lon]] for _, name, lat, lon in departments]
+        }])
+        start = time.perf_counter()
+        storage.assign_sites(distance_threshold)
+        results["storage.assign_sites"] = time.perf_counter() - start
+    storage.connect()
+
+    print(f"## Sites of {n_departments} departments ({labels.max() + 1} sites within {distance_threshold} km)")
+    for name, seconds in results.items():
+        print(f"# {name}: {seconds:.2f} s")
+    return results
+
+# create_graph as it was before storage.get_edges: one link row per article and direction, merged in Python
+def legacy_create_graph(departments, article_dept_links):
+    G = nx.Graph()
+    for dept_id, name, lat, lon in departments:
+        G.add_node(dept_id, name=name, lat=lat, lon=lon)
+    for dept1_id, dept2_id, article_id, journal_title in article_dept_links:
+        if G.has_edge(dept1_id, dept2_id):
+            G[dept1_id][dept2_id]['weight'] += 1
+            G[dept1_id][dept2_id]['articles'].append((article_id, journal_title))
+        else:
+            G.add_edge(dept1_id, dept2_id, weight=1, articles=[(article_id, journal_title)])
+    return G
+
+# Department graph of n_articles synthetic articles: Python-side link merging against SQL-aggregated edges
+def bench_graph(n_articles=2000, n_authors=30):
+    n_articles, n_authors = int(n_articles), int(n_authors)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        _fresh_database(directory, "graph.db")
+        storage.ingest_articles([make_article(i, n_authors) for i in range(n_articles)])
+        start = time.perf_counter()
+        links = storage.get_article_department_links()
+        legacy = legacy_create_graph(storage.retrieve_all_departments(), links)
+        results["links + has_edge loop"] = time.perf_counter() - start
+        start = time.perf_counter()
+        G = network.load_graph()
+        results["get_edges + add_weighted_edges_from"] = time.perf_counter() - start
+        assert G.number_of_edges() == legacy.number_of_edges()
+    storage.connect()
+
+    print(f"## Graph of {n_articles} articles ({len(links)} link rows, {G.number_of_edges()} edges)")
+    for name, seconds in results.items():
+        print(f"# {name}: {seconds:.2f} s")
+    return results
+
+# Articles of a random co-authorship network: n_articles articles with 2 to max_departments of
+# n_departments departments each
+def make_network_articles(n_departments, n_articles, seed=0, max_departments=12, start=0):
+    rng = random.Random(seed)
+    articles = []
+    for i in range(start, start + n_articles):
+        departments = rng.sample(range(n_departments), rng.randint(2, max_departments))
+        articles.append({
+            "articleTitle": f"Synthetic article {i}", "journalTitle": f"Journal {i % 5}", "datePublished": None,
+            "abstract": None, "authorsList": [f"Author {d}" for d in departments],
+            "departmentList": [[f"Department {d}", [0.0, 0.0]] for d in departments]
+        })
+    return articles
+
+# Degree, eigenvector centrality and weighted clustering of a random network of n_departments departments and
+# n_articles articles: NetworkX graph against the sparse incidence backend
+def bench_sparse(n_departments=5000, n_articles=20000):
+    n_departments, n_articles = int(n_departments), int(n_articles)
+    articles = make_network_articles(n_departments, n_articles)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        _fresh_database(directory, "sparse.db")
+        storage.ingest_articles(articles)
+
+        start = time.perf_counter()
+        G = network.load_graph()
+        results["NetworkX load"] = time.perf_counter() - start
+        start = time.perf_counter()
+        dict(G.degree(weight="weight"))
+        nx.eigenvector_centrality(G, weight="weight", max_iter=500)
+        nx.average_clustering(G, weight="weight")
+        results["NetworkX metrics"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        net = sparsenetwork.load_network()
+        A = net.adjacency()
+        results["sparse load"] = time.perf_counter() - start
+        start = time.perf_counter()
+        sparsenetwork.weighted_degree(A)
+        sparsenetwork.eigenvector_centrality(A)
+        sparsenetwork.average_clustering(A, weighted=True)
+        results["sparse metrics"] = time.perf_counter() - start
+        start = time.perf_counter()
+        sparsenetwork.weighted_degree(net.adjacency(["Journal 0"]))
+        results["sparse journal slice"] = time.perf_counter() - start
+    storage.connect()
+
+    print(f"## Network of {n_departments} departments, {n_articles} articles ({G.number_of_edges()} edges)")
+    for name, seconds in results.items():
+        print(f"# {name}: {seconds:.2f} s")
+    return results
+
+# Every metric of network.calculate_graph_metrics under the exact and the fast profile
+def bench_metrics(n_departments=1000, n_articles=1000):
+    n_departments, n_articles = int(n_departments), int(n_articles)
+    with tempfile.TemporaryDirectory() as directory:
+        _fresh_database(directory, "metrics.db")
+        storage.ingest_articles(make_network_articles(n_departments, n_articles))
+        G = network.load_graph()
+    storage.connect()
+
+    print(f"## Graph metrics of {G}")
+    results, closeness = {}, {}
+    for profile in network.PROFILES:
+        print(f"# profile {profile}")
+        metrics = network.calculate_graph_metrics(G, profile=profile)
+        network.print_metric_runtimes(metrics)
+        results[profile] = metrics["Runtimes"]
+        closeness[profile] = metrics["Closeness centrality"]
+    exact, fast = closeness["exact"], closeness["fast"]
+    if all(fast[node] is not None for node in G):
+        error = max(abs(fast[node] - exact[node]) / exact[node] for node in G if exact[node])
+        print(f"# fast closeness ({network.CLOSENESS_PIVOTS} pivots per component): max relative error {error:.1%}")
+    return results
+
+# Speedup of the process pool mode of calculate_graph_metrics with the number of workers, on a random
+# weighted graph as large as the department graph of pubmed.db (1238 departments, 7599 edges)
+def bench_parallel(n_nodes=1238, n_edges=7599, profile="exact"):
+    n_nodes, n_edges = int(n_nodes), int(n_edges)
+    rng = random.Random(0)
+    G = nx.gnm_random_graph(n_nodes, n_edges, seed=0)
+    for u, v in G.edges():
+        G[u][v]["weight"] = rng.randint(1, 5)
+    metrics = ["degree", "betweenness", "closeness", "eigenvector"]
+    # cores this process may run on, which can be fewer than the machine has
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    counts = sorted({1, 2, 4, 8, cores})
+    results = {}
+    for workers in counts:
+        results[workers] = network.calculate_graph_metrics(G, profile=profile, metrics=metrics, workers=workers)["Elapsed"]
+
+    print(f"## Centralities of {G} ({profile} profile, {cores} usable cores)")
+    if cores == 1:
+        print("# Only one core: these numbers show the pool overhead, not scaling. Run on a multi-core machine for the speedup curve.")
+    for workers, seconds in results.items():
+        note = f" (more workers than the {cores} cores, no speedup possible)" if workers > cores else ""
+        print(f"# {workers} workers: {seconds:.2f} s, speedup {results[1] / seconds:.2f}x{note}")
+    return results
+
+# A daily crawl's worth of new articles on top of an existing network: incremental.update_graph_metrics
+# against rebuilding the graph and all exact metrics
+def bench_incremental(n_departments=20000, n_articles=3000, n_new=20):
+    n_departments, n_articles, n_new = int(n_departments), int(n_articles), int(n_new)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        _fresh_database(directory, "incremental.db")
+        state_path = os.path.join(directory, "state.pickle")
+        storage.ingest_articles(make_network_articles(n_departments, n_articles, max_departments=4))
+        start = time.perf_counter()
+        incremental.update_graph_metrics(path=state_path)
+        results["initial full build"] = time.perf_counter() - start
+
+        storage.ingest_articles(make_network_articles(n_departments, n_new, seed=1, max_departments=4, start=n_articles))
+        start = time.perf_counter()
+        G, metrics, report = incremental.update_graph_metrics(path=state_path)
+        results["incremental update"] = time.perf_counter() - start
+        start = time.perf_counter()
+        network.calculate_graph_metrics(network.load_graph(), "exact")
+        results["full recompute"] = time.perf_counter() - start
+        incremental.check_consistency(G, metrics)
+    storage.connect()
+
+    print(f"## {n_new} new articles on {G} ({report['affected_nodes']} nodes in affected components)")
+    for name, seconds in results.items():
+        print(f"# {name}: {seconds:.2f} s")
+    return results
+
+# export_graph_to_geojson_by_journal before streaming: every journal's features in memory, one
+# get_edge_articles query per edge, written with indent=4
+def legacy_export_graph_to_geojson_by_journal(G, metrics):
+    journal_features = {}
+    for node_id, data in G.nodes(data=True):
+        feature = keplerglexport._node_feature(G, node_id, metrics)
+        node_journals = set()
+        for neighbor in G.neighbors(node_id):
+            node_journals.update(G[node_id][neighbor]['journals'])
+        for journal_title in node_journals:
+            journal_features.setdefault(journal_title, {"nodes": [], "edges": []})["nodes"].append(feature)
+    for source, target, data in G.edges(data=True):
+        edge_feature = keplerglexport._edge_feature(G, source, target, network.edge_articles(G, source, target))
+        for journal_title in data['journals']:
+            journal_features.setdefault(journal_title, {"nodes": [], "edges": []})["edges"].append(edge_feature)
+    for journal_title, features in journal_features.items():
+        with open(keplerglexport.journal_file_name(journal_title), "w") as f:
+            json.dump({"type": "FeatureCollection", "features": features["nodes"] + features["edges"]}, f, indent=4)
+
+def _directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+def _read_features(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        if ".geojsonl" in path:
+            return [json.loads(line) for line in f]
+        return json.load(f)["features"]
+
+# Per-journal GeoJSON export of the current pubmed.db graph (metrics from the GraphMetrics cache)
+def bench_geojson(level="department"):
+    import shutil
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # the metrics cache is written, keep that out of pubmed.db
+        shutil.copy(storage.DB_PATH, os.path.join(directory, "geojson.db"))
+        storage.connect(os.path.join(directory, "geojson.db"))
+        storage.instantiate()
+        G = network.load_graph(level)
+        metrics = network.cached_graph_metrics(level, metrics=keplerglexport.NODE_METRICS, G=G)
+        legacy_directory = os.path.join(directory, "legacy")
+        os.mkdir(legacy_directory)
+        cwd = os.getcwd()
+        os.chdir(legacy_directory)
+        try:
+            start = time.perf_counter()
+            legacy_export_graph_to_geojson_by_journal(G, metrics)
+            results["legacy, indent=4"] = (time.perf_counter() - start, _directory_size(legacy_directory))
+        finally:
+            os.chdir(cwd)
+        for fmt, compress in [("geojson", False), ("ndjson", False), ("geojson", True)]:
+            out = os.path.join(directory, f"{fmt}{'_gz' if compress else ''}")
+            os.mkdir(out)
+            start = time.perf_counter()
+            files = keplerglexport.export_graph_to_geojson_by_journal(G, metrics, fmt, compress, out)
+            results[f"streaming {fmt}{' + gzip' if compress else ''}"] = (time.perf_counter() - start, _directory_size(out))
+            for journal_title, path in files.items():
+                legacy = _read_features(os.path.join(legacy_directory, keplerglexport.journal_file_name(journal_title)))
+                ours = _read_features(path)
+                key = lambda feature: json.dumps(feature, sort_keys=True)
+                assert len(ours) == len({key(feature) for feature in ours})
+                assert sorted(map(key, ours)) == sorted({key(feature) for feature in legacy}), journal_title
+    storage.connect()
+
+    print(f"## GeoJSON export of {G} into {len(files)} journal files")
+    for name, (seconds, size) in results.items():
+        print(f"# {name}: {seconds:.2f} s, {size / 1e6:.2f} MB")
+    return results
+
+# folium map of the current pubmed.db graph, detailed (analysis.create_map) against bundled (bundledmap).
+# There is no browser here, so the Leaflet objects the page creates on load stand in for its render time.
+def bench_map(level="site"):
+    import shutil
+    import bundledmap
+    from analysis import create_map
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # assign_sites and the metrics cache write to the database, keep that out of pubmed.db
+        shutil.copy(storage.DB_PATH, os.path.join(directory, "map.db"))
+        storage.connect(os.path.join(directory, "map.db"))
+        storage.instantiate()
+        if level == "site":
+            storage.assign_sites()
+        G = network.load_graph(level)
+        metrics = network.cached_graph_metrics(level, G=G)
+        for name, create in [("detailed", create_map), ("bundled", bundledmap.create_bundled_map)]:
+            path = os.path.join(directory, f"{name}.html")
+            start = time.perf_counter()
+            create(G, metrics).save(path)
+            seconds = time.perf_counter() - start
+            with open(path) as f:
+                html = f.read()
+            objects = html.count("L.marker(") + html.count("L.polyline(")
+            if name == "bundled":
+                bands = bundledmap.bundled_bands(G, metrics)
+                objects = {f"{band['minZoom']}-{band['maxZoom']}": len(band["features"]) for band in bands}
+            results[name] = (seconds, len(html), objects)
+    storage.connect()
+
+    print(f"## Map of {G} (level {level})")
+    for name, (seconds, size, objects) in results.items():
+        print(f"# {name}: {seconds:.2f} s, {size / 1e6:.2f} MB, Leaflet objects {objects}")
+    return results
+
+# Synthetic country borders: a grid of cells over the globe, each border densified to about vertices
+# points like a real coastline, every fifth country a MultiPolygon with an island next to it
+def make_countries_geojson(path, n_lat=10, n_lon=25, vertices=400):
+    import shapely
+    from shapely.geometry import box, mapping, MultiPolygon
+    features = []
+    lat_step, lon_step = 180 / n_lat, 360 / n_lon
+    for i in range(n_lat):
+        for j in range(n_lon):
+            cell = box(-180 + j * lon_step, -90 + i * lat_step, -180 + (j + 1) * lon_step, -90 + (i + 1) * lat_step)
+            polygon = shapely.segmentize(cell, 2 * (lat_step + lon_step) / vertices)
+            if (i * n_lon + j) % 5 == 0:
+                polygon = MultiPolygon([polygon, shapely.segmentize(box(cell.bounds[0], cell.bounds[1], cell.bounds[0] + 0.1, cell.bounds[1] + 0.1), 0.01)])
+            features.append({"type": "Feature", "properties": {"COUNTRY": f"C{i:02d}{j:02d}"}, "geometry": mapping(polygon)})
+    with open(path, "w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+# get_country_from_point of the notebooks: every country polygon rebuilt and tested on every lookup
+def linear_country_from_point(lat, lon, countries_geojson):
+    from shapely.geometry import shape, Point
+    point = Point(lon, lat)
+    for feature in countries_geojson['features']:
+        polygon = shape(feature['geometry'])
+        if polygon.contains(point):
+            return feature['properties']['COUNTRY']
+    return None
+
+# Country assignment of the departments of pubmed.db (a scratch copy) against synthetic borders, and the
+# per-country article counts of the notebook loop against storage.count_articles_by_country
+def bench_countries(n_lat=10, n_lon=25, vertices=400):
+    n_lat, n_lon, vertices = int(n_lat), int(n_lon), int(vertices)
+    import shutil
+    import countries
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "countries.geojson")
+        make_countries_geojson(path, n_lat, n_lon, vertices)
+        shutil.copy(storage.DB_PATH, os.path.join(directory, "countries.db"))
+        storage.connect(os.path.join(directory, "countries.db"))
+        storage.instantiate()
+        departments = storage.retrieve_all_departments()
+        with open(path) as f:
+            countries_geojson = json.load(f)
+
+        start = time.perf_counter()
+        legacy = {dept[0]: linear_country_from_point(dept[2], dept[3], countries_geojson) for dept in departments}
+        results["linear scan, shape() per lookup"] = time.perf_counter() - start
+        start = time.perf_counter()
+        storage.assign_countries(path, refresh=True)
+        results["STRtree bulk assign_countries (load + index + store)"] = time.perf_counter() - start
+        start = time.perf_counter()
+        storage.assign_countries(path, refresh=True)
+        results["STRtree bulk assign_countries (indexed)"] = time.perf_counter() - start
+        storage.cursor.execute('SELECT department_id, country_code FROM Departments')
+        assigned = dict(storage.cursor.fetchall())
+        for dept in departments:
+            if not (dept[2] == 0 and dept[3] == 0):
+                assert assigned[dept[0]] == legacy[dept[0]], dept
+
+        start = time.perf_counter()
+        loop_counts = {}
+        for dept in departments:
+            country = assigned.get(dept[0])
+            if country:
+                loop_counts.setdefault(country, set()).update(article[0] for article in storage.retrieve_articles_by_department(dept[0]))
+        results["articles per country, notebook loop"] = time.perf_counter() - start
+        start = time.perf_counter()
+        counts = storage.count_articles_by_country()
+        results["articles per country, GROUP BY"] = time.perf_counter() - start
+        assert dict(counts) == {country: len(articles) for country, articles in loop_counts.items()}
+        start = time.perf_counter()
+        storage.count_country_collaborations()
+        results["international collaborations, GROUP BY"] = time.perf_counter() - start
+    storage.connect()
+
+    print(f"## Countries of {len(departments)} departments in {n_lat * n_lon} countries of ~{vertices} vertices")
+    for name, seconds in results.items():
+        print(f"# {name}: {seconds:.3f} s")
+    return results
+
+# Articles co-authored by departments already in the database, drawn from their names
+def make_existing_department_articles(n_articles, seed=0, start=0):
+    rng = random.Random(seed)
+    departments = storage.retrieve_all_departments()
+    articles = []
+    for i in range(start, start + n_articles):
+        chosen = rng.sample(departments, rng.randint(2, 8))
+        articles.append({
+            "articleTitle": f"Synthetic article {i}", "journalTitle": rng.choice(["Cell", "The lancet. HIV", None]),
+            "datePublished": None, "abstract": None, "authorsList": [f"Author {i}-{j}" for j in range(len(chosen))],
+            "departmentList": [[dept[1], [dept[2], dept[3]]] for dept in chosen]
+        })
+    return articles
+
+# The notebooks' dashboards computed from get_article_department_links against the rollup tables, on a
+# scratch copy of pubmed.db, and the cost of keeping the rollups current while ingesting
+def bench_rollups(n_new=500):
+    n_new = int(n_new)
+    import shutil
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy(storage.DB_PATH, os.path.join(directory, "rollups.db"))
+        storage.connect(os.path.join(directory, "rollups.db"))
+        start = time.perf_counter()
+        storage.instantiate()
+        results["migrate, rollups built from scratch"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        departments = storage.retrieve_all_departments()
+        links = storage.get_article_department_links()
+        connections = {dept[0]: 0 for dept in departments}
+        for dept1_id, dept2_id, _, _ in links:
+            connections[dept1_id] += 1
+            connections[dept2_id] += 1
+        ranked = sorted(((dept[0], dept[1], connections[dept[0]]) for dept in departments), key=lambda x: x[2], reverse=True)
+        results["prevalence ranking, notebook loop"] = time.perf_counter() - start
+        start = time.perf_counter()
+        ranking = storage.rank_departments_by_prevalence()
+        results["prevalence ranking, rollup"] = time.perf_counter() - start
+        start = time.perf_counter()
+        storage.rank_departments_by_prevalence(10)
+        results["top 10 departments, rollup"] = time.perf_counter() - start
+        start = time.perf_counter()
+        storage.get_department_intensities()
+        results["heatmap intensities, rollup"] = time.perf_counter() - start
+        assert {row[0]: 2 * row[3] for row in ranking if row[3]} == {dept_id: count for dept_id, _, count in ranked if count}
+
+        start = time.perf_counter()
+        layers = {}
+        for _, _, article_id, journal_title in storage.get_article_department_links():
+            layers.setdefault(journal_title, set()).add(article_id)
+        results["journal layers, notebook loop"] = time.perf_counter() - start
+        start = time.perf_counter()
+        for journal_title, _ in storage.get_journal_department_counts():
+            storage.get_journal_departments(journal_title)
+        results["journal layers, rollup"] = time.perf_counter() - start
+
+        articles = make_existing_department_articles(n_new, seed=1)
+        start = time.perf_counter()
+        storage.ingest_articles(articles[:n_new // 2], refresh_rollups=False)
+        results[f"ingest {n_new // 2} articles without rollups"] = time.perf_counter() - start
+        start = time.perf_counter()
+        storage.refresh_rollups()
+        results["catch-up refresh"] = time.perf_counter() - start
+        start = time.perf_counter()
+        storage.ingest_articles(articles[n_new // 2:])
+        results[f"ingest {n_new - n_new // 2} articles with rollups"] = time.perf_counter() - start
+        storage.check_rollups()
+        storage.cursor.execute('BEGIN IMMEDIATE')
+        start = time.perf_counter()
+        storage._rebuild_rollups()
+        results["full rebuild"] = time.perf_counter() - start
+        storage.conn.rollback()
+    storage.connect()
+
+    print(f"## Rollups of pubmed.db ({len(links)} link rows), {n_new} articles ingested")
+    for name, seconds in results.items():
+        print(f"# {name}: {seconds * 1000:.1f} ms")
+    return results
+
+# create_heatmap of the notebooks: connections counted over every link row, one weighted point per department
+def legacy_create_heatmap(departments, article_dept_links):
+    import folium
+    from folium.plugins import HeatMap
+    folium_map = folium.Map(location=[0, 0], zoom_start=2)
+    dept_connections = {dept[0]: 0 for dept in departments}
+    for dept1_id, dept2_id, _, _ in article_dept_links:
+        dept_connections[dept1_id] += 1
+        dept_connections[dept2_id] += 1
+    heat_data = [[dept[2], dept[3], dept_connections[dept[0]]] for dept in departments if dept[2] != 0.0 and dept[3] != 0.0]
+    HeatMap(heat_data, max_zoom=15).add_to(folium_map)
+    return folium_map
+
+def _html_size(folium_map):
+    return len(folium_map.get_root().render())
+
+# Heatmaps of pubmed.db (a scratch copy): the notebook's per-department points against the binned grid,
+# cold and from the per-process cache, then the binning alone on n_points synthetic departments
+def bench_heatmap(n_points=1000000, cell_size=1.0):
+    n_points, cell_size = int(n_points), float(cell_size)
+    import shutil
+    import heatmap
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy(storage.DB_PATH, os.path.join(directory, "heatmap.db"))
+        storage.connect(os.path.join(directory, "heatmap.db"))
+        storage.instantiate()
+        start = time.perf_counter()
+        legacy = legacy_create_heatmap(storage.retrieve_all_departments(), storage.get_article_department_links())
+        results["notebook create_heatmap"] = (time.perf_counter() - start, _html_size(legacy))
+        for grid in ("hex", "latlon"):
+            for run in ("cold", "cached"):
+                start = time.perf_counter()
+                binned = heatmap.create_heatmap(grid=grid, cell_size=cell_size)
+                results[f"{grid} grid, {run}"] = (time.perf_counter() - start, _html_size(binned))
+        start = time.perf_counter()
+        heatmap.create_heatmap("Cell", (20240701, 20240831), cell_size=cell_size)
+        results["hex grid, Cell Jul-Aug 2024, cold"] = (time.perf_counter() - start, None)
+    storage.connect()
+
+    rng = np.random.default_rng(0)
+    lats, lons = rng.uniform(-60, 70, n_points), rng.uniform(-180, 180, n_points)
+    weights = rng.integers(1, 100, n_points)
+    for grid in ("hex", "latlon"):
+        start = time.perf_counter()
+        cell_lats, _, _ = heatmap.bin_points(lats, lons, weights, cell_size, grid)
+        results[f"bin {n_points} points, {grid} ({len(cell_lats)} cells)"] = (time.perf_counter() - start, None)
+
+    print(f"## Heatmaps, {cell_size} degree cells")
+    for name, (seconds, size) in results.items():
+        print(f"# {name}: {seconds * 1000:.1f} ms" + (f", {size / 1e3:.0f} kB" if size else ""))
+    return results
+
+# Year-over-year metrics: every window rebuilt with network.load_graph(level, window) and computed from
+# scratch, against incremental.sliding_window_metrics, on n_articles articles spread over n_years years
+# (windows of `years` years, one per year) and on the monthly windows of pubmed.db (a scratch copy)
+def bench_windows(n_departments=3000, n_articles=2000, n_years=10, years=2):
+    n_departments, n_articles, n_years, years = int(n_departments), int(n_articles), int(n_years), int(years)
+    import shutil
+    metrics = ["degree", "betweenness", "closeness", "eigenvector", "clustering"]
+    results = {}
+
+    def compare(name, windows):
+        start = time.perf_counter()
+        rebuilt = [network.calculate_graph_metrics(network.load_graph('department', window), "exact", metrics)
+                   for window in windows]
+        results[f"{name}: rebuild every window"] = time.perf_counter() - start
+        start = time.perf_counter()
+        series = incremental.sliding_window_metrics(windows, metrics=metrics)
+        results[f"{name}: sliding windows"] = time.perf_counter() - start
+        for fresh, (_, ours) in zip(rebuilt, series):
+            for key in ("Betweenness centrality", "Closeness centrality", "Eigenvector centrality"):
+                assert max(abs(fresh[key][node] - ours[key][node]) for node in fresh[key]) < 1e-9, key
+
+    with tempfile.TemporaryDirectory() as directory:
+        _fresh_database(directory, "windows.db")
+        rng = random.Random(2)
+        articles = make_network_articles(n_departments, n_articles, max_departments=4)
+        for article in articles:
+            article["datePublished"] = f"{2014 + rng.randrange(n_years)} {rng.choice(['Jan', 'Apr', 'Jul', 'Oct'])} {rng.randint(1, 28)}"
+        storage.ingest_articles(articles)
+        windows = incremental.year_windows(2014, 2014 + n_years - 1, years)
+        compare(f"{len(windows)} windows of {years} years", windows)
+
+        shutil.copy(storage.DB_PATH, os.path.join(directory, "pubmed.db"))
+        storage.connect(os.path.join(directory, "pubmed.db"))
+        storage.instantiate()
+        windows = incremental.month_windows((2024, 1), (2024, 9), 3)
+        compare(f"pubmed.db, {len(windows)} windows of 3 months", windows)
+    storage.connect()
+
+    print(f"## Windowed metrics ({', '.join(metrics)})")
+    for name, seconds in results.items():
+        print(f"# {name}: {seconds:.2f} s")
+    return results
+
+BENCHMARKS = {
+    "ingest": bench_ingest,
+    "medline": bench_medline,
+    "radius": bench_radius,
+    "distance": bench_distance,
+    "sites": bench_sites,
+    "graph": bench_graph,
+    "sparse": bench_sparse,
+    "metrics": bench_metrics,
+    "parallel": bench_parallel,
+    "incremental": bench_incremental,
+    "geojson": bench_geojson,
+    "map": bench_map,
+    "countries": bench_countries,
+    "rollups": bench_rollups,
+    "heatmap": bench_heatmap,
+    "windows": bench_windows,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:2] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name](*sys.argv[2:])
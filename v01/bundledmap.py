@@ -0,0 +1,169 @@
+import json
+import numpy as np
+import folium
+from folium.map import Layer
+from branca.element import Template
+
+# Zoom bands of the bundled map as (min zoom, max zoom, grid cell size in degrees). Within a band the
+# departments are merged per grid cell and the edges per pair of cells; None draws every department
+# and every department pair once.
+BUNDLE_LEVELS = [
+    (0, 4, 5.0),
+    (4, 6, 1.0),
+    (6, 8, 0.25),
+    (8, 19, None),
+]
+# Decimals kept of every coordinate, 4 is about 11 m
+COORDINATE_DECIMALS = 4
+
+# Grid cell of every point: returns one label 0..k-1 per point and the mean position and size of every cell
+def grid_cells(lats, lons, cell_size):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if cell_size is None:
+        return np.arange(len(lats)), lats, lons, np.ones(len(lats), dtype=np.int64)
+    keys = np.column_stack((np.floor(lats / cell_size), np.floor(lons / cell_size)))
+    _, labels = np.unique(keys, axis=0, return_inverse=True)
+    labels = labels.ravel()
+    counts = np.bincount(labels)
+    return (labels, np.bincount(labels, weights=lats) / counts, np.bincount(labels, weights=lons) / counts, counts)
+
+# Edges between grid cells: every department pair whose ends fall in two different cells is added to the
+# pair of cells. Returns arrays (cell_a, cell_b, weight, pairs) with cell_a < cell_b, weight being the
+# shared articles summed over the department pairs.
+def bundle_edges(labels, sources, targets, weights):
+    a = labels[sources]
+    b = labels[targets]
+    keep = a != b
+    a, b, weights = np.minimum(a, b)[keep], np.maximum(a, b)[keep], np.asarray(weights, dtype=np.float64)[keep]
+    if len(a) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0), empty
+    n = labels.max() + 1
+    keys, inverse = np.unique(a * n + b, return_inverse=True)
+    return keys // n, keys % n, np.bincount(inverse, weights=weights), np.bincount(inverse)
+
+def _point(lon, lat):
+    return [round(float(lon), COORDINATE_DECIMALS), round(float(lat), COORDINATE_DECIMALS)]
+
+def _metric(metrics, name, node_id):
+    value = metrics.get(name, {}).get(node_id)
+    return round(value, 4) if value is not None else None
+
+# Features of one zoom band: a Point per department (or grid cell) and a LineString per department pair
+# (or pair of cells). Departments carry their metrics and the cliques they are in, cells their size.
+def band_features(G, metrics, cell_size, nodes=None, cliques=None):
+    nodes = list(G) if nodes is None else nodes
+    index = {node_id: i for i, node_id in enumerate(nodes)}
+    lats = np.array([G.nodes[node_id]['lat'] for node_id in nodes], dtype=np.float64)
+    lons = np.array([G.nodes[node_id]['lon'] for node_id in nodes], dtype=np.float64)
+    labels, cell_lats, cell_lons, counts = grid_cells(lats, lons, cell_size)
+
+    edges = list(G.edges(data='weight'))
+    sources = np.array([index[u] for u, _, _ in edges], dtype=np.int64)
+    targets = np.array([index[v] for _, v, _ in edges], dtype=np.int64)
+    weights = np.array([weight for _, _, weight in edges], dtype=np.float64)
+    cell_a, cell_b, cell_weights, pairs = bundle_edges(labels, sources, targets, weights)
+
+    features = []
+    if cell_size is None:
+        cliques = cliques or {}
+        for i, node_id in enumerate(nodes):
+            features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": _point(lons[i], lats[i])},
+                             "properties": {"name": G.nodes[node_id]['name'],
+                                            "degree": _metric(metrics, 'Degree centrality', node_id),
+                                            "betweenness": _metric(metrics, 'Betweenness centrality', node_id),
+                                            "closeness": _metric(metrics, 'Closeness centrality', node_id),
+                                            "eigenvector": _metric(metrics, 'Eigenvector centrality', node_id),
+                                            "cliques": cliques.get(node_id, [])}})
+    else:
+        for label in range(len(counts)):
+            features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": _point(cell_lons[label], cell_lats[label])},
+                             "properties": {"departments": int(counts[label])}})
+    for a, b, weight, n_pairs in zip(cell_a, cell_b, cell_weights, pairs):
+        features.append({"type": "Feature",
+                         "geometry": {"type": "LineString",
+                                      "coordinates": [_point(cell_lons[a], cell_lats[a]), _point(cell_lons[b], cell_lats[b])]},
+                         "properties": {"weight": int(weight), "pairs": int(n_pairs)}})
+    return features
+
+# Every zoom band of BUNDLE_LEVELS as {"minZoom", "maxZoom", "features"}
+def bundled_bands(G, metrics, levels=None):
+    nodes = list(G)
+    cliques = {}
+    for i, clique in enumerate(metrics.get("Cliques", [])):
+        for node_id in clique:
+            cliques.setdefault(node_id, []).append(i + 1)
+    return [{"minZoom": min_zoom, "maxZoom": max_zoom, "features": band_features(G, metrics, cell_size, nodes, cliques)}
+            for min_zoom, max_zoom, cell_size in (BUNDLE_LEVELS if levels is None else levels)]
+
+# One Leaflet GeoJSON layer holding the bands of bundled_bands. On every zoom it swaps in the features of
+# the band of that zoom, so the page carries the geometry once as data and Leaflet only ever draws one band.
+# Line widths grow with the log of the shared articles, popups are built from the properties on click.
+class BundledNetworkLayer(Layer):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_bands = {{ this.data }};
+            var {{ this.get_name() }} = L.geoJSON(null, {
+                // addData also applies style to the circle markers of pointToLayer, only the lines are styled here
+                style: function(feature) {
+                    if (feature.geometry.type === 'Point') {
+                        return {};
+                    }
+                    return {color: 'green', opacity: 0.6, weight: 1 + Math.log2(feature.properties.weight)};
+                },
+                pointToLayer: function(feature, latlng) {
+                    var size = feature.properties.departments || 1;
+                    var cliques = feature.properties.cliques || [];
+                    return L.circleMarker(latlng, {radius: 3 + 2 * Math.log2(size), weight: 1,
+                                                   color: cliques.length ? 'orange' : 'blue', fillOpacity: 0.6});
+                },
+                onEachFeature: function(feature, layer) {
+                    layer.bindPopup(function() {
+                        var p = feature.properties;
+                        if (p.pairs !== undefined) {
+                            return 'Shared articles: ' + p.weight + '<br>{{ this.label }} pairs: ' + p.pairs;
+                        }
+                        if (p.departments !== undefined) {
+                            return '{{ this.label }}s: ' + p.departments;
+                        }
+                        var format = function(value) { return value === null ? 'N/A' : value; };
+                        return '{{ this.label }}: ' + p.name +
+                               '<br>Degree Centrality: ' + format(p.degree) +
+                               '<br>Betweenness Centrality: ' + format(p.betweenness) +
+                               '<br>Closeness Centrality: ' + format(p.closeness) +
+                               '<br>Eigenvector Centrality: ' + format(p.eigenvector) +
+                               (p.cliques.length ? '<br>Cliques: ' + p.cliques.join(', ') : '');
+                    });
+                }
+            });
+            function {{ this.get_name() }}_draw() {
+                var zoom = {{ this._parent.get_name() }}.getZoom();
+                {{ this.get_name() }}.clearLayers();
+                {{ this.get_name() }}_bands.forEach(function(band) {
+                    if (band.minZoom <= zoom && zoom < band.maxZoom) {
+                        {{ this.get_name() }}.addData(band.features);
+                    }
+                });
+            }
+            {{ this._parent.get_name() }}.on('zoomend', {{ this.get_name() }}_draw);
+            {{ this.get_name() }}_draw();
+        {% endmacro %}
+        """)
+
+    def __init__(self, bands, name=None, overlay=True, control=True, show=True, label="Department"):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "BundledNetworkLayer"
+        # what a node is in the popups, "Department" or "Site"
+        self.label = label
+        # inside a <script> block, a department name must not close it
+        self.data = json.dumps(bands, separators=(',', ':')).replace('</', '<\\/')
+
+# The network of analysis.create_map as a single bundled GeoJSON layer: grid cells and the edges between
+# them when zoomed out, every department and department pair once when zoomed in
+def create_bundled_map(G, metrics, levels=None):
+    m = folium.Map(location=[0, 0], zoom_start=2)
+    BundledNetworkLayer(bundled_bands(G, metrics, levels), name="Co-authorship network",
+                        label=G.graph.get("level", "department").capitalize()).add_to(m)
+    folium.LayerControl().add_to(m)
+    return m
@@ -0,0 +1,42 @@
+import json
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+# Country borders used by the notebooks, one feature per country
+COUNTRIES_PATH = 'worldcountries.geojson'
+# Feature property stored as the country of a department (Departments.country_code)
+COUNTRY_PROPERTY = 'COUNTRY'
+
+# path -> (country codes, prepared geometries, STRtree), every file is read and indexed once per process
+_countries = {}
+
+# The country polygons of a GeoJSON file as (codes, geometries, tree). The geometries are prepared, which
+# makes repeated containment tests against them cheap, and the STRtree narrows every lookup down to the
+# few countries whose bounding box holds the point instead of testing all of them.
+def load_countries(path=COUNTRIES_PATH, country_property=COUNTRY_PROPERTY):
+    key = (path, country_property)
+    if key not in _countries:
+        with open(path) as f:
+            features = json.load(f)['features']
+        codes = np.array([feature['properties'].get(country_property) for feature in features], dtype=object)
+        geometries = np.array([shape(feature['geometry']) for feature in features], dtype=object)
+        shapely.prepare(geometries)
+        _countries[key] = (codes, geometries, shapely.STRtree(geometries))
+    return _countries[key]
+
+# Country of every point in one bulk query, None where no country contains it. Like the notebooks'
+# get_country_from_point, a point on a border is outside, and where countries overlap the one that
+# comes first in the file wins.
+def countries_of_points(lats, lons, path=COUNTRIES_PATH, country_property=COUNTRY_PROPERTY):
+    codes, _, tree = load_countries(path, country_property)
+    points = shapely.points(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+    result = np.full(len(points), None, dtype=object)
+    if len(points) == 0:
+        return result
+    point_index, country_index = tree.query(points, predicate='within')
+    order = np.lexsort((country_index, point_index))
+    point_index, country_index = point_index[order], country_index[order]
+    first = np.r_[True, np.diff(point_index) != 0] if len(point_index) else np.empty(0, dtype=bool)
+    result[point_index[first]] = codes[country_index[first]]
+    return result
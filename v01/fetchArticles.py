@@ -2,67 +2,42 @@ from bs4 import BeautifulSoup
 import requests
 from geopy.geocoders import Nominatim
 import json 
+import os
+from urllib.parse import parse_qs
 # storage library for this project
 import storage 
+# persistent cache of geolocation results
+import geocache
+# offline institution geocoder, tried before Mapbox
+import gazetteer
+# pooled, rate limited and concurrent access to PubMed
+import pubmedfetch
+# streaming MEDLINE record parser
+import medline
+# staged fetch -> parse -> geocode -> store execution
+import pipeline
 
-MAPBOXTOKEN = open("mapbox.txt", "r").read().strip()
+try:
+    MAPBOXTOKEN = open("mapbox.txt", "r").read().strip()
+except FileNotFoundError:
+    MAPBOXTOKEN = None
+MAPBOX_URL = "https://api.mapbox.com/search/geocode/v6/forward"
 #given an article ID number, we request and parse the page. we return a json containing our data.
 def getByArticleID(article_id):
-    url = f'https://pubmed.ncbi.nlm.nih.gov/{article_id}/?format=pubmed'
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    lines = soup.get_text().splitlines()
-    article_info = {
-        "articleTitle": None,
-        "journalTitle": None,
-        "datePublished": None,
-        "abstract": None,
-        "authorsList": [],
-        "departmentList": []
-    }
-
-    flags = {"titleActive": False, "abstractActive": False, "departmentActive": False}
-    for line in lines:
-        if line.startswith("DP"):
-            article_info["datePublished"] = line[2:].replace("-", "").strip()
-        if line.startswith("TI"):
-            article_info["articleTitle"] = line[2:].replace("-", "").strip()
-            flags["titleActive"] = True
-        elif flags["titleActive"]:
-            if line.startswith("PG") or line.startswith("LID"):
-                flags["titleActive"] = False
-            else:
-                article_info["articleTitle"] += " " + line.strip()
-        if line.startswith("JT"):
-            article_info["journalTitle"] = line[2:].replace("-", "").strip()
-        if line.startswith("AB"):
-            article_info["abstract"] = line[2:].replace("-", "").strip()
-            flags["abstractActive"] = True
-        elif flags["abstractActive"]:
-            if line.startswith("CI"):
-                flags["abstractActive"] = False
-            else:
-                article_info["abstract"] += " " + line.replace('\\', "").strip()
-        if line.startswith("FAU"):
-            article_info["authorsList"].append(line[3:].replace("-", "").strip())
-        if line.startswith("AD"):
-            article_info["departmentList"].append(line[2:].replace("-", "").strip())
-            flags["departmentActive"] = True
-        elif flags["departmentActive"]:
-            if line.startswith("FAU") or line.startswith("LA"):
-                flags["departmentActive"] = False
-            else:
-                article_info["departmentList"][-1] += " " + line.strip()
-    try:
-        assert len(article_info["authorsList"]) == len(article_info["departmentList"])
-    except Exception as e:
-        print(len(article_info["authorsList"]))
-        print(len(article_info["departmentList"]))
-        print(article_info["authorsList"])
-        print(article_info['departmentList'])
-        print(url)
-        return(False)
-    return article_info
+    url = pubmedfetch.article_url(article_id)
+    return parseArticlePage(pubmedfetch.get(url), url)
+
+#parse the ?format=pubmed page of an article
+def parseArticlePage(page, url):
+    soup = BeautifulSoup(page, 'html.parser')
+    return parseMedline(soup.get_text().splitlines(), url)
+
+#parse the lines of one MEDLINE record
+def parseMedline(lines, url):
+    for article_info in medline.parse(lines):
+        return article_info
+    print(" ? No MEDLINE record found in ", url)
+    return(False)
 
 #this takes two arguments: the constructed query for the journal and the page number of the results we want to return.
 def getByJournal(journal_query, pagenum):
@@ -70,30 +45,39 @@ def getByJournal(journal_query, pagenum):
         print(f"Assertion Error: A string is required but you passed a: {type(journal_query).__name__}")
         return None
     article_id_list = []
-    base_url = "https://pubmed.ncbi.nlm.nih.gov/"
     
-    response = requests.get(f"{base_url}{journal_query}&page={pagenum}")
-    soup = BeautifulSoup(response.text, 'html.parser')
+    page = pubmedfetch.get(f"{pubmedfetch.PUBMED_URL}{journal_query}&page={pagenum}")
+    soup = BeautifulSoup(page, 'html.parser')
     links = soup.find_all('a', class_='docsum-title')
     for link in links:
         article_id_list.append(link['href'])
     return article_id_list
 
+#the search term of one of our pubmed.ncbi.nlm.nih.gov queries, e.g. '"Cell"[jour]'
+def queryTerm(journal_query):
+    return parse_qs(journal_query.lstrip("?"))["term"][0]
+
 #this takes the string containing the institution and geolocates it, returning a pair of coordinates (latitude, longitude)
+#results are cached in geocache, including lookups that found nothing (retried after geocache.NEGATIVE_TTL)
 def mapboxGeolocate(fuzzloc):
+    cached = geocache.lookup(fuzzloc)
+    if cached is not None:
+        return(cached)
     try:
         #print(">> Accessing Mapbox API: " + fuzzloc)
         location =[]    
-        url = "https://api.mapbox.com/search/geocode/v6/forward?q="+fuzzloc+"&access_token="+MAPBOXTOKEN
-        data = requests.get(url).text
+        data = requests.get(MAPBOX_URL, params={"q": fuzzloc, "access_token": MAPBOXTOKEN}).text
         
         data = json.loads(data)
         
         if 'features' in data.keys():
             # Extract the coordinates
-            coordinates = data['features'][0]['geometry']['coordinates']
-            location = [coordinates[1], coordinates[0]]
+            if len(data['features']) > 0:
+                coordinates = data['features'][0]['geometry']['coordinates']
+                location = [coordinates[1], coordinates[0]]
+            geocache.store(fuzzloc, location)
         else:
+            #API errors (bad token, rate limit) are not cached
             print(data)
         #print(">> Mapbox Query Resulted in: " +str(location))
     except:
@@ -108,6 +92,10 @@ def CleanExtractDepartmentLocation(departmentstring):
         departmentstring = departmentstring.split("Electronic address:")[0]
     if(";" in departmentstring):
         departmentstring = departmentstring.split(";")[0]
+    #known institutions resolve locally, without a Mapbox request
+    latlong = gazetteer.lookup(departmentstring)
+    if latlong is not None:
+        return([departmentstring, latlong])
     try:
         latlong = mapboxGeolocate(departmentstring)
         assert len(latlong)!=0
@@ -155,70 +143,137 @@ def CleanExtractDepartmentLocation(departmentstring):
 
 
 #given a journal query, we 
-# 1. get the ID of every article on the first page of results (most recent)
-# 2. get the 
-def aggregate_by_journalquery(querystr, pages_start, pages_end):
+# 1. get the ID of every article on the requested pages of results (most recent first)
+# 2. skip the articles already stored, fetch, parse and geolocate the rest and store them
+#the crawl state in pubmed.db makes this resumable: pages of a query that were completely stored are
+#not requested again (unless refresh is set, for daily refreshes of the first pages) and PMIDs that
+#are already stored are never fetched again.
+def aggregate_by_journalquery(querystr, pages_start, pages_end, refresh=False):
     if(pages_start == None):
         pages_start = 1
+    if not refresh:
+        pages_start = max(pages_start, storage.get_query_progress(querystr) + 1)
+    if pages_start >= pages_end:
+        print(">>> Pages already collected for ", querystr)
+        return []
 
-    articlesForJournal= []
-    for i in range(pages_start, pages_end):
-        articlesForJournal += getByJournal(querystr, i)
-    
-    bad_count = 0
-    for i in range(0, len(articlesForJournal)): 
-        #using the article ID, get and parse data
-        current_item = getByArticleID(int(articlesForJournal[i].replace("/","")))
-        #check to make sure this is a valid article - some are not correctly formatted nor parseable
-        #this introduces a stipulation into our methods, we are discarding articles which are not formatted. 
-        #create a counter to keep track of this. 
-        if(current_item!=False):
+    if BACKEND == "eutils":
+        #one esearch call for the whole page range, then MEDLINE for EFETCH_BATCH articles per efetch call
+        article_ids = pubmedfetch.esearch(queryTerm(querystr),
+                                          retstart=(pages_start - 1) * PAGE_SIZE,
+                                          retmax=(pages_end - pages_start) * PAGE_SIZE)
+    else:
+        articlesForJournal= []
+        for i in range(pages_start, pages_end):
+            articlesForJournal += getByJournal(querystr, i)
+        article_ids = [int(article_link.replace("/","")) for article_link in articlesForJournal]
 
-        
-            #articleItems = current_item[i]['articleTitle']
-            #these two variables keep track of our author and department insertion IDs so we can tie them to the article
-            authorIDList = []
-            departmentIDList = []
-
-            #insert the article into the database, this returns the article ID
-            #store the current working article ID in the variable article_id
-            #this is necessary for later to match our author
-            article_id = storage.insert_article(current_item['articleTitle'], 
-                                    current_item['journalTitle'],
-                                    current_item['datePublished'],
-                                    current_item['abstract'])
-
-            #for every author in the author list, insert the author
-            #store the ID
-            #print(current_item)
-            
-            for author in current_item['authorsList']:
-                author_id = storage.insert_author(author)
-                authorIDList.append(author_id)
-            #for every department in the department list, insert the department
-            #store the ID
-            for department in current_item['departmentList']:
-                extracted = CleanExtractDepartmentLocation(department)
-                if(extracted[1]!=None):
-                    department_id = storage.insert_department(extracted[0], extracted[1][0], extracted[1][1])
+    stored = storage.stored_pmids(article_ids)
+    article_ids = [article_id for article_id in article_ids if article_id not in stored]
+    print(">>> ", len(stored), " articles already stored, ", len(article_ids), " to collect")
+
+    if PIPELINE:
+        stored_ids = collectPipelined(article_ids)
+        bad_count = len(article_ids) - len(stored_ids)
+    else:
+        stored_ids, bad_count = collectSerial(querystr, article_ids)
+    print(">>> Stored ", len(stored_ids), " articles, discarded ", bad_count)
+    if bad_count == 0:
+        storage.record_query_page(querystr, pages_end - 1)
+    return stored_ids
+
+#fetch, parse, geolocate and store one article after the other, recording the progress of every PMID
+def collectSerial(querystr, article_ids):
+    bad_count = 0
+    if BACKEND == "eutils":
+        def parsed_articles():
+            nonlocal bad_count
+            for batch, text in pubmedfetch.efetch_all(article_ids):
+                if text is None:
+                    bad_count += len(batch)
+                    continue
+                storage.set_pmid_status(batch, 'fetched', querystr)
+                records = list(medline.parse(text))
+                storage.set_pmid_status([record['pmid'] for record in records], 'parsed')
+                yield from records
+    else:
+        #articles are downloaded concurrently (pubmedfetch.WORKERS at a time, rate limited)
+        def parsed_articles():
+            for article_id, page in pubmedfetch.fetch_all(article_ids):
+                if page is not None:
+                    storage.set_pmid_status([article_id], 'fetched', querystr)
+                    current_item = parseArticlePage(page, pubmedfetch.article_url(article_id))
+                    if current_item != False:
+                        storage.set_pmid_status([article_id], 'parsed')
+                    yield current_item
                 else:
-                    department_id = storage.insert_department(extracted[0], 0,0)
-                departmentIDList.append(department_id)
-            
-            #now the identifiers for the authors and departments must be tied to the current article.
-            #we will make use of the  author, article, department database
-            assert len(departmentIDList) == len(authorIDList)
-            for i in range(0, len(departmentIDList)):
-                print(">>> Tying:")
-                print("> Article: ", str(article_id))
-                print("> Author: ", str(authorIDList[i]))
-                print("> Department: ", str(departmentIDList[i]))
-                print(">>>>>>>>>>")
-
-                currenttie = storage.tie_article_author_department(article_id, authorIDList[i], departmentIDList[i])
+                    yield False
+
+    #parsed articles are geolocated in the order they arrive
+    def geolocated_articles():
+        nonlocal bad_count
+        for current_item in parsed_articles():
+            #check to make sure this is a valid article - some are not correctly formatted nor parseable
+            #this introduces a stipulation into our methods, we are discarding articles which are not formatted. 
+            #create a counter to keep track of this. 
+            if(current_item==False):
+                bad_count+=1
+                continue
+            #departments become [departmentName, [lat, lon]] pairs, authorsList and departmentList stay aligned
+            current_item['departmentList'] = [CleanExtractDepartmentLocation(department) for department in current_item['departmentList']]
+            storage.set_pmid_status([current_item['pmid']], 'geocoded')
+            yield current_item
+
+    #the article, its authors, its departments and the ties between them are written together,
+    #storage.INGEST_BATCH_SIZE articles per transaction, and their PMIDs are marked stored.
+    #The rollup tables are refreshed once after the crawl (storage.refresh_rollups)
+    return storage.ingest_articles(geolocated_articles(), refresh_rollups=False), bad_count
 
+#the same collection as a staged pipeline: fetch, parse and geolocation run on their own worker threads
+#with bounded queues in between, so network, CPU and disk work overlap. This thread is the single writer
+#stage and stores storage.INGEST_BATCH_SIZE articles per transaction (marking their PMIDs stored).
+#Only this thread touches pubmed.db, so the intermediate PMID states are not recorded in this mode;
+#the geocache keeps the geolocation work of an interrupted run.
+def collectPipelined(article_ids):
+    stored_ids = []
+    pending = []
+
+    if BACKEND == "eutils":
+        source = [article_ids[i:i + pubmedfetch.EFETCH_BATCH] for i in range(0, len(article_ids), pubmedfetch.EFETCH_BATCH)]
+        def fetch(batch):
+            yield pubmedfetch.efetch_medline(batch)
+        def parse(text):
+            return medline.parse(text)
     else:
-        bad_count+=1
+        source = article_ids
+        def fetch(article_id):
+            yield article_id, pubmedfetch.get(pubmedfetch.article_url(article_id))
+        def parse(fetched):
+            article_id, page = fetched
+            current_item = parseArticlePage(page, pubmedfetch.article_url(article_id))
+            if current_item != False:
+                yield current_item
+
+    def geocode(current_item):
+        current_item['departmentList'] = [CleanExtractDepartmentLocation(department) for department in current_item['departmentList']]
+        yield current_item
+
+    def flush():
+        stored_ids.extend(storage.ingest_articles(pending, refresh_rollups=False))
+        pending.clear()
+
+    def store(current_item):
+        pending.append(current_item)
+        if len(pending) >= storage.INGEST_BATCH_SIZE:
+            flush()
+        return []
+
+    stages = [pipeline.Stage("fetch", fetch, workers=FETCH_WORKERS),
+              pipeline.Stage("parse", parse, workers=PARSE_WORKERS),
+              pipeline.Stage("geocode", geocode, workers=GEOCODE_WORKERS),
+              pipeline.Stage("store", store, flush=flush)]
+    pipeline.print_metrics(pipeline.run_pipeline(source, stages))
+    return stored_ids
 
 # Aggregation
 
@@ -239,8 +294,31 @@ querylist = [   '?term="Cell"%5Bjour%5D&sort=date&sort_order=desc',
 #Page range to collect:
 PAGESTART = 2
 PAGEEND = 9
+#results per page on pubmed.ncbi.nlm.nih.gov, used to turn the page range into an esearch range
+PAGE_SIZE = 10
+#"eutils" fetches MEDLINE in batches through E-utilities, "html" scrapes one PubMed page per article
+BACKEND = "eutils"
+#run collection as a staged pipeline and the number of worker threads of each stage
+PIPELINE = True
+FETCH_WORKERS = pubmedfetch.WORKERS
+PARSE_WORKERS = 1
+GEOCODE_WORKERS = 8
+#set for incremental refreshes: the first pages are requested again and only unseen PMIDs are collected
+REFRESH = False
 
+if __name__ == "__main__":
+    storage.instantiate()
+    storage.set_journal_mode('WAL')
 
-
-for qi in querylist:
-    aggregate_by_journalquery(querystr=qi, pages_start=PAGESTART, pages_end=PAGEEND)
+    for qi in querylist:
+        aggregate_by_journalquery(querystr=qi, pages_start=PAGESTART, pages_end=PAGEEND, refresh=REFRESH)
+        print(">>> Gazetteer: ", gazetteer.get_stats())
+    print(">>> Geocache: ", geocache.get_stats())
+    print(">>> Ingest: ", storage.ingest_stats)
+    #the crawl leaves the rollup tables behind, bring them up to date in one go
+    storage.refresh_rollups()
+    print(">>> Sites: ", storage.assign_sites())
+    # country borders for Departments.country_code, shapely is only loaded when they are there
+    import countries
+    if os.path.exists(countries.COUNTRIES_PATH):
+        print(">>> Countries: ", storage.assign_countries())
@@ -0,0 +1,220 @@
+import csv
+import json
+import time
+import sqlite3
+import threading
+import unicodedata
+from statistics import median
+import numpy as np
+# vectorized haversine for the sample spread of an institution
+import geodistance
+
+UNIVERSITIES_PATH = 'world-universities.csv'
+ANNOTATION_PATHS = ['annotated_university_names.txt', 'annotated_university_2.txt', 'annotated_university_3.txt']
+# name,latitude,longitude,samples,places of every institution we have coordinates for (see build_coordinates)
+COORDINATES_PATH = 'institution_coordinates.csv'
+# Shortest institution name (in tokens) we keep, "Mayo Clinic" or "City University" name several places
+MIN_TOKENS = 3
+# An institution is dropped when more than a fifth of its samples lie further than this from its median,
+# the name then stands for several sites ("Fraunhofer Institute for ..." in Berlin and Hannover)
+MAX_SPREAD_KM = 50
+MIN_AGREEMENT = 0.8
+# Names in the annotation files that are not institutions
+NOT_INSTITUTIONS = {'nature genetics'}
+
+# Lookup counters for the current process, shared by the geocode workers of the pipeline
+stats = {"lookups": 0, "alias": 0, "ngram": 0, "unresolved": 0}
+stats_lock = threading.Lock()
+
+# normalized institution name -> [lat, lon], normalized annotated affiliation -> [lat, lon]
+names = {}
+aliases = {}
+# normalized institution name -> the normalized cities its samples were in
+places = {}
+# first token of a name -> the token lengths of the names starting with it, longest first
+first_tokens = {}
+
+# Lower case, accents and punctuation removed, so "Université Paris-Saclay," and "universite paris saclay" agree
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join("".join(c if c.isalnum() else " " for c in text).split())
+
+def _load_annotations():
+    pairs = []
+    for path in ANNOTATION_PATHS:
+        try:
+            with open(path) as f:
+                pairs += [(entry["listed"], entry["annotated_name"]) for entry in json.load(f) if entry["annotated_name"]]
+        except FileNotFoundError:
+            pass
+    return pairs
+
+# Build the in-memory index: every institution with coordinates by normalized name, and every annotated
+# affiliation string as an alias of its institution
+def load(coordinates_path=COORDINATES_PATH):
+    names.clear()
+    aliases.clear()
+    places.clear()
+    try:
+        with open(coordinates_path) as f:
+            for row in csv.DictReader(f):
+                name = normalize(row["name"])
+                names[name] = [float(row["latitude"]), float(row["longitude"])]
+                places[name] = set(filter(None, (row.get("places") or "").split("|")))
+    except FileNotFoundError:
+        pass
+    for listed, annotated_name in _load_annotations():
+        location = names.get(normalize(annotated_name))
+        if location is not None:
+            aliases[normalize(listed)] = location
+    _index_first_tokens()
+    return len(names), len(aliases)
+
+def _index_first_tokens():
+    first_tokens.clear()
+    for name in names:
+        tokens = name.split()
+        if len(tokens) >= MIN_TOKENS:
+            first_tokens.setdefault(tokens[0], set()).add(len(tokens))
+    for token, lengths in first_tokens.items():
+        first_tokens[token] = sorted(lengths, reverse=True)
+
+# Longest institution name occurring as a run of whole words in the normalized affiliation.
+# Only the n-grams starting with the first token of some name are looked up.
+def _longest_match(tokens):
+    best = None
+    for start, token in enumerate(tokens):
+        for length in first_tokens.get(token, ()):
+            if best is not None and length <= len(best.split()):
+                break
+            if start + length > len(tokens):
+                continue
+            name = " ".join(tokens[start:start + length])
+            if name in names:
+                best = name
+                break
+    return best
+
+# The cities of an affiliation: the comma separated parts after the one naming the institution (the
+# last three parts when it is not named), without postal codes, state abbreviations and the trailing
+# country, so that "..., Mayo Clinic, Rochester, MN 55905, USA." gives {"rochester"}
+def affiliation_places(affiliation, name=None):
+    parts = [" ".join(token for token in normalize(part).split() if not token.isdigit()) for part in affiliation.split(",")]
+    after = next((i + 1 for i, part in enumerate(parts) if name and f" {name} " in f" {part} "), max(len(parts) - 3, 1))
+    trailing = [part for part in parts[after:] if part]
+    if len(trailing) > 1:
+        trailing = trailing[:-1]
+    return {part for part in trailing if len(part) > 2 and len(part.split()) <= 3}
+
+# True when the affiliation names one of the cities the institution was seen in
+def _place_agrees(key, name):
+    return any(f" {place} " in f" {key} " for place in places.get(name, ()))
+
+# ([lat, lon] or None, "alias" / "ngram" / "unresolved") of an affiliation string
+def _resolve(affiliation):
+    key = normalize(affiliation)
+    location = aliases.get(key)
+    if location is not None:
+        return location, "alias"
+    name = _longest_match(key.split())
+    if name is not None and _place_agrees(key, name):
+        return names[name], "ngram"
+    return None, "unresolved"
+
+def _count(outcomes):
+    with stats_lock:
+        for outcome in outcomes:
+            stats["lookups"] += 1
+            stats[outcome] += 1
+
+# [lat, lon] of an affiliation string, or None when the gazetteer does not know it. A name found inside
+# the affiliation only counts when the affiliation also names its city, otherwise it falls through to Mapbox.
+def lookup(affiliation):
+    location, outcome = _resolve(affiliation)
+    _count([outcome])
+    return location
+
+# Resolve a batch of affiliations, returning their locations (None where unresolved) and the batch coverage.
+# The batch counts its own outcomes, lookups of other threads in the meantime do not show up in them.
+def lookup_batch(affiliations):
+    start = time.perf_counter()
+    resolved = [_resolve(affiliation) for affiliation in affiliations]
+    elapsed = time.perf_counter() - start
+    locations = [location for location, _ in resolved]
+    outcomes = [outcome for _, outcome in resolved]
+    _count(outcomes)
+    found = len(outcomes) - outcomes.count("unresolved")
+    batch_stats = {
+        "affiliations": len(locations),
+        "resolved": found,
+        "coverage": found / len(locations) if locations else 0.0,
+        "alias": outcomes.count("alias"),
+        "ngram": outcomes.count("ngram"),
+        "microseconds_per_lookup": elapsed / len(locations) * 1e6 if locations else 0.0,
+    }
+    return locations, batch_stats
+
+def get_stats():
+    with stats_lock:
+        counts = dict(stats)
+    resolved = counts["alias"] + counts["ngram"]
+    return {**counts, "coverage": resolved / counts["lookups"] if counts["lookups"] else 0.0,
+            "institutions": len(names), "aliases": len(aliases)}
+
+# Share of the samples within MAX_SPREAD_KM of their median
+def _agreement(points, latitude, longitude):
+    distances = geodistance.haversine_many(latitude, longitude, [p[0] for p in points], [p[1] for p in points])
+    return float(np.mean(distances <= MAX_SPREAD_KM))
+
+# Derive the coordinates file from departments that were already geolocated in pubmed.db.
+# Every department contributes its coordinates and cities to the annotated institution of its affiliation
+# and to every world-universities.csv institution named in it; an institution gets the median of its
+# samples, which outvotes the occasional wrong Mapbox hit. Short names, non-institutions and names whose
+# samples are spread over several sites are left out. Writes name,latitude,longitude,samples,places.
+def build_coordinates(db_path='pubmed.db', output_path=COORDINATES_PATH, min_samples=1):
+    with open(UNIVERSITIES_PATH, newline='') as f:
+        universities = {normalize(row[1]): row[1] for row in csv.reader(f) if len(row) > 1}
+    annotated = {}
+    for listed, annotated_name in _load_annotations():
+        annotated[normalize(listed)] = annotated_name
+        universities.setdefault(normalize(annotated_name), annotated_name)
+    universities = {name: university for name, university in universities.items()
+                    if len(name.split()) >= MIN_TOKENS and name not in NOT_INSTITUTIONS}
+
+    # match against every known name, with or without coordinates
+    names.clear()
+    names.update({name: None for name in universities})
+    _index_first_tokens()
+
+    db = sqlite3.connect(db_path)
+    samples = {}
+    for departmentName, latitude, longitude in db.execute('''
+        SELECT departmentName, latitude, longitude FROM Departments
+        WHERE latitude IS NOT NULL AND NOT (latitude = 0 AND longitude = 0)
+        '''):
+        key = normalize(departmentName)
+        matched = set()
+        if key in annotated and normalize(annotated[key]) in universities:
+            matched.add(normalize(annotated[key]))
+        name = _longest_match(key.split())
+        if name is not None:
+            matched.add(name)
+        for name in matched:
+            samples.setdefault(name, []).append((latitude, longitude, affiliation_places(departmentName, name)))
+    db.close()
+
+    with open(output_path, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "latitude", "longitude", "samples", "places"])
+        for name, points in sorted(samples.items()):
+            latitude, longitude = median(p[0] for p in points), median(p[1] for p in points)
+            if len(points) >= min_samples and _agreement(points, latitude, longitude) >= MIN_AGREEMENT:
+                writer.writerow([universities[name], round(latitude, 6), round(longitude, 6), len(points),
+                                 "|".join(sorted(set().union(*(p[2] for p in points))))])
+    return load(output_path)
+
+load()
+
+if __name__ == "__main__":
+    print(build_coordinates())
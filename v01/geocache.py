@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+import time
+
+GEOCACHE_PATH = 'geocache.db'
+# Failed lookups are remembered for this many seconds before the API is asked again
+NEGATIVE_TTL = 7 * 24 * 60 * 60
+
+# Hit/miss counters for the current process
+stats = {"hits": 0, "negative_hits": 0, "misses": 0, "expired": 0, "stored": 0}
+
+# The geocoder may be called from worker threads, so the connection is shared behind a lock.
+# It is opened on first use (see _connection), importing the module creates no file.
+lock = threading.Lock()
+conn = None
+
+def _open(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute('''
+    CREATE TABLE IF NOT EXISTS Geocache (
+        queryKey TEXT PRIMARY KEY,
+        query TEXT NOT NULL,
+        latitude REAL,
+        longitude REAL,
+        fetched REAL NOT NULL
+    )
+    ''')
+    connection.commit()
+    return connection
+
+# Point the cache at another file (tests, scratch runs)
+def connect(path=GEOCACHE_PATH):
+    global conn
+    with lock:
+        conn = _open(path)
+    return conn
+
+# The shared connection, opened on GEOCACHE_PATH the first time. Callers hold lock.
+def _connection():
+    global conn
+    if conn is None:
+        conn = _open(GEOCACHE_PATH)
+    return conn
+
+# Affiliation strings repeat with different case, spacing and trailing punctuation
+def normalize_query(query):
+    return " ".join(query.lower().split()).strip(" .,;")
+
+# Returns [lat, lon] for a cached location, [] for a cached failed lookup that has not expired,
+# and None when the API has to be asked.
+def lookup(query, now=None):
+    now = time.time() if now is None else now
+    with lock:
+        row = _connection().execute('SELECT latitude, longitude, fetched FROM Geocache WHERE queryKey = ?',
+                                    (normalize_query(query),)).fetchone()
+        if row is None:
+            stats["misses"] += 1
+            return None
+        latitude, longitude, fetched = row
+        if latitude is not None:
+            stats["hits"] += 1
+            return [latitude, longitude]
+        if now - fetched > NEGATIVE_TTL:
+            stats["expired"] += 1
+            stats["misses"] += 1
+            return None
+        stats["negative_hits"] += 1
+        return []
+
+# Store the result of an API lookup, an empty location records a failed lookup
+def store(query, location, now=None):
+    now = time.time() if now is None else now
+    latitude, longitude = location if len(location) == 2 else (None, None)
+    with lock:
+        connection = _connection()
+        connection.execute('''
+        INSERT OR REPLACE INTO Geocache (queryKey, query, latitude, longitude, fetched)
+        VALUES (?, ?, ?, ?, ?)
+        ''', (normalize_query(query), query, latitude, longitude, now))
+        connection.commit()
+        stats["stored"] += 1
+
+def get_stats():
+    with lock:
+        entries, failures = _connection().execute(
+            'SELECT COUNT(*), COUNT(*) - COUNT(latitude) FROM Geocache').fetchone()
+    lookups = stats["hits"] + stats["negative_hits"] + stats["misses"]
+    hit_rate = (stats["hits"] + stats["negative_hits"]) / lookups if lookups else 0.0
+    return {**stats, "entries": entries, "cached_failures": failures, "hit_rate": hit_rate}
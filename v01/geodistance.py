@@ -0,0 +1,133 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+EARTH_RADIUS = 6371.0  # km, as in storage.haversine
+# Rows/columns per block of the all-pairs distance matrix: a float64 block takes BLOCK_SIZE**2 * 8 bytes
+BLOCK_SIZE = 1024
+
+# float32 halves memory and is faster on large blocks; distances are then good to a few metres
+# for nearby points and about 1 km across the globe, float64 matches storage.haversine.
+def _radians(values, dtype):
+    return np.radians(np.asarray(values, dtype=dtype))
+
+def _haversine(lat1, lon1, cos_lat1, lat2, lon2, cos_lat2):
+    a = np.sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lat2 * np.sin((lon2 - lon1) / 2) ** 2
+    return (2 * EARTH_RADIUS) * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+# Distance in km from one point to every point of the arrays
+def haversine_many(lat, lon, lats, lons, dtype=np.float64):
+    lat1, lon1 = _radians(lat, dtype), _radians(lon, dtype)
+    lats, lons = _radians(lats, dtype), _radians(lons, dtype)
+    return _haversine(lat1, lon1, np.cos(lat1), lats, lons, np.cos(lats)).astype(dtype, copy=False)
+
+# Element-wise distance in km between two equally long point arrays, e.g. the two ends of every edge
+def haversine_pairs(lats1, lons1, lats2, lons2, dtype=np.float64):
+    lats1, lons1 = _radians(lats1, dtype), _radians(lons1, dtype)
+    lats2, lons2 = _radians(lats2, dtype), _radians(lons2, dtype)
+    return _haversine(lats1, lons1, np.cos(lats1), lats2, lons2, np.cos(lats2)).astype(dtype, copy=False)
+
+# All-pairs distances, one block_size x block_size block at a time so memory stays bounded.
+# Yields (row_start, column_start, block) for the blocks on and above the diagonal.
+def pairwise_blocks(lats, lons, block_size=BLOCK_SIZE, dtype=np.float64):
+    lats, lons = _radians(lats, dtype), _radians(lons, dtype)
+    cos_lats = np.cos(lats)
+    n = len(lats)
+    for i in range(0, n, block_size):
+        rows = slice(i, min(i + block_size, n))
+        lat1, lon1, cos1 = lats[rows, None], lons[rows, None], cos_lats[rows, None]
+        for j in range(i, n, block_size):
+            columns = slice(j, min(j + block_size, n))
+            yield i, j, _haversine(lat1, lon1, cos1, lats[columns], lons[columns], cos_lats[columns]).astype(dtype, copy=False)
+
+# Index pairs (i < j) of the points within threshold km of each other, with their distances, as three arrays
+def pairs_within(lats, lons, threshold, block_size=BLOCK_SIZE, dtype=np.float64):
+    firsts, seconds, distances = [], [], []
+    for i, j, block in pairwise_blocks(lats, lons, block_size, dtype):
+        rows, columns = np.nonzero(block <= threshold)
+        rows, columns = rows + i, columns + j
+        upper = rows < columns
+        firsts.append(rows[upper])
+        seconds.append(columns[upper])
+        distances.append(block[rows[upper] - i, columns[upper] - j])
+    if not firsts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=dtype)
+    return np.concatenate(firsts), np.concatenate(seconds), np.concatenate(distances)
+
+# Points as unit vectors: the straight-line (chord) distance between two of them grows with their
+# great-circle distance, so a k-d tree over them answers "within d km" without wrapping problems
+def _unit_vectors(lats, lons):
+    lats, lons = _radians(lats, np.float64), _radians(lons, np.float64)
+    cos_lats = np.cos(lats)
+    return np.column_stack((cos_lats * np.cos(lons), cos_lats * np.sin(lons), np.sin(lats)))
+
+def _chord(distance):
+    return 2 * np.sin(min(distance / EARTH_RADIUS, np.pi) / 2)
+
+# Single-linkage clustering: points within distance_threshold km of each other share a cluster, and so
+# does everything chained through such pairs (union-find over the neighbour pairs of a k-d tree).
+# Cost grows with the number of close pairs instead of n². Returns one label 0..k-1 per point.
+def cluster_by_proximity(lats, lons, distance_threshold=1.0):
+    points = _unit_vectors(lats, lons)
+    n = len(points)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    pairs = cKDTree(points).query_pairs(_chord(distance_threshold), output_type='ndarray')
+    adjacency = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    return connected_components(adjacency, directed=False)[1]
+
+# Sites of clustered points: the centroid of every cluster (mean unit vector, so clusters across the
+# antimeridian come out right), the index of the member nearest to it, which names the site, and its size.
+def cluster_sites(lats, lons, labels):
+    n_clusters = labels.max() + 1 if len(labels) else 0
+    points = _unit_vectors(lats, lons)
+    x, y, z = (np.bincount(labels, weights=points[:, k], minlength=n_clusters) for k in range(3))
+    site_lats = np.degrees(np.arctan2(z, np.hypot(x, y)))
+    site_lons = np.degrees(np.arctan2(y, x))
+    distances = haversine_pairs(lats, lons, site_lats[labels], site_lons[labels])
+    order = np.lexsort((distances, labels))
+    representatives = order[np.r_[0, np.flatnonzero(np.diff(labels[order])) + 1]] if len(order) else order
+    return site_lats, site_lons, representatives, np.bincount(labels, minlength=n_clusters)
+
+# The notebooks' proximity merge as a library function. Departments are (department_id, name, lat, lon);
+# returns (merged_name, lat, lon, [department ids]) per site. Unlike the notebook, groups are transitive
+# (single linkage) and get their centroid rather than the coordinates of whichever member came first.
+def merge_departments_by_proximity(departments, distance_threshold=1.0):
+    lats = np.array([dept[2] for dept in departments], dtype=np.float64)
+    lons = np.array([dept[3] for dept in departments], dtype=np.float64)
+    labels = cluster_by_proximity(lats, lons, distance_threshold)
+    site_lats, site_lons, _, _ = cluster_sites(lats, lons, labels)
+    groups = [[] for _ in range(len(site_lats))]
+    for dept, label in zip(departments, labels):
+        groups[label].append(dept)
+    return [(" / ".join(set(d[1] for d in group)), float(site_lats[label]), float(site_lons[label]), [d[0] for d in group])
+            for label, group in enumerate(groups)]
+
+# Great-circle length in km of every edge of a department graph (nodes carry lat/lon attributes),
+# in G.edges() order
+def edge_lengths(G, dtype=np.float64):
+    # coordinates are read once per node, the edges only carry node positions
+    index = {node: i for i, node in enumerate(G)}
+    lats = np.fromiter((lat for _, lat in G.nodes(data='lat')), dtype=np.float64, count=len(index))
+    lons = np.fromiter((lon for _, lon in G.nodes(data='lon')), dtype=np.float64, count=len(index))
+    ends = np.fromiter((index[node] for edge in G.edges() for node in edge), dtype=np.int64,
+                       count=2 * G.number_of_edges()).reshape(-1, 2)
+    return haversine_pairs(lats[ends[:, 0]], lons[ends[:, 0]], lats[ends[:, 1]], lons[ends[:, 1]], dtype)
+
+# Summary of collaboration distances, optionally weighted (e.g. by the number of shared articles)
+def edge_length_stats(lengths, weights=None):
+    lengths = np.asarray(lengths, dtype=np.float64)
+    if len(lengths) == 0:
+        return {"edges": 0}
+    stats = {
+        "edges": len(lengths),
+        "mean_km": float(lengths.mean()),
+        "median_km": float(np.median(lengths)),
+        "p90_km": float(np.percentile(lengths, 90)),
+        "max_km": float(lengths.max()),
+    }
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+        stats["weighted_mean_km"] = float(np.average(lengths, weights=weights))
+    return stats
@@ -0,0 +1,88 @@
+import numpy as np
+import folium
+from folium.plugins import HeatMap
+# storage library for this project
+import storage
+
+# Grid the departments are binned into: "hex" (hexagons) or "latlon" (rectangular cells)
+GRID = "hex"
+# Cell size in degrees: the side of a latlon cell, the centre-to-corner distance of a hexagon
+CELL_SIZE = 1.0
+
+# (data fingerprint, journal, window, grid, cell size) -> binned cells, cleared when the data changes
+_grids = {}
+
+# Distinct (a, b) integer cell coordinates and the cell of every point, through one int64 key per point
+# (a 1-D unique sorts several times faster than np.unique over rows)
+def _unique_cells(a, b):
+    a = a.astype(np.int64)
+    b = b.astype(np.int64)
+    b_min = b.min()
+    span = b.max() - b_min + 1
+    keys, inverse = np.unique(a * span + (b - b_min), return_inverse=True)
+    return keys // span, keys % span + b_min, inverse
+
+# Rectangular grid: the centre of every non-empty cell and the summed weights of its points
+def bin_latlon(lats, lons, weights, cell_size=CELL_SIZE):
+    rows, columns, inverse = _unique_cells(np.floor(lats / cell_size), np.floor(lons / cell_size))
+    return (rows + 0.5) * cell_size, (columns + 0.5) * cell_size, np.bincount(inverse, weights=weights)
+
+# Pointy-top hexagons over the (lon, lat) plane: points go to axial coordinates, are rounded to the
+# nearest hexagon in cube coordinates, and every non-empty hexagon gets its centre and summed weights
+def bin_hex(lats, lons, weights, cell_size=CELL_SIZE):
+    q = (np.sqrt(3) / 3 * lons - lats / 3) / cell_size
+    r = (2 / 3 * lats) / cell_size
+    x, z = q, r
+    y = -x - z
+    rx, ry, rz = np.round(x), np.round(y), np.round(z)
+    dx, dy, dz = np.abs(rx - x), np.abs(ry - y), np.abs(rz - z)
+    fix_x = (dx > dy) & (dx > dz)
+    fix_z = ~fix_x & (dz >= dy)
+    rx = np.where(fix_x, -ry - rz, rx)
+    rz = np.where(fix_z, -rx - ry, rz)
+    cell_q, cell_r, inverse = _unique_cells(rx, rz)
+    return cell_size * 1.5 * cell_r, cell_size * np.sqrt(3) * (cell_q + cell_r / 2), np.bincount(inverse, weights=weights)
+
+# Weighted points binned into the cells of a grid, only the non-empty cells: (lats, lons, weights)
+def bin_points(lats, lons, weights, cell_size=CELL_SIZE, grid=GRID):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if len(lats) == 0:
+        return np.empty(0), np.empty(0), np.empty(0)
+    if grid == "hex":
+        return bin_hex(lats, lons, weights, cell_size)
+    if grid == "latlon":
+        return bin_latlon(lats, lons, weights, cell_size)
+    raise ValueError(f"Unknown grid {grid!r}")
+
+# The binned collaboration heat of the departments, for all articles or those of one journal and/or
+# a (start, end) window of storage.publication_date integers. Kept per process until pubmed.db changes,
+# so a repeated map costs the number of cells rather than the number of departments.
+def heatmap_cells(journal_title=None, window=None, grid=GRID, cell_size=CELL_SIZE):
+    fingerprint = storage.data_fingerprint()
+    # a window given as a list is the same window, and must be hashable for the key
+    window = tuple(window) if window is not None else None
+    key = (fingerprint, journal_title, window, grid, cell_size)
+    if key not in _grids:
+        if any(cached[0] != fingerprint for cached in _grids):
+            _grids.clear()
+        start, end = window if window is not None else (None, None)
+        intensities = storage.get_department_intensities(journal_title, start, end)
+        lats = [row[0] for row in intensities]
+        lons = [row[1] for row in intensities]
+        weights = [row[2] for row in intensities]
+        _grids[key] = bin_points(lats, lons, weights, cell_size, grid)
+    return _grids[key]
+
+# Folium heatmap of the binned cells, one weighted point per non-empty cell
+def create_heatmap(journal_title=None, window=None, grid=GRID, cell_size=CELL_SIZE):
+    lats, lons, weights = heatmap_cells(journal_title, window, grid, cell_size)
+    folium_map = folium.Map(location=[0, 0], zoom_start=2)
+    heat_data = np.column_stack((lats, lons, weights)).round(4).tolist()
+    HeatMap(heat_data, max_zoom=15).add_to(folium_map)
+    return folium_map
+
+if __name__ == "__main__":
+    storage.instantiate()
+    create_heatmap().save("department_heatmap.html")
@@ -0,0 +1,292 @@
+import os
+import time
+import pickle
+import hashlib
+from collections import deque
+import networkx as nx
+# storage library for this project
+import storage
+import network
+import sparsenetwork
+
+# Graph and metric state between runs, one file per level
+STATE_PATH = 'graph_state_{level}.pickle'
+# Metrics maintained incrementally, all of them computed like the exact profile of network.calculate_graph_metrics
+METRICS = network.METRICS
+
+# Incremental maintenance of the exact metrics of the co-authorship graph across ingests.
+#
+# The state keeps the graph together with the ArticleAuthors rowid it reflects. An update reads only the
+# rows after that rowid as edge deltas (storage.get_edges_since), which keeps degrees and weights exact,
+# and recomputes the expensive metrics inside the connected components those deltas touched:
+#   betweenness  unnormalized values are per component, only the normalization depends on the node count
+#   closeness    per node reach and total distance, the wf_improved scaling is reapplied for all nodes
+#   clustering   per node, all nodes again when the largest edge weight changed the normalization
+#   transitivity per node triangle counts
+#   cliques      maximal cliques never span components
+# Degree centrality, density, assortativity and connectivity are cheap and recomputed in full. Eigenvector
+# centrality is global (the power iteration runs over every component at once) and recomputed in full
+# on the CSR adjacency, which gives the NetworkX values at a fraction of the cost.
+# Anything the deltas cannot describe (deleted rows, sites reassigned) falls back to a full build.
+
+def _state_path(level, path=None):
+    return path or STATE_PATH.format(level=level)
+
+def load_state(level='department', path=None):
+    try:
+        with open(_state_path(level, path), 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_state(state, path=None):
+    # write then rename, a crash mid-write leaves the previous state in place
+    path = _state_path(state["level"], path)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+# Checksum of the site of every department the state knows, sites are recomputed from scratch by
+# storage.assign_sites and their ids only stay meaningful while the existing departments keep their site
+def _sites_fingerprint(max_department_id):
+    return hashlib.sha1(repr(storage.get_site_assignments(max_department_id)).encode()).hexdigest()
+
+# Why the state cannot be brought up to date with deltas, or None when it can
+def _needs_rebuild(state, level, metrics):
+    if state is None:
+        return "no state"
+    if state["level"] != level or state["metrics"] != list(metrics):
+        return "different level or metrics"
+    if storage.count_article_authors(state["rowid"]) != state["rows"]:
+        return "rows deleted"
+    if level == 'site' and _sites_fingerprint(state["max_department_id"]) != state["sites"]:
+        return "sites reassigned"
+    return None
+
+def _apply_deltas(G, nodes, edges):
+    for node_id, name, lat, lon in nodes:
+        G.add_node(node_id, name=name, lat=lat, lon=lon)
+    for node_a, node_b, weight, journals in edges:
+        if G.has_edge(node_a, node_b):
+            data = G[node_a][node_b]
+            data["weight"] += weight
+            for journal_title, articles in journals.items():
+                data["journals"][journal_title] = data["journals"].get(journal_title, 0) + articles
+        else:
+            G.add_edge(node_a, node_b, weight=weight, journals=dict(journals))
+
+def _max_weight(G):
+    return max((weight for _, _, weight in G.edges(data="weight")), default=1)
+
+# Recompute the metrics of the nodes in affected (all of G on a full build) from the per node values
+# kept in aux, and return the metrics dictionary of network.calculate_graph_metrics(G, "exact")
+def _update_metrics(G, names, aux, affected):
+    n = len(G)
+    components = [component for component in nx.connected_components(G) if component & affected]
+    affected = set().union(*components) if components else set()
+    results = {}
+    runtimes = {}
+    for name in names:
+        start = time.perf_counter()
+        if name == "cliques":
+            cliques = [clique for clique in aux.get("cliques", []) if not affected.intersection(clique)]
+            cliques += list(nx.find_cliques(G.subgraph(affected).copy()))
+            aux["cliques"] = cliques
+            results.update({"Number of cliques": len(cliques), "Cliques": cliques})
+        elif name == "connectivity":
+            results["Network connectivity"] = nx.node_connectivity(G) if n and nx.is_connected(G) else 0
+        elif name == "clustering":
+            max_weight = _max_weight(G)
+            nodes = affected if aux.get("max_weight") == max_weight else G
+            aux.setdefault("clustering", {}).update(nx.clustering(G, nodes=nodes, weight='weight'))
+            aux["max_weight"] = max_weight
+            results["Average clustering coefficient"] = sum(aux["clustering"].values()) / n if n else 0.0
+        elif name == "density":
+            results["Graph density"] = nx.density(G)
+        elif name == "assortativity":
+            results["Assortativity coefficient"] = nx.degree_assortativity_coefficient(G, weight='weight')
+        elif name == "transitivity":
+            aux.setdefault("triangles", {}).update(nx.triangles(G, nodes=affected))
+            possible = sum(d * (d - 1) for _, d in G.degree())
+            triangles = sum(aux["triangles"].get(node, 0) for node in G)
+            results["Transitivity"] = 2 * triangles / possible if triangles else 0
+        elif name == "degree":
+            results["Degree centrality"] = nx.degree_centrality(G)
+        elif name == "betweenness":
+            raw = aux.setdefault("betweenness", {})
+            for component in components:
+                # a copy, algorithms run several times faster on it than on a subgraph view
+                raw.update(nx.betweenness_centrality(G.subgraph(component).copy(), weight='weight', normalized=False))
+            scale = 2 / ((n - 1) * (n - 2)) if n > 2 else 2
+            results["Betweenness centrality"] = {node: raw.get(node, 0.0) * scale for node in G}
+        elif name == "closeness":
+            reach = aux.setdefault("closeness", {})
+            for node in affected:
+                distances = nx.single_source_shortest_path_length(G, node)
+                reach[node] = (len(distances) - 1, sum(distances.values()))
+            results["Closeness centrality"] = {
+                node: (r / total * r / (n - 1) if total > 0 and n > 1 else 0.0)
+                for node, (r, total) in ((node, reach.get(node, (0, 0))) for node in G)
+            }
+        elif name == "eigenvector":
+            nodes = list(G)
+            try:
+                values = sparsenetwork.eigenvector_centrality(nx.to_scipy_sparse_array(G, nodelist=nodes, weight='weight', format='csr'))
+                eigenvector = dict(zip(nodes, values.tolist()))
+            except nx.exception.PowerIterationFailedConvergence:
+                eigenvector = {node: None for node in G}
+            results["Eigenvector centrality"] = eigenvector
+        runtimes[name] = {"seconds": time.perf_counter() - start, "budget": None, "complete": True, "over_budget": False}
+    results["Runtimes"] = runtimes
+    results["Elapsed"] = sum(runtime["seconds"] for runtime in runtimes.values())
+    return results, len(affected)
+
+# Bring the graph and metrics of a level up to date with pubmed.db and persist them.
+# Returns (G, metrics, report) where report says whether the update was incremental and how much it touched.
+def update_graph_metrics(level='department', metrics=None, path=None, rebuild=False):
+    names = list(METRICS if metrics is None else metrics)
+    state = None if rebuild else load_state(level, path)
+    reason = "rebuild requested" if rebuild else _needs_rebuild(state, level, names)
+    rowid = storage.max_article_author_rowid()
+    start = time.perf_counter()
+
+    if reason is None:
+        G, aux = state["graph"], state["aux"]
+        nodes = storage.get_nodes_since(state["rowid"], level)
+        edges = storage.get_edges_since(state["rowid"], level)
+        _apply_deltas(G, nodes, edges)
+        affected = {node[0] for node in nodes} | {node for edge in edges for node in edge[:2]}
+        report = {"mode": "incremental", "new_rows": rowid - state["rowid"], "new_edges": len(edges)}
+    else:
+        G = network.load_graph(level)
+        aux = {}
+        affected = set(G)
+        report = {"mode": "full", "reason": reason, "new_rows": rowid, "new_edges": G.number_of_edges()}
+
+    results, report["affected_nodes"] = _update_metrics(G, names, aux, affected)
+    report["seconds"] = time.perf_counter() - start
+    max_department_id = storage.max_department_id()
+    save_state({
+        "level": level,
+        "metrics": names,
+        "rowid": rowid,
+        "rows": storage.count_article_authors(rowid),
+        "max_department_id": max_department_id,
+        "sites": _sites_fingerprint(max_department_id) if level == 'site' else None,
+        "graph": G,
+        "aux": aux,
+        "results": results,
+    }, path)
+    return G, results, report
+
+# Windows of `years` years starting every `step` years, as (start, end) publishedDate pairs
+def year_windows(first_year, last_year, years=1, step=1):
+    return [(year * 10000 + 101, (year + years - 1) * 10000 + 1231)
+            for year in range(first_year, last_year - years + 2, step)]
+
+# Windows of `months` months starting every `step` months from (year, month) to (year, month). Every window
+# ends on day 31 of its last month, which as an integer is past the last day of any month.
+def month_windows(first, last, months=1, step=1):
+    windows = []
+    index, last_index = first[0] * 12 + first[1] - 1, last[0] * 12 + last[1] - 1
+    while index + months - 1 <= last_index:
+        end = index + months - 1
+        windows.append(((index // 12) * 10000 + (index % 12 + 1) * 100 + 1, (end // 12) * 10000 + (end % 12 + 1) * 100 + 31))
+        index += step
+    return windows
+
+# Add (sign 1) or take away (sign -1) one article's contribution to an edge
+def _apply_contribution(G, node_a, node_b, journal_title, sign):
+    if sign > 0 and not G.has_edge(node_a, node_b):
+        G.add_edge(node_a, node_b, weight=0, journals={})
+    data = G[node_a][node_b]
+    data["weight"] += sign
+    journals = data["journals"]
+    journals[journal_title] = journals.get(journal_title, 0) + sign
+    if not journals[journal_title]:
+        del journals[journal_title]
+    if not data["weight"]:
+        G.remove_edge(node_a, node_b)
+
+# Graphs of a series of publication windows ((start, end) publishedDate pairs whose starts and ends both
+# move forward, e.g. year_windows), built in one pass over storage.iter_edge_contributions: every window
+# adds the articles its end reaches and takes away those its start leaves behind, instead of rebuilding
+# the graph. Yields (window, G, touched) with touched the nodes whose edges changed since the previous
+# window. G is the same graph object throughout and equals network.load_graph(level, window) each time.
+def sliding_window_graphs(windows, level='department'):
+    windows = [tuple(window) for window in windows]
+    for previous, window in zip(windows, windows[1:]):
+        assert window[0] >= previous[0] and window[1] >= previous[1], f"windows must move forward: {previous} then {window}"
+    nodes = storage.retrieve_all_sites() if level == 'site' else storage.retrieve_all_departments()
+    G = network.create_graph(nodes, [], level)
+    if not windows:
+        return
+    contributions = storage.iter_edge_contributions(windows[0][0], windows[-1][1], level)
+    pending = next(contributions, None)
+    inside = deque()
+    for start, end in windows:
+        touched = set()
+        while pending is not None and pending[0] <= end:
+            if pending[0] >= start:
+                _apply_contribution(G, *pending[1:], 1)
+                inside.append(pending)
+                touched.update(pending[1:3])
+            pending = next(contributions, None)
+        while inside and inside[0][0] < start:
+            contribution = inside.popleft()
+            _apply_contribution(G, *contribution[1:], -1)
+            touched.update(contribution[1:3])
+        G.graph["window"] = (start, end)
+        yield (start, end), G, touched
+
+# Exact metrics of every window of sliding_window_graphs. Between windows only the connected components
+# holding a node whose edges changed are recomputed, as update_graph_metrics does across ingests.
+# Returns [(window, metrics)] in window order.
+def sliding_window_metrics(windows, level='department', metrics=None):
+    names = list(METRICS if metrics is None else metrics)
+    aux = None
+    series = []
+    for window, G, touched in sliding_window_graphs(windows, level):
+        if aux is None:
+            aux, touched = {}, set(G)
+        results, _ = _update_metrics(G, names, aux, touched)
+        series.append((window, results))
+    return series
+
+# {node: [value in every window]} of one per-node metric (e.g. "Betweenness centrality") of
+# sliding_window_metrics, for trends over time
+def centrality_trends(series, name):
+    trends = {}
+    for i, (_, results) in enumerate(series):
+        for node, value in results[name].items():
+            trends.setdefault(node, [None] * len(series))[i] = value
+    return trends
+
+# Compare incrementally maintained metrics with a full recompute by network.calculate_graph_metrics.
+# Returns the largest difference per metric.
+def check_consistency(G, results, metrics=None, tol=1e-9):
+    names = list(METRICS if metrics is None else metrics)
+    fresh_graph = network.load_graph(G.graph.get("level", "department"), G.graph.get("window"))
+    assert set(fresh_graph) == set(G) and fresh_graph.number_of_edges() == G.number_of_edges()
+    for u, v, data in fresh_graph.edges(data=True):
+        assert G.has_edge(u, v) and G[u][v]["weight"] == data["weight"] and G[u][v]["journals"] == data["journals"], (u, v)
+    fresh = network.calculate_graph_metrics(fresh_graph, "exact", names)
+    differences = {}
+    for key, value in fresh.items():
+        if key in ("Runtimes", "Elapsed"):
+            continue
+        if key == "Cliques":
+            differences[key] = 0.0 if sorted(map(sorted, value)) == sorted(map(sorted, results[key])) else 1.0
+        elif isinstance(value, dict):
+            differences[key] = max((abs((value[node] or 0.0) - (results[key].get(node) or 0.0)) for node in value), default=0.0)
+        else:
+            differences[key] = abs((value or 0) - (results[key] or 0))
+    for key, difference in differences.items():
+        assert difference <= tol, f"{key} differs by {difference}"
+    return differences
+
+if __name__ == "__main__":
+    storage.instantiate()
+    G, results, report = update_graph_metrics()
+    print(report)
+    print(check_consistency(G, results))
@@ -1,133 +1,133 @@
+import os
+import gzip
+import contextlib
 import sqlite3
 import networkx as nx
 import json
 import storage
+from network import load_graph, calculate_graph_metrics, cached_graph_metrics
+from incremental import update_graph_metrics
 
-# Create NetworkX graph from department data and shared articles
-def create_graph(departments, article_dept_links):
-    G = nx.Graph()
-    
-    # Add departments as nodes
-    for dept in departments:
-        dept_id, name, lat, lon = dept
-        G.add_node(dept_id, name=name, lat=lat, lon=lon)
-    
-    # Add edges based on shared articles
-    for link in article_dept_links:
-        dept1_id, dept2_id, article_id, journal_title = link
-        if G.has_edge(dept1_id, dept2_id):
-            G[dept1_id][dept2_id]['weight'] += 1
-            G[dept1_id][dept2_id]['articles'].append((article_id, journal_title))
-        else:
-            G.add_edge(dept1_id, dept2_id, weight=1, articles=[(article_id, journal_title)])
-    
-    return G
-
-# Calculate graph metrics
-def calculate_graph_metrics(G):
-    cliques = list(nx.find_cliques(G))
-    connectivity = nx.node_connectivity(G)
-    avg_clustering = nx.average_clustering(G, weight='weight')
-    density = nx.density(G)
-    assortativity = nx.degree_assortativity_coefficient(G, weight='weight')
-    transitivity = nx.transitivity(G)
-    
-    # Calculate per-node metrics
-    degree_centrality = nx.degree_centrality(G)
-    betweenness_centrality = nx.betweenness_centrality(G, weight='weight', normalized=True)
-    closeness_centrality = nx.closeness_centrality(G)
-    
-    try:
-        eigenvector_centrality = nx.eigenvector_centrality(G, weight='weight', max_iter=500)
-    except nx.exception.PowerIterationFailedConvergence:
-        eigenvector_centrality = {node: None for node in G.nodes()}
-    
-    metrics = {
-        "Number of cliques": len(cliques),
-        "Network connectivity": connectivity,
-        "Average clustering coefficient": avg_clustering,
-        "Graph density": density,
-        "Assortativity coefficient": assortativity,
-        "Transitivity": transitivity,
-        "Degree centrality": degree_centrality,
-        "Betweenness centrality": betweenness_centrality,
-        "Closeness centrality": closeness_centrality,
-        "Eigenvector centrality": eigenvector_centrality,
-        "Cliques": cliques
-    }
-    
-    return metrics
+# Output format of export_graph_to_geojson_by_journal: "geojson" writes one FeatureCollection per journal,
+# "ndjson" one Feature per line (newline-delimited GeoJSON, .geojsonl)
+GEOJSON_FORMAT = "geojson"
+# gzip the exported files (.gz appended to the name)
+GEOJSON_GZIP = False
 
-# Export graph data to GeoJSON by journal
-def export_graph_to_geojson_by_journal(G, metrics):
-    journal_features = {}
+# File name of the export of one journal
+def journal_file_name(journal_title, fmt="geojson", compress=False):
+    name = f"graph_data_{str(journal_title).replace(' ', '_')}.{'geojsonl' if fmt == 'ndjson' else 'geojson'}"
+    return name + ".gz" if compress else name
 
-    # Nodes (Departments)
-    for node_id, data in G.nodes(data=True):
-        node_metrics = {
-            "degree_centrality": metrics["Degree centrality"].get(node_id),
-            "betweenness_centrality": metrics["Betweenness centrality"].get(node_id),
-            "closeness_centrality": metrics["Closeness centrality"].get(node_id),
-            "eigenvector_centrality": metrics["Eigenvector centrality"].get(node_id),
+def _node_feature(G, node_id, metrics):
+    data = G.nodes[node_id]
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [data["lon"], data["lat"]]
+        },
+        "properties": {
+            "id": node_id,
+            "name": data["name"],
+            "degree_centrality": metrics.get("Degree centrality", {}).get(node_id),
+            "betweenness_centrality": metrics.get("Betweenness centrality", {}).get(node_id),
+            "closeness_centrality": metrics.get("Closeness centrality", {}).get(node_id),
+            "eigenvector_centrality": metrics.get("Eigenvector centrality", {}).get(node_id),
         }
-        feature = {
-            "type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": [data["lon"], data["lat"]]
-            },
-            "properties": {
-                "id": node_id,
-                "name": data["name"],
-                **node_metrics
-            }
+    }
+
+def _edge_feature(G, source, target, articles):
+    dept1 = G.nodes[source]
+    dept2 = G.nodes[target]
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [
+                [dept1["lon"], dept1["lat"]],
+                [dept2["lon"], dept2["lat"]]
+            ]
+        },
+        "properties": {
+            "source": source,
+            "target": target,
+            "weight": G[source][target]["weight"],
+            "articles": articles
         }
+    }
 
-        # Determine the journals for this node
-        for neighbor in G.neighbors(node_id):
-            for article_id, journal_title in G[node_id].get('articles', []):
-                if journal_title not in journal_features:
-                    journal_features[journal_title] = {"nodes": [], "edges": []}
-                journal_features[journal_title]["nodes"].append(feature)
+def _dumps(feature):
+    return json.dumps(feature, separators=(',', ':'))
 
-    # Edges
-    for source, target, data in G.edges(data=True):
-        dept1 = G.nodes[source]
-        dept2 = G.nodes[target]
-        edge_feature = {
-            "type": "Feature",
-            "geometry": {
-                "type": "LineString",
-                "coordinates": [
-                    [dept1["lon"], dept1["lat"]],
-                    [dept2["lon"], dept2["lat"]]
-                ]
-            },
-            "properties": {
-                "source": source,
-                "target": target,
-                "weight": data["weight"],
-                "articles": data["articles"]
-            }
-        }
-        for article_id, journal_title in data['articles']:
-            if journal_title not in journal_features:
-                journal_features[journal_title] = {"nodes": [], "edges": []}
-            journal_features[journal_title]["edges"].append(edge_feature)
+# Export graph data to GeoJSON by journal, one file per journal with the edges carrying an article of that
+# journal and every department at their ends exactly once. The journal files are written side by side: the
+# nodes first, then the edges as storage.iter_edge_articles streams them, so memory holds the graph and the
+# articles of one edge but never a whole file. The articles are those of the graph's window (load_graph).
+# Returns {journal_title: file_name}.
+def export_graph_to_geojson_by_journal(G, metrics, fmt=None, compress=None, directory="."):
+    fmt = fmt or GEOJSON_FORMAT
+    compress = GEOJSON_GZIP if compress is None else compress
 
-    for journal_title, features in journal_features.items():
-        graph_data = {
-            "type": "FeatureCollection",
-            "features": features["nodes"] + features["edges"]
-        }
+    # Departments of every journal, in one pass over the graph
+    journal_nodes = {}
+    for source, target, journals in G.edges(data="journals"):
+        for journal_title in journals:
+            nodes = journal_nodes.setdefault(journal_title, {})
+            nodes[source] = nodes[target] = None
+
+    files = {journal_title: os.path.join(directory, journal_file_name(journal_title, fmt, compress))
+             for journal_title in journal_nodes}
+    opener = gzip.open if compress else open
+    written = dict.fromkeys(files, 0)
+
+    def write(f, journal_title, feature):
+        if fmt == "ndjson":
+            f.write(_dumps(feature) + "\n")
+        else:
+            f.write((",\n" if written[journal_title] else "") + _dumps(feature))
+        written[journal_title] += 1
+
+    with contextlib.ExitStack() as stack:
+        outputs = {journal_title: stack.enter_context(opener(file_name, "wt", encoding="utf-8"))
+                   for journal_title, file_name in files.items()}
+        for journal_title, f in outputs.items():
+            if fmt != "ndjson":
+                f.write('{"type":"FeatureCollection","features":[\n')
+            for node_id in journal_nodes[journal_title]:
+                write(f, journal_title, _node_feature(G, node_id, metrics))
+        start, end = G.graph.get("window", (None, None))
+        for (source, target), articles in storage.iter_edge_articles(start, end, G.graph.get("level", "department")):
+            if not G.has_edge(source, target):
+                continue
+            feature = _edge_feature(G, source, target, articles)
+            for journal_title in G[source][target]["journals"]:
+                write(outputs[journal_title], journal_title, feature)
+        if fmt != "ndjson":
+            for f in outputs.values():
+                f.write("\n]}\n")
+    return files
 
-        file_name = f"graph_data_{journal_title.replace(' ', '_')}.geojson"
-        with open(file_name, "w") as f:
-            json.dump(graph_data, f, indent=4)
+# network.PROFILES entry used for the metrics: "exact" or "fast" for large graphs
+METRIC_PROFILE = "exact"
+# Processes for the metrics, network.WORKERS to use every core
+METRIC_WORKERS = 1
+# Keep the graph and exact metrics between runs (incremental.STATE_PATH) and only apply the new rows
+INCREMENTAL = False
+# Reuse the metrics stored in the GraphMetrics table while the data has not changed
+METRICS_CACHE = True
+NODE_METRICS = ["degree", "betweenness", "closeness", "eigenvector"]
 
 # Main execution
-departments = storage.retrieve_all_departments()
-article_dept_links = storage.get_article_department_links()
-G = create_graph(departments, article_dept_links)
-metrics = calculate_graph_metrics(G)
-export_graph_to_geojson_by_journal(G, metrics)
+if __name__ == "__main__":
+    storage.instantiate()
+    if INCREMENTAL:
+        G, metrics, report = update_graph_metrics(metrics=NODE_METRICS)
+        print(report)
+    elif METRICS_CACHE:
+        G = load_graph()
+        metrics = cached_graph_metrics(profile=METRIC_PROFILE, metrics=NODE_METRICS, workers=METRIC_WORKERS, G=G)
+    else:
+        G = load_graph()
+        metrics = calculate_graph_metrics(G, profile=METRIC_PROFILE, workers=METRIC_WORKERS, metrics=NODE_METRICS)
+    export_graph_to_geojson_by_journal(G, metrics)
@@ -0,0 +1,90 @@
+# Streaming parser for MEDLINE text: the ?format=pubmed pages and efetch rettype=medline responses.
+# A record is a block of "TAG - value" lines separated from the next record by a blank line.
+# Tags are left aligned in the first four columns, long values continue on lines indented by six spaces.
+CONTINUATION = "      "
+
+# Accepts a str, bytes or any iterable of lines (a file opened in text or binary mode, a response stream)
+def _lines(source):
+    if isinstance(source, bytes):
+        source = source.decode("utf-8")
+    if isinstance(source, str):
+        source = source.splitlines()
+    for line in source:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        yield line.rstrip("\r\n")
+
+# Yields every record as a list of (tag, value) pairs in file order, continuation lines joined onto their value.
+# Only one record is held in memory at a time.
+def iter_records(source):
+    fields = []
+    for line in _lines(source):
+        if not line.strip():
+            if fields:
+                yield [(tag, " ".join(parts)) for tag, parts in fields]
+                fields = []
+        elif line.startswith(CONTINUATION):
+            if fields:
+                fields[-1][1].append(line.strip())
+        elif len(line) > 4 and line[4] == "-":
+            fields.append((line[:4].strip(), [line[5:].strip()]))
+        # anything else is page furniture around the record and is skipped
+    if fields:
+        yield [(tag, " ".join(parts)) for tag, parts in fields]
+
+# Turn the fields of one record into the article dictionary used by storage.ingest_articles.
+# AD lines belong to the author listed before them, an author can have several; after a group author
+# (CN) they belong to nobody until the next FAU/AU. authorsList and
+# departmentList hold one aligned entry per (author, affiliation) pair; authors without an
+# affiliation are only listed in "authors".
+def parse_record(fields):
+    article_info = {
+        "pmid": None,
+        "articleTitle": None,
+        "journalTitle": None,
+        "datePublished": None,
+        "abstract": None,
+        "authors": [],
+        "authorsList": [],
+        "departmentList": []
+    }
+    authors = article_info["authors"]
+    # the author AD lines attach to, None after a group author
+    current = None
+    for tag, value in fields:
+        if tag == "PMID":
+            article_info["pmid"] = int(value)
+        elif tag == "TI":
+            article_info["articleTitle"] = value
+        elif tag == "JT":
+            article_info["journalTitle"] = value
+        elif tag == "DP":
+            article_info["datePublished"] = value
+        elif tag == "AB":
+            article_info["abstract"] = value if article_info["abstract"] is None else article_info["abstract"] + " " + value
+        elif tag == "FAU":
+            current = {"name": value, "au_seen": False, "affiliations": []}
+            authors.append(current)
+        elif tag == "AU":
+            # AU follows the FAU of the same author, older records only carry AU
+            if current is not None and current["au_seen"] is False and not current["affiliations"]:
+                current["au_seen"] = True
+            else:
+                current = {"name": value, "au_seen": True, "affiliations": []}
+                authors.append(current)
+        elif tag == "CN":
+            current = None
+        elif tag == "AD" and current is not None:
+            current["affiliations"].append(value)
+
+    for author in authors:
+        del author["au_seen"]
+        for affiliation in author["affiliations"]:
+            article_info["authorsList"].append(author["name"])
+            article_info["departmentList"].append(affiliation)
+    return article_info
+
+# Lazily parse every record of a MEDLINE file or stream
+def parse(source):
+    for fields in iter_records(source):
+        yield parse_record(fields)
@@ -0,0 +1,344 @@
+import os
+import json
+import math
+import time
+import pickle
+import random
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+import networkx as nx
+from networkx.algorithms import approximation
+# storage library for this project
+import storage
+import sparsenetwork
+
+# Every metric calculate_graph_metrics knows, in the order they are computed
+METRICS = ["cliques", "connectivity", "clustering", "density", "assortativity", "transitivity",
+           "degree", "betweenness", "closeness", "eigenvector"]
+# "exact" reproduces the full computations, "fast" switches to the cheaper variant of each metric.
+# budget is the number of seconds each metric may take (None for no limit); metrics that work
+# incrementally stop there and return what they have, the others report that they went over.
+PROFILES = {
+    "exact": {"fast": False, "budget": None},
+    "fast": {"fast": True, "budget": 60.0},
+}
+# Number of source nodes sampled for betweenness in the fast profile
+BETWEENNESS_PIVOTS = 256
+BETWEENNESS_SEED = 0
+# Number of source nodes sampled for closeness in each component in the fast profile
+CLOSENESS_PIVOTS = 256
+CLOSENESS_SEED = 0
+# Worker processes for calculate_graph_metrics(workers=...), and betweenness source chunks per worker
+WORKERS = os.cpu_count() or 1
+CHUNKS_PER_WORKER = 4
+
+# Create NetworkX graph from department (or site) rows and the aggregated edges of storage.get_edges.
+# Every edge carries its weight (shared articles) and journals ({journalTitle: articles}); the article
+# ids are fetched on demand with edge_articles.
+def create_graph(departments, edges, level='department'):
+    G = nx.Graph(level=level)
+    G.add_nodes_from((dept_id, {"name": name, "lat": lat, "lon": lon}) for dept_id, name, lat, lon in departments)
+    G.add_weighted_edges_from((dept_a, dept_b, weight) for dept_a, dept_b, weight, _ in edges)
+    nx.set_edge_attributes(G, {(dept_a, dept_b): journals for dept_a, dept_b, _, journals in edges}, "journals")
+    return G
+
+# Graph of every department, or of every site when level='site'. With a window (start, end) of publishedDate
+# integers the edges only count the articles published within it, every node is kept.
+def load_graph(level='department', window=None):
+    nodes = storage.retrieve_all_sites() if level == 'site' else storage.retrieve_all_departments()
+    edges = storage.get_edges(level) if window is None else storage.get_edges_between(window[0], window[1], level)
+    G = create_graph(nodes, edges, level)
+    if window is not None:
+        G.graph["window"] = tuple(window)
+    return G
+
+# (article_id, journalTitle) of the articles behind the edge u-v
+def edge_articles(G, u, v):
+    return storage.get_edge_articles(u, v, G.graph.get("level", "department"))
+
+# Weighted CSR adjacency of G for the sparsenetwork metrics, built once per calculate_graph_metrics call
+def _adjacency(G, cache):
+    if "adjacency" not in cache:
+        cache["nodes"] = list(G)
+        cache["adjacency"] = nx.to_scipy_sparse_array(G, nodelist=cache["nodes"], weight="weight", format="csr")
+    return cache["adjacency"]
+
+def _expired(deadline):
+    return time.perf_counter() > deadline
+
+# Each metric function takes (G, fast, deadline, cache) and returns (entries of the metrics dictionary, complete)
+
+# Exact lists every maximal clique, fast only counts them
+def _cliques(G, fast, deadline, cache):
+    cliques, count = [], 0
+    complete = True
+    for clique in nx.find_cliques(G):
+        count += 1
+        if not fast:
+            cliques.append(clique)
+        if _expired(deadline):
+            complete = False
+            break
+    return ({"Number of cliques": count} if fast else {"Number of cliques": count, "Cliques": cliques}), complete
+
+# Fast: a disconnected graph has connectivity 0, so the flow computations only run inside components,
+# largest first, with the approximation algorithm
+def _connectivity(G, fast, deadline, cache):
+    if not fast:
+        return {"Network connectivity": nx.node_connectivity(G)}, True
+    components = sorted(nx.connected_components(G), key=len, reverse=True)
+    per_component = []
+    for component in components:
+        if _expired(deadline):
+            break
+        if len(component) <= 2:
+            per_component.append(len(component) - 1)
+        else:
+            per_component.append(approximation.node_connectivity(G.subgraph(component)))
+    complete = len(per_component) == len(components)
+    if len(components) != 1:
+        connectivity = 0
+    else:
+        connectivity = per_component[0] if per_component else None
+    return {"Network connectivity": connectivity, "Component connectivity": per_component}, complete
+
+def _clustering(G, fast, deadline, cache):
+    if fast:
+        return {"Average clustering coefficient": sparsenetwork.average_clustering(_adjacency(G, cache), weighted=True)}, True
+    return {"Average clustering coefficient": nx.average_clustering(G, weight='weight')}, True
+
+def _density(G, fast, deadline, cache):
+    return {"Graph density": nx.density(G)}, True
+
+def _assortativity(G, fast, deadline, cache):
+    return {"Assortativity coefficient": nx.degree_assortativity_coefficient(G, weight='weight')}, True
+
+def _transitivity(G, fast, deadline, cache):
+    return {"Transitivity": nx.transitivity(G)}, True
+
+def _degree(G, fast, deadline, cache):
+    return {"Degree centrality": nx.degree_centrality(G)}, True
+
+# Fast: estimated from BETWEENNESS_PIVOTS sampled source nodes
+def _betweenness(G, fast, deadline, cache):
+    k = min(BETWEENNESS_PIVOTS, len(G)) if fast else None
+    return {"Betweenness centrality": nx.betweenness_centrality(G, k=k, weight='weight', normalized=True,
+                                                                 seed=BETWEENNESS_SEED)}, True
+
+# Fast: estimated from CLOSENESS_PIVOTS sampled source nodes per component (Eppstein and Wang, "Fast
+# approximation of centrality", 2001). One breadth-first search per pivot gives every node its distance to
+# the pivots, whose mean stands in for its mean distance to the rest of the component, so the work is at
+# most CLOSENESS_PIVOTS searches per component instead of one per node. With k pivots in a component of r
+# nodes and diameter D the estimated mean distance of a node is within D * sqrt(log(r) / k) of the true one
+# with high probability (k = 256, r = 1238: within 0.17 D). Components no larger than CLOSENESS_PIVOTS are
+# computed exactly. The values are scaled like nx.closeness_centrality (wf_improved); components the
+# budget stops before are left None.
+def _closeness(G, fast, deadline, cache):
+    if not fast:
+        return {"Closeness centrality": nx.closeness_centrality(G)}, True
+    n = len(G)
+    closeness = dict.fromkeys(G)
+    rng = random.Random(CLOSENESS_SEED)
+    for component in sorted(nx.connected_components(G), key=len, reverse=True):
+        r = len(component)
+        if r == 1:
+            closeness[next(iter(component))] = 0.0
+            continue
+        exact = r <= CLOSENESS_PIVOTS
+        pivots = list(component) if exact else rng.sample(sorted(component), CLOSENESS_PIVOTS)
+        totals = dict.fromkeys(component, 0)
+        for pivot in pivots:
+            if _expired(deadline):
+                return {"Closeness centrality": closeness}, False
+            for node, distance in nx.single_source_shortest_path_length(G, pivot).items():
+                totals[node] += distance
+        pivot_set = set(pivots)
+        for node, total in totals.items():
+            if not exact:
+                # the pivots other than the node itself sample its distances to the other r - 1 nodes
+                total = total * (r - 1) / (CLOSENESS_PIVOTS - (node in pivot_set))
+            closeness[node] = (r - 1) / total * (r - 1) / (n - 1) if total > 0 else 0.0
+    return {"Closeness centrality": closeness}, True
+
+# Fast: the same power iteration on the CSR adjacency
+def _eigenvector(G, fast, deadline, cache):
+    try:
+        if fast:
+            values = sparsenetwork.eigenvector_centrality(_adjacency(G, cache))
+            eigenvector_centrality = dict(zip(cache["nodes"], values.tolist()))
+        else:
+            eigenvector_centrality = nx.eigenvector_centrality(G, weight='weight', max_iter=500)
+    except nx.exception.PowerIterationFailedConvergence:
+        eigenvector_centrality = {node: None for node in G.nodes()}
+    return {"Eigenvector centrality": eigenvector_centrality}, True
+
+_METRIC_FUNCTIONS = {
+    "cliques": _cliques,
+    "connectivity": _connectivity,
+    "clustering": _clustering,
+    "density": _density,
+    "assortativity": _assortativity,
+    "transitivity": _transitivity,
+    "degree": _degree,
+    "betweenness": _betweenness,
+    "closeness": _closeness,
+    "eigenvector": _eigenvector,
+}
+
+# Source nodes of the betweenness computation: all of them, or the BETWEENNESS_PIVOTS that
+# nx.betweenness_centrality samples with the same seed
+def betweenness_sources(G, fast):
+    nodes = list(G)
+    if not fast or BETWEENNESS_PIVOTS >= len(nodes):
+        return nodes
+    return random.Random(BETWEENNESS_SEED).sample(nodes, BETWEENNESS_PIVOTS)
+
+# Sum the unnormalized betweenness of source chunks (None for chunks skipped by the budget) and normalize
+# like nx.betweenness_centrality(normalized=True), treating the sources that ran as its sample
+def merge_betweenness(G, chunks, partials):
+    betweenness = dict.fromkeys(G, 0.0)
+    sampled = set()
+    for chunk, partial in zip(chunks, partials):
+        if partial is None:
+            continue
+        sampled.update(chunk)
+        for node, value in partial.items():
+            betweenness[node] += value
+    n, k = len(G) - 1, len(sampled)
+    if n < 2 or k == 0:
+        return betweenness
+    # the subset sums count every unordered pair once, nx scales the ordered pair counts
+    if k == len(G):
+        scale_source = scale_other = 2 / (n * (n - 1))
+    else:
+        scale_source = 2 / ((k - 1) * (n - 1)) if k > 1 else math.nan
+        scale_other = 2 / (k * (n - 1))
+    return {node: value * (scale_source if node in sampled else scale_other) for node, value in betweenness.items()}
+
+# The graph of a worker process, set once by the pool initializer instead of being sent with every task
+_worker_graph = None
+
+def _init_worker(G):
+    global _worker_graph
+    _worker_graph = G
+
+def _run_metric(name, fast, budget):
+    start = time.perf_counter()
+    deadline = start + budget if budget is not None else math.inf
+    values, complete = _METRIC_FUNCTIONS[name](_worker_graph, fast, deadline, {})
+    return values, complete, time.perf_counter() - start
+
+# Unnormalized betweenness over the shortest paths from some source nodes, None once past the
+# deadline (wall clock, as it is shared by all workers)
+def _betweenness_chunk(sources, deadline):
+    if time.time() > deadline:
+        return None
+    return nx.betweenness_centrality_subset(_worker_graph, sources, list(_worker_graph), normalized=False, weight='weight')
+
+# fork shares the graph with the workers copy-on-write, elsewhere the initializer pickles it once per worker
+def _pool_context():
+    return multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+
+# calculate_graph_metrics on a process pool: betweenness split over source chunks, every other metric
+# a task of its own, all running concurrently. Runtimes are wall-clock seconds until each metric finished.
+def _calculate_parallel(G, settings, names, budgets, workers):
+    results = {}
+    runtimes = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context(),
+                             initializer=_init_worker, initargs=(G,)) as pool:
+        chunks, chunk_futures, futures = [], [], {}
+        # the betweenness chunks go first, they are most of the work
+        if "betweenness" in names:
+            budget = budgets.get("betweenness", settings["budget"])
+            deadline = time.time() + budget if budget is not None else math.inf
+            sources = betweenness_sources(G, settings["fast"])
+            size = max(1, math.ceil(len(sources) / (workers * CHUNKS_PER_WORKER)))
+            chunks = [sources[i:i + size] for i in range(0, len(sources), size)]
+            chunk_futures = [pool.submit(_betweenness_chunk, chunk, deadline) for chunk in chunks]
+        for name in names:
+            if name != "betweenness":
+                futures[name] = pool.submit(_run_metric, name, settings["fast"], budgets.get(name, settings["budget"]))
+        # the other metrics keep running meanwhile, they time themselves in the worker
+        wait(chunk_futures)
+        betweenness_seconds = time.perf_counter() - start
+
+        for name in names:
+            budget = budgets.get(name, settings["budget"])
+            if name == "betweenness":
+                seconds = betweenness_seconds
+                partials = [future.result() for future in chunk_futures]
+                values = {"Betweenness centrality": merge_betweenness(G, chunks, partials)}
+                complete = all(partial is not None for partial in partials)
+            else:
+                values, complete, seconds = futures[name].result()
+            results.update(values)
+            runtimes[name] = {"seconds": seconds, "budget": budget, "complete": complete,
+                              "over_budget": budget is not None and seconds > budget}
+    results["Runtimes"] = runtimes
+    results["Elapsed"] = time.perf_counter() - start
+    return results
+
+# Calculate graph metrics. profile picks "exact" or "fast" variants and the default budget, metrics limits
+# the run to some of METRICS and budgets overrides the budget per metric ({name: seconds or None}).
+# "Runtimes" reports the seconds, budget and completeness of every metric that ran, "Elapsed" the total.
+# With workers > 1 the metrics run on a pool of that many processes.
+def calculate_graph_metrics(G, profile="exact", metrics=None, budgets=None, workers=1):
+    settings = PROFILES[profile]
+    budgets = budgets or {}
+    if workers > 1:
+        return _calculate_parallel(G, settings, METRICS if metrics is None else list(metrics), budgets, workers)
+    cache = {}
+    results = {}
+    runtimes = {}
+    start_all = time.perf_counter()
+    for name in (METRICS if metrics is None else metrics):
+        budget = budgets.get(name, settings["budget"])
+        start = time.perf_counter()
+        deadline = start + budget if budget is not None else math.inf
+        values, complete = _METRIC_FUNCTIONS[name](G, settings["fast"], deadline, cache)
+        seconds = time.perf_counter() - start
+        results.update(values)
+        runtimes[name] = {"seconds": seconds, "budget": budget, "complete": complete,
+                          "over_budget": budget is not None and seconds > budget}
+    results["Runtimes"] = runtimes
+    results["Elapsed"] = time.perf_counter() - start_all
+    return results
+
+# calculate_graph_metrics through the GraphMetrics table of pubmed.db. The key combines the data fingerprint
+# of the level with every parameter that changes the result, so a hit is exactly what a fresh run would
+# return and any change to the data invalidates it. G is only built on a miss when not given.
+# Results cut short by a budget are not cached. "Cached" in the result tells whether it was a hit.
+# window restricts the graph to a publication period as in load_graph.
+def cached_graph_metrics(level='department', profile="exact", metrics=None, budgets=None, workers=1, G=None, window=None):
+    names = list(METRICS if metrics is None else metrics)
+    fingerprint = storage.data_fingerprint(level)
+    parameters = {"level": level, "profile": profile, "metrics": names, "budgets": budgets or {},
+                  "betweenness_pivots": BETWEENNESS_PIVOTS, "betweenness_seed": BETWEENNESS_SEED,
+                  "closeness_pivots": CLOSENESS_PIVOTS, "closeness_seed": CLOSENESS_SEED}
+    if window is not None:
+        parameters["window"] = list(window)
+    parameters = json.dumps(parameters, sort_keys=True)
+    cache_key = hashlib.sha1(f"{fingerprint}|{parameters}".encode()).hexdigest()
+    cached = storage.get_graph_metrics(cache_key)
+    if cached is not None:
+        results = pickle.loads(cached)
+        results["Cached"] = True
+        return results
+
+    if G is None:
+        G = load_graph(level, window)
+    results = calculate_graph_metrics(G, profile, names, budgets, workers)
+    if all(runtime["complete"] for runtime in results["Runtimes"].values()):
+        storage.store_graph_metrics(cache_key, level, fingerprint, parameters,
+                                    pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL), results["Elapsed"])
+    results["Cached"] = False
+    return results
+
+def print_metric_runtimes(metrics):
+    print(f"## Graph metrics in {metrics['Elapsed']:.1f}s" + (" (cached)" if metrics.get("Cached") else ""))
+    for name, runtime in metrics["Runtimes"].items():
+        budget = f"{runtime['budget']:.0f}s" if runtime["budget"] is not None else "none"
+        flags = ("" if runtime["complete"] else " partial") + (" over budget" if runtime["over_budget"] else "")
+        print(f"# {name:<13} {runtime['seconds']:.2f}s budget={budget}{flags}")
@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+
+# Bounded queues between stages: a slow stage blocks the ones upstream of it instead of piling up work
+QUEUE_SIZE = 64
+# Seconds between queue depth samples
+SAMPLE_INTERVAL = 0.1
+
+# End of input marker passed down the queues
+_DONE = object()
+
+# One stage of a pipeline. func(item) returns an iterable of outputs for the next stage (empty to drop
+# the item), flush() is called once after the last item and may return outputs as well.
+# The last stage of a pipeline always runs on the thread that calls run_pipeline with a single worker,
+# which makes it the place for the SQLite writer.
+class Stage:
+    def __init__(self, name, func, workers=1, queue_size=QUEUE_SIZE, flush=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.flush = flush
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self.running = 0
+
+    def sample_depth(self):
+        depth = self.inbox.qsize()
+        with self.lock:
+            self.depth_samples += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+
+    def metrics(self, elapsed):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "items_in": self.items_in,
+                "items_out": self.items_out,
+                "errors": self.errors,
+                "busy_seconds": self.busy,
+                "throughput": self.items_in / elapsed if elapsed else 0.0,
+                "utilization": self.busy / (elapsed * self.workers) if elapsed else 0.0,
+                "queue_depth": self.inbox.qsize(),
+                "mean_queue_depth": self.depth_total / self.depth_samples if self.depth_samples else 0.0,
+                "max_queue_depth": self.max_depth,
+            }
+
+# put/get that give up once the pipeline has been stopped, so no thread stays blocked on a full queue
+def _put(inbox, item, stopped):
+    while not stopped.is_set():
+        try:
+            inbox.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(inbox, stopped):
+    while not stopped.is_set():
+        try:
+            return inbox.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+# Errors are counted and the item dropped, except in the writer where they stop the pipeline
+def _process(stage, item, outbox, stopped, raise_errors=False):
+    start = time.perf_counter()
+    try:
+        outputs = list(stage.func(item)) if item is not _DONE else list(stage.flush() or [])
+    except Exception as e:
+        with stage.lock:
+            stage.errors += 1
+        if raise_errors:
+            raise
+        print(f" ? {stage.name} failed: {e!r}")
+        outputs = []
+    with stage.lock:
+        stage.busy += time.perf_counter() - start
+        if item is not _DONE:
+            stage.items_in += 1
+        stage.items_out += len(outputs)
+    if outbox is not None:
+        for output in outputs:
+            _put(outbox, output, stopped)
+
+def _worker(stage, outbox, stopped):
+    while True:
+        item = _get(stage.inbox, stopped)
+        if item is _DONE:
+            # let the sibling workers see the marker too, the last one out flushes and tells the next stage
+            _put(stage.inbox, _DONE, stopped)
+            with stage.lock:
+                stage.running -= 1
+                last = stage.running == 0
+            if last:
+                if stage.flush is not None:
+                    _process(stage, _DONE, outbox, stopped)
+                _put(outbox, _DONE, stopped)
+            return
+        _process(stage, item, outbox, stopped)
+
+def _feed(source, inbox, stopped):
+    for item in source:
+        if not _put(inbox, item, stopped):
+            return
+    _put(inbox, _DONE, stopped)
+
+# Run source through the stages. Each stage but the last gets its own worker threads, the last one
+# runs here. Returns per-stage metrics; progress(metrics) is called on every sample if given.
+def run_pipeline(source, stages, progress=None):
+    stopped = threading.Event()
+    finished = threading.Event()
+    threads = [threading.Thread(target=_feed, args=(source, stages[0].inbox, stopped), daemon=True)]
+    for stage, next_stage in zip(stages, stages[1:]):
+        stage.running = stage.workers
+        for _ in range(stage.workers):
+            threads.append(threading.Thread(target=_worker, args=(stage, next_stage.inbox, stopped), daemon=True))
+
+    start = time.perf_counter()
+
+    def monitor():
+        while not finished.wait(SAMPLE_INTERVAL):
+            for stage in stages:
+                stage.sample_depth()
+            if progress is not None:
+                progress(pipeline_metrics(stages, time.perf_counter() - start))
+
+    threads.append(threading.Thread(target=monitor, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    writer = stages[-1]
+    writer.running = 1
+    try:
+        while True:
+            item = _get(writer.inbox, stopped)
+            if item is _DONE:
+                if writer.flush is not None:
+                    _process(writer, _DONE, None, stopped, raise_errors=True)
+                break
+            _process(writer, item, None, stopped, raise_errors=True)
+    finally:
+        # on an error in the writer the other stages are stopped instead of waiting on full queues
+        stopped.set()
+        finished.set()
+    return pipeline_metrics(stages, time.perf_counter() - start)
+
+def pipeline_metrics(stages, elapsed):
+    return {"elapsed": elapsed, "stages": {stage.name: stage.metrics(elapsed) for stage in stages}}
+
+def print_metrics(metrics):
+    print(f"## Pipeline finished in {metrics['elapsed']:.1f}s")
+    for name, stage in metrics["stages"].items():
+        print(f"# {name:<8} workers={stage['workers']} in={stage['items_in']} out={stage['items_out']} "
+              f"errors={stage['errors']} {stage['throughput']:.1f}/s utilization={stage['utilization']:.0%} "
+              f"queue mean={stage['mean_queue_depth']:.1f} max={stage['max_queue_depth']}")
@@ -0,0 +1,136 @@
+import json
+import time
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+
+PUBMED_URL = "https://pubmed.ncbi.nlm.nih.gov/"
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+# efetch returns up to this many MEDLINE records per request
+EFETCH_BATCH = 200
+
+try:
+    NCBI_API_KEY = open("ncbi.txt", "r").read().strip()
+except FileNotFoundError:
+    NCBI_API_KEY = None
+
+# NCBI asks for no more than 3 requests per second from one client (10 with an API key)
+REQUESTS_PER_SECOND = 10 if NCBI_API_KEY else 3
+# Concurrent downloads, also the size of the connection pool
+WORKERS = 4
+# Retries of a failed request, waiting BACKOFF * 2**attempt seconds (or the server's Retry-After)
+MAX_RETRIES = 4
+BACKOFF = 0.5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+TIMEOUT = 30
+
+# Token bucket shared by every worker thread. With burst=1 requests are spaced 1/rate seconds apart.
+class RateLimiter:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+# One keep-alive session for the whole crawl, with a pool large enough for every worker
+def make_session(pool_size=WORKERS):
+    new_session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    new_session.mount("http://", adapter)
+    new_session.mount("https://", adapter)
+    return new_session
+
+session = make_session()
+limiter = RateLimiter(REQUESTS_PER_SECOND)
+
+def configure(rate=REQUESTS_PER_SECOND, workers=WORKERS):
+    global session, limiter, WORKERS
+    WORKERS = workers
+    session = make_session(workers)
+    limiter = RateLimiter(rate)
+
+# Rate limited GET with retry and exponential backoff, returns the response body
+def get(url, params=None):
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.acquire()
+        try:
+            response = session.get(url, params=params, timeout=TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(BACKOFF * 2 ** attempt)
+            continue
+        if response.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+            retry_after = response.headers.get("Retry-After")
+            time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else BACKOFF * 2 ** attempt)
+            continue
+        response.raise_for_status()
+        return response.text
+
+def article_url(article_id):
+    return f"{PUBMED_URL}{article_id}/?format=pubmed"
+
+# Download url_for(item) for every item on a bounded thread pool. Yields (item, text) in arrival order,
+# text is None when the request failed for good. At most 2 * workers downloads are held in flight.
+# params_for(item) optionally supplies the query parameters of each request.
+def fetch_all(items, url_for=article_url, workers=None, params_for=None):
+    workers = workers or WORKERS
+    items = iter(items)
+
+    def submit(executor, item):
+        return executor.submit(get, url_for(item), params_for(item) if params_for else None)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {submit(executor, item): item for item in islice(items, workers * 2)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    text = future.result()
+                except requests.RequestException as e:
+                    print(" ? Failed to fetch ", url_for(item), ": ", e)
+                    text = None
+                for next_item in islice(items, 1):
+                    pending[submit(executor, next_item)] = next_item
+                yield item, text
+
+def _eutils_params(params):
+    params = {"db": "pubmed", "tool": "buph-decolonization", **params}
+    if NCBI_API_KEY:
+        params["api_key"] = NCBI_API_KEY
+    return params
+
+# PMIDs matching a PubMed search term, most recent first (the default order of esearch)
+def esearch(term, retstart=0, retmax=100):
+    text = get(EUTILS_URL + "esearch.fcgi",
+               _eutils_params({"term": term, "retstart": retstart, "retmax": retmax, "retmode": "json"}))
+    return [int(pmid) for pmid in json.loads(text)["esearchresult"]["idlist"]]
+
+def efetch_params(pmids):
+    return _eutils_params({"id": ",".join(str(pmid) for pmid in pmids), "rettype": "medline", "retmode": "text"})
+
+# Raw MEDLINE text of a list of PMIDs, records separated by blank lines
+def efetch_medline(pmids):
+    return get(EUTILS_URL + "efetch.fcgi", efetch_params(pmids))
+
+# efetch the PMIDs EFETCH_BATCH at a time, concurrently. Yields (batch, MEDLINE text) in arrival order.
+def efetch_all(pmids, batch_size=EFETCH_BATCH, workers=None):
+    pmids = list(pmids)
+    batches = [tuple(pmids[i:i + batch_size]) for i in range(0, len(pmids), batch_size)]
+    return fetch_all(batches, lambda batch: EUTILS_URL + "efetch.fcgi", workers, efetch_params)
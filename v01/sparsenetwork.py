@@ -0,0 +1,130 @@
+import numpy as np
+from scipy import sparse
+from networkx.exception import PowerIterationFailedConvergence
+# storage library for this project
+import storage
+
+# Sort order of journal titles, untitled (None) last
+def _journal_key(journal):
+    return (journal is None, journal or "")
+
+# The co-authorship network as a sparse node x article incidence matrix B, 1 where a department (or site)
+# has an author on the article. B·Bᵀ counts the articles two nodes share, the weights of storage.get_edges,
+# and keeping only the columns of some journals gives the network of those journals.
+# Rows follow node_ids and columns article_ids.
+class SparseNetwork:
+    def __init__(self, node_ids, incidence, article_journals):
+        self.node_ids = np.asarray(node_ids)
+        self.index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.article_ids = np.array([article_id for article_id, _ in article_journals], dtype=np.int64)
+        columns = {article_id: j for j, article_id in enumerate(self.article_ids.tolist())}
+        self.journals = sorted({journal for _, journal in article_journals}, key=_journal_key)
+        journal_index = {journal: k for k, journal in enumerate(self.journals)}
+        self.article_journals = np.array([journal_index[journal] for _, journal in article_journals], dtype=np.int64)
+
+        pairs = [(self.index[node_id], columns[article_id]) for node_id, article_id in incidence
+                 if node_id in self.index and article_id in columns]
+        rows = np.array([row for row, _ in pairs], dtype=np.int64)
+        cols = np.array([col for _, col in pairs], dtype=np.int64)
+        self.incidence = sparse.csr_matrix((np.ones(len(pairs)), (rows, cols)),
+                                           shape=(len(self.node_ids), len(self.article_ids)))
+        self._adjacency = {}
+
+    # Boolean mask over the article columns of the given journal titles
+    def journal_mask(self, journals):
+        journals = set(journals)
+        wanted = [k for k, journal in enumerate(self.journals) if journal in journals]
+        return np.isin(self.article_journals, wanted)
+
+    # Weighted adjacency (shared articles, zero diagonal) over all articles or only those of some journals
+    def adjacency(self, journals=None):
+        key = None if journals is None else tuple(sorted(set(journals), key=_journal_key))
+        if key not in self._adjacency:
+            B = self.incidence if key is None else self.incidence[:, self.journal_mask(key)]
+            A = (B @ B.T).tocsr()
+            A.setdiag(0)
+            A.eliminate_zeros()
+            self._adjacency[key] = A
+        return self._adjacency[key]
+
+    # {node_id: value} of a per-node array, shaped like the NetworkX metric results
+    def to_dict(self, values):
+        return dict(zip(self.node_ids.tolist(), np.asarray(values).tolist()))
+
+# Every department (or site) with its articles, isolated nodes included as in network.load_graph
+def load_network(level='department'):
+    nodes = storage.retrieve_all_sites() if level == 'site' else storage.retrieve_all_departments()
+    return SparseNetwork([node[0] for node in nodes], storage.get_incidence(level), storage.get_article_journals())
+
+def degree(A):
+    return np.diff(A.indptr)
+
+def weighted_degree(A):
+    return np.asarray(A.sum(axis=1)).ravel()
+
+# nx.degree_centrality
+def degree_centrality(A):
+    n = A.shape[0]
+    return degree(A) / (n - 1) if n > 1 else np.ones(n)
+
+# nx.eigenvector_centrality(G, weight='weight'): power iteration on A + I from a uniform start,
+# L2-normalized, stopping once the L1 change drops below n * tol
+def eigenvector_centrality(A, max_iter=500, tol=1e-6):
+    n = A.shape[0]
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        x_last = x
+        x = x_last + A @ x_last
+        norm = np.linalg.norm(x) or 1.0
+        x = x / norm
+        if np.abs(x - x_last).sum() < n * tol:
+            return x
+    raise PowerIterationFailedConvergence(max_iter)
+
+# nx.clustering: triangles through each node over the pairs of its neighbours. Weighted, the triangles
+# count with the geometric mean of their edge weights normalized by the largest weight.
+def clustering(A, weighted=False):
+    W = A.copy()
+    if weighted and W.nnz:
+        W.data = np.cbrt(W.data / W.data.max())
+    else:
+        W.data = np.ones_like(W.data)
+    triangles = np.asarray((W @ W).multiply(W).sum(axis=1)).ravel()
+    d = degree(A).astype(np.float64)
+    possible = d * (d - 1)
+    return np.divide(triangles, possible, out=np.zeros_like(triangles), where=possible > 0)
+
+# nx.average_clustering, zero-clustering nodes included
+def average_clustering(A, weighted=False):
+    return float(clustering(A, weighted).mean()) if A.shape[0] else 0.0
+
+# Compare the sparse metrics with NetworkX on the graph of network.load_graph at the same level
+def check_against_networkx(level='department', journals=None, tol=1e-6):
+    import networkx as nx
+    import network
+    net = load_network(level)
+    G = network.load_graph(level)
+    if journals is not None:
+        G = G.edge_subgraph([(u, v) for u, v, js in G.edges(data="journals") if set(js) & set(journals)]).copy()
+        G.add_nodes_from(net.node_ids.tolist())
+        for u, v, js in G.edges(data="journals"):
+            G[u][v]["weight"] = sum(count for journal, count in js.items() if journal in journals)
+    A = net.adjacency(journals)
+    assert A.nnz == 2 * G.number_of_edges()
+    assert net.to_dict(degree(A)) == dict(G.degree())
+    assert net.to_dict(weighted_degree(A)) == dict(G.degree(weight="weight"))
+    for name, ours, theirs in [
+        ("degree centrality", degree_centrality(A), nx.degree_centrality(G)),
+        ("clustering", clustering(A), nx.clustering(G)),
+        ("weighted clustering", clustering(A, weighted=True), nx.clustering(G, weight="weight")),
+        ("eigenvector centrality", eigenvector_centrality(A), nx.eigenvector_centrality(G, weight="weight", max_iter=500)),
+    ]:
+        ours = net.to_dict(ours)
+        worst = max((abs(ours[node] - theirs[node]) for node in theirs), default=0.0)
+        assert worst < tol, f"{name} differs from NetworkX by {worst}"
+    return True
+
+if __name__ == "__main__":
+    storage.instantiate()
+    for level in ('department', 'site'):
+        print(level, check_against_networkx(level))
@@ -1,9 +1,90 @@
 import sqlite3
 import math
+# vectorized great-circle distances
+import geodistance
+
+DB_PATH = 'pubmed.db'
+# Number of articles written per transaction by ingest_articles
+INGEST_BATCH_SIZE = 100
+# Departments closer than this many km are merged into one site by assign_sites
+SITE_DISTANCE = 1.0
+
+# Month numbers of the MEDLINE DP field, seasons map to their first month
+_MONTHS = {name: i for i, name in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+                                             'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+_MONTHS.update({'spring': 3, 'summer': 6, 'fall': 9, 'autumn': 9, 'winter': 12})
+
+# Publication date ("2024 Aug 8", "2024 Aug", "2024 Jul-Aug", "2023 Dec-2024 Jan", "1998-1999", "2023 Winter", "2024")
+# as an integer YYYYMMDD that sorts and compares like the date, a missing month or day counting as the
+# first. A range counts from its start. None when there is no year.
+def publication_date(date_published):
+    if not date_published:
+        return None
+    parts = date_published.replace('-', ' ').split()
+    if not parts[0][:4].isdigit():
+        return None
+    year, month, day = int(parts[0][:4]), 1, 1
+    # a 4 digit second part is the end year of a range ("1998-1999"), which counts from its first day
+    if len(parts) > 1 and not (parts[1].isdigit() and len(parts[1]) == 4):
+        month = int(parts[1]) if parts[1].isdigit() else _MONTHS.get(parts[1][:3].lower(), _MONTHS.get(parts[1].lower(), 1))
+        # only a 1-2 digit number is a day, the "2024" of "2023 Dec-2024 Jan" starts the end of a range
+        if len(parts) > 2 and parts[2].isdigit() and len(parts[2]) <= 2:
+            day = int(parts[2])
+    return year * 10000 + min(max(month, 1), 12) * 100 + min(max(day, 1), 31)
+
+# SQL functions of this module, registered on every connection
+def _register_functions(connection):
+    connection.create_function('publication_date', 1, publication_date, deterministic=True)
 
 # Connect to the database
-conn = sqlite3.connect('pubmed.db')
+conn = sqlite3.connect(DB_PATH)
 cursor = conn.cursor()
+_register_functions(conn)
+
+# In-process caches of normalized name -> id for the deduplicated dimension tables
+_author_ids = {}
+_department_ids = {}
+# keys of the cached departments written without coordinates (0, 0), they still take the first real ones
+_unlocated_departments = set()
+
+def clear_caches():
+    _author_ids.clear()
+    _department_ids.clear()
+    _unlocated_departments.clear()
+
+# True when a department has to go through _UPSERT_DEPARTMENT: it is not cached yet, or it was stored
+# without coordinates and now comes with some
+def _department_needs_upsert(key, latitude, longitude):
+    return key not in _department_ids or (key in _unlocated_departments and (latitude != 0 or longitude != 0))
+
+def _track_unlocated(key, latitude, longitude):
+    if latitude == 0 and longitude == 0:
+        _unlocated_departments.add(key)
+    else:
+        _unlocated_departments.discard(key)
+
+# Point the module at another database file (benchmarks and scratch copies of pubmed.db)
+def connect(path=DB_PATH):
+    global conn, cursor
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    _register_functions(conn)
+    clear_caches()
+    return conn
+
+# Normalized key for author and department names. Case, whitespace and trailing punctuation
+# differences ("..., Stanford, CA, USA. " vs "..., Stanford, CA, USA") collapse onto one row.
+def normalize_name(name):
+    return " ".join(name.lower().split()).strip(" .,;")
+
+# Switch the journal mode of the connection. In WAL mode a commit is an append to the log
+# instead of a rewrite of the database pages, and readers are not blocked while we ingest.
+def set_journal_mode(mode='WAL', synchronous='NORMAL'):
+    cursor.execute(f'PRAGMA journal_mode={mode}')
+    result = cursor.fetchone()[0]
+    if synchronous is not None:
+        cursor.execute(f'PRAGMA synchronous={synchronous}')
+    return result
 
 # Create Articles Table
 def instantiate():
@@ -47,29 +128,322 @@ def instantiate():
     )
     ''')
 
+    migrate()
+
+def _add_column_if_missing(table, column, column_type):
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+# Point every ArticleAuthors row at the first row of each group of duplicates (by key_column,
+# in the given order) and delete the rest. Returns the number of rows removed.
+def _collapse_duplicates(table, id_column, key_column, order):
+    cursor.execute('DROP TABLE IF EXISTS temp.remap')
+    cursor.execute(f'''
+    CREATE TEMP TABLE remap AS
+    SELECT {id_column} AS old_id,
+           FIRST_VALUE({id_column}) OVER (PARTITION BY {key_column} ORDER BY {order}) AS new_id
+    FROM {table}
+    ''')
+    cursor.execute('DELETE FROM temp.remap WHERE old_id = new_id')
+    cursor.execute(f'''
+    UPDATE ArticleAuthors
+    SET {id_column} = (SELECT new_id FROM temp.remap WHERE old_id = ArticleAuthors.{id_column})
+    WHERE {id_column} IN (SELECT old_id FROM temp.remap)
+    ''')
+    cursor.execute(f'DELETE FROM {table} WHERE {id_column} IN (SELECT old_id FROM temp.remap)')
+    removed = cursor.rowcount
+    cursor.execute('DROP TABLE temp.remap')
+    return removed
+
+# Migration 1: give Authors and Departments a normalized key, collapse the rows that were
+# inserted once per authorship onto one row per key and enforce it with a UNIQUE index.
+# Of duplicate departments we keep the geolocated one, (0, 0) rows only survive if nothing better exists.
+def dedupe_dimensions():
+    conn.create_function('normalize_name', 1, normalize_name, deterministic=True)
+    _add_column_if_missing('Authors', 'authorKey', 'TEXT')
+    _add_column_if_missing('Departments', 'departmentKey', 'TEXT')
+    cursor.execute('UPDATE Authors SET authorKey = normalize_name(authorName) WHERE authorKey IS NULL')
+    cursor.execute('UPDATE Departments SET departmentKey = normalize_name(departmentName) WHERE departmentKey IS NULL')
+
+    removed_authors = _collapse_duplicates('Authors', 'author_id', 'authorKey', 'author_id')
+    removed_departments = _collapse_duplicates('Departments', 'department_id', 'departmentKey',
+                                               '(latitude = 0 AND longitude = 0), department_id')
+
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_authors_key ON Authors(authorKey)')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_departments_key ON Departments(departmentKey)')
+    clear_caches()
+    return removed_authors, removed_departments
+
+# Migration 2: index the ArticleAuthors join table in both article <-> department directions and by author.
+# (article_id, department_id) also covers the self-join in get_article_department_links.
+def index_article_authors():
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_articleauthors_article_department ON ArticleAuthors(article_id, department_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_articleauthors_department_article ON ArticleAuthors(department_id, article_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_articleauthors_author ON ArticleAuthors(author_id)')
+    cursor.execute('ANALYZE')
+
+# Migration 3: PMID of every article (unique, NULL for rows stored before we kept it) and the crawl state
+# of fetchArticles: the last finished results page per query and the progress of every PMID.
+def add_crawl_state():
+    _add_column_if_missing('Articles', 'pmid', 'INTEGER')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_articles_pmid ON Articles(pmid)')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS CrawlQueries (
+        query TEXT PRIMARY KEY,
+        last_page INTEGER NOT NULL,
+        updated REAL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS CrawlArticles (
+        pmid INTEGER PRIMARY KEY,
+        query TEXT,
+        status TEXT NOT NULL,
+        updated REAL
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_crawlarticles_query_status ON CrawlArticles(query, status)')
+
+# Migration 4: R*Tree over department coordinates (a point is a zero-size box), kept in sync with
+# Departments by triggers so every insert, upsert, merge and purge is reflected.
+def add_spatial_index():
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS DepartmentLocations USING rtree(
+        department_id, minLat, maxLat, minLon, maxLon
+    )
+    ''')
+    cursor.execute('DELETE FROM DepartmentLocations')
+    cursor.execute('''
+    INSERT INTO DepartmentLocations (department_id, minLat, maxLat, minLon, maxLon)
+    SELECT department_id, latitude, latitude, longitude, longitude FROM Departments
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS departments_locations_insert AFTER INSERT ON Departments
+    WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO DepartmentLocations (department_id, minLat, maxLat, minLon, maxLon)
+        VALUES (NEW.department_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS departments_locations_update AFTER UPDATE OF latitude, longitude ON Departments
+    BEGIN
+        DELETE FROM DepartmentLocations WHERE department_id = OLD.department_id;
+        INSERT INTO DepartmentLocations (department_id, minLat, maxLat, minLon, maxLon)
+        SELECT NEW.department_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+        WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS departments_locations_delete AFTER DELETE ON Departments
+    BEGIN
+        DELETE FROM DepartmentLocations WHERE department_id = OLD.department_id;
+    END
+    ''')
+
+# Migration 5: sites, the places that departments within SITE_DISTANCE km of each other are merged into
+# (see assign_sites), and the site of every department. site_id stays NULL until assign_sites runs.
+def add_sites():
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Sites (
+        site_id INTEGER PRIMARY KEY,
+        siteName TEXT NOT NULL,
+        latitude REAL,
+        longitude REAL,
+        departmentCount INTEGER NOT NULL
+    )
+    ''')
+    _add_column_if_missing('Departments', 'site_id', 'INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_departments_site ON Departments(site_id)')
+
+# Migration 6: cache of calculate_graph_metrics results (pickled), keyed by the data fingerprint and the
+# metric parameters, see network.cached_graph_metrics
+def add_graph_metrics_cache():
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS GraphMetrics (
+        cacheKey TEXT PRIMARY KEY,
+        level TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        parameters TEXT NOT NULL,
+        metrics BLOB NOT NULL,
+        seconds REAL,
+        created REAL
+    )
+    ''')
+
+# Migration 7: country of every department (countries.COUNTRY_PROPERTY of the country polygon holding it),
+# NULL until assign_countries runs or where no country contains the department
+def add_country_codes():
+    _add_column_if_missing('Departments', 'country_code', 'TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_departments_country ON Departments(country_code)')
+
+# Migration 8: rollup tables of the questions the notebooks recompute from get_article_department_links,
+# kept up to date by refresh_rollups on every ingest (see _apply_rollup_deltas):
+#   DepartmentEdges     articles shared by every pair of departments (get_edges without the journals)
+#   DepartmentDegrees   per department its collaborating departments, the articles it shares with them
+#                       summed over those departments, and its own articles
+#   CountryEdges        articles shared by every pair of countries (get_edges('country'))
+#   JournalDepartments  articles of every department in every journal (untitled journals left out)
+# RollupState holds the ArticleAuthors rowid and row count the rollups reflect.
+def add_rollups():
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS DepartmentEdges (
+        department_a INTEGER NOT NULL,
+        department_b INTEGER NOT NULL,
+        articles INTEGER NOT NULL,
+        PRIMARY KEY (department_a, department_b)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_departmentedges_b ON DepartmentEdges(department_b)')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS DepartmentDegrees (
+        department_id INTEGER PRIMARY KEY,
+        degree INTEGER NOT NULL,
+        collaborations INTEGER NOT NULL,
+        articles INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_departmentdegrees_collaborations ON DepartmentDegrees(collaborations DESC, department_id)')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS CountryEdges (
+        country_a TEXT NOT NULL,
+        country_b TEXT NOT NULL,
+        articles INTEGER NOT NULL,
+        PRIMARY KEY (country_a, country_b)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS JournalDepartments (
+        journalTitle TEXT NOT NULL,
+        department_id INTEGER NOT NULL,
+        articles INTEGER NOT NULL,
+        PRIMARY KEY (journalTitle, department_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS RollupState (
+        state_id INTEGER PRIMARY KEY CHECK (state_id = 0),
+        articleAuthorRowid INTEGER NOT NULL,
+        articleAuthorRows INTEGER NOT NULL
+    )
+    ''')
+    _refresh_rollups()
+
+# Migration 9: publication date of every article as a publication_date integer (YYYYMMDD, NULL without a
+# year), indexed so the graph of a time window (get_edges_between) starts from the articles in it
+def add_published_dates():
+    _add_column_if_missing('Articles', 'publishedDate', 'INTEGER')
+    cursor.execute('UPDATE Articles SET publishedDate = publication_date(datePublished) WHERE publishedDate IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_articles_published ON Articles(publishedDate)')
+
+# Migration 10: ArticleAuthors gets an AUTOINCREMENT key. The rollups and incremental.py read the rows after
+# a remembered rowid; a plain rowid can be handed out again once the newest row is deleted, and a row reusing
+# it would never be seen. SQLite cannot add AUTOINCREMENT to a table, so it is rebuilt with the rows keeping
+# their rowids (the remembered positions stay valid) and the sequence starting above any rowid RollupState
+# remembers.
+def add_article_author_ids():
+    cursor.execute('''
+    CREATE TABLE ArticleAuthors_new (
+        article_author_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        article_id INTEGER,
+        author_id INTEGER,
+        department_id INTEGER,
+        FOREIGN KEY (article_id) REFERENCES Articles(article_id),
+        FOREIGN KEY (author_id) REFERENCES Authors(author_id),
+        FOREIGN KEY (department_id) REFERENCES Departments(department_id)
+    )
+    ''')
+    cursor.execute('''
+    INSERT INTO ArticleAuthors_new (article_author_id, article_id, author_id, department_id)
+    SELECT rowid, article_id, author_id, department_id FROM ArticleAuthors ORDER BY rowid
+    ''')
+    cursor.execute('DROP TABLE ArticleAuthors')
+    cursor.execute('ALTER TABLE ArticleAuthors_new RENAME TO ArticleAuthors')
+    index_article_authors()
+    cursor.execute('SELECT COALESCE(MAX(articleAuthorRowid), 0) FROM RollupState')
+    remembered = cursor.fetchone()[0]
+    cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'ArticleAuthors'")
+    cursor.execute('''
+    INSERT INTO sqlite_sequence (name, seq)
+    SELECT 'ArticleAuthors', MAX(COALESCE(MAX(article_author_id), 0), ?) FROM ArticleAuthors
+    ''', (remembered,))
+
+# Schema migrations in order. PRAGMA user_version stores how many of them a database has applied,
+# so new steps are appended to the end and applied ones are never edited or reordered.
+MIGRATIONS = [
+    dedupe_dimensions,
+    index_article_authors,
+    add_crawl_state,
+    add_spatial_index,
+    add_sites,
+    add_graph_metrics_cache,
+    add_country_codes,
+    add_rollups,
+    add_published_dates,
+    add_article_author_ids,
+]
+
+def schema_version():
+    cursor.execute('PRAGMA user_version')
+    return cursor.fetchone()[0]
+
+# Bring the database up to the latest schema. Each step runs in its own transaction together with its version bump.
+def migrate():
+    version = schema_version()
+    for step, migration in enumerate(MIGRATIONS[version:], version + 1):
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            migration()
+            cursor.execute(f'PRAGMA user_version = {step}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            clear_caches()
+            raise
+    return schema_version()
+
 def insert_article(articleTitle, journalTitle, datePublished, abstract):
     cursor.execute('''
-    INSERT INTO Articles (articleTitle, journalTitle, datePublished, abstract)
-    VALUES (?, ?, ?, ?)
-    ''', (articleTitle, journalTitle, datePublished, abstract))
+    INSERT INTO Articles (articleTitle, journalTitle, datePublished, publishedDate, abstract)
+    VALUES (?, ?, ?, ?, ?)
+    ''', (articleTitle, journalTitle, datePublished, publication_date(datePublished), abstract))
     conn.commit()
     return cursor.lastrowid
 
+# Authors and departments are upserted on their normalized key: the id of an existing row is returned
+# instead of inserting a duplicate.
 def insert_author(authorName):
-    cursor.execute('''
-    INSERT INTO Authors (authorName)
-    VALUES (?)
-    ''', (authorName,))
-    conn.commit()
-    return cursor.lastrowid
+    key = normalize_name(authorName)
+    if key not in _author_ids:
+        cursor.execute('''
+        INSERT INTO Authors (authorName, authorKey)
+        VALUES (?, ?)
+        ON CONFLICT(authorKey) DO UPDATE SET authorKey = excluded.authorKey
+        RETURNING author_id
+        ''', (authorName, key))
+        _author_ids[key] = cursor.fetchone()[0]
+        conn.commit()
+    return _author_ids[key]
+
+# A department first stored without coordinates (0, 0) picks up the coordinates of a later insert.
+_UPSERT_DEPARTMENT = '''
+INSERT INTO Departments (departmentName, departmentKey, latitude, longitude)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(departmentKey) DO UPDATE SET
+    latitude = CASE WHEN latitude = 0 AND longitude = 0 THEN excluded.latitude ELSE latitude END,
+    longitude = CASE WHEN latitude = 0 AND longitude = 0 THEN excluded.longitude ELSE longitude END
+'''
 
 def insert_department(departmentName, latitude, longitude):
-    cursor.execute('''
-    INSERT INTO Departments (departmentName, latitude, longitude)
-    VALUES (?, ?, ?)
-    ''', (departmentName, latitude, longitude))
-    conn.commit()
-    return cursor.lastrowid
+    key = normalize_name(departmentName)
+    if _department_needs_upsert(key, latitude, longitude):
+        cursor.execute(_UPSERT_DEPARTMENT + 'RETURNING department_id', (departmentName, key, latitude, longitude))
+        _department_ids[key] = cursor.fetchone()[0]
+        _track_unlocated(key, latitude, longitude)
+        conn.commit()
+    return _department_ids[key]
 
 def tie_article_author_department(article_id, author_id, department_id):
     cursor.execute('''
@@ -79,34 +453,245 @@ def tie_article_author_department(article_id, author_id, department_id):
     conn.commit()
     return cursor.lastrowid
 
-# Retrieve all articles
+# Next id AUTOINCREMENT would hand out for a table. Only valid while we hold the write lock.
+def _next_id(table, id_column):
+    cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+    row = cursor.fetchone()
+    seq = row[0] if row else 0
+    cursor.execute(f'SELECT COALESCE(MAX({id_column}), 0) FROM {table}')
+    return max(seq, cursor.fetchone()[0]) + 1
+
+# Departments are either the raw affiliation string or the [departmentName, [lat, lon]]
+# pair returned by fetchArticles.CleanExtractDepartmentLocation.
+def _department_row(department):
+    if isinstance(department, str):
+        return (department, 0, 0)
+    name, location = department
+    if location is None or len(location) != 2:
+        return (name, 0, 0)
+    return (name, location[0], location[1])
+
+# Look up the ids of a set of keys, chunked to stay under SQLite's bound parameter limit
+def _ids_for_keys(table, id_column, key_column, keys, cache):
+    keys = list(keys)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        cursor.execute(f'''
+        SELECT {key_column}, {id_column} FROM {table}
+        WHERE {key_column} IN ({','.join('?' for _ in chunk)})
+        ''', chunk)
+        cache.update(cursor.fetchall())
+
+# Counters of ingest_articles for the current process
+ingest_stats = {"invalid": 0}
+
+# Raise ValueError for an article the schema would reject or store wrongly: no title (Articles.articleTitle
+# is NOT NULL), or author and department lists that do not pair up one to one
+def validate_article(article):
+    if article.get('articleTitle') is None:
+        raise ValueError(f"article {article.get('pmid')} has no title")
+    authors, departments = article.get('authorsList'), article.get('departmentList')
+    if authors is None or departments is None:
+        raise ValueError(f"article {article.get('pmid')} has no author or department list")
+    if len(authors) != len(departments):
+        raise ValueError(f"article {article.get('pmid')} has {len(authors)} authors but {len(departments)} departments")
+
+# Write a batch of parsed articles in one transaction, returns the new article ids. The articles are
+# validated before the transaction starts, an invalid one raises ValueError and nothing is written.
+# Without refresh_rollups the rollup tables are left behind until the next refresh_rollups().
+def _ingest_batch(articles, refresh_rollups=True):
+    for article in articles:
+        validate_article(article)
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        article_id = _next_id('Articles', 'article_id')
+
+        # articles whose PMID is already stored are skipped, also repeats within the batch
+        pmids = [article.get('pmid') for article in articles if article.get('pmid') is not None]
+        seen = _stored_pmids(pmids)
+
+        article_rows, author_rows, department_rows, ties = [], {}, {}, []
+        article_ids = []
+        for article in articles:
+            pmid = article.get('pmid')
+            if pmid is not None:
+                if pmid in seen:
+                    continue
+                seen.add(pmid)
+            article_rows.append((article_id, pmid, article['articleTitle'], article['journalTitle'],
+                                 article['datePublished'], publication_date(article['datePublished']), article['abstract']))
+            for author, department in zip(article['authorsList'], article['departmentList']):
+                author_key = normalize_name(author)
+                department_name, latitude, longitude = _department_row(department)
+                department_key = normalize_name(department_name)
+                if author_key not in _author_ids:
+                    author_rows.setdefault(author_key, (author, author_key))
+                if _department_needs_upsert(department_key, latitude, longitude):
+                    # a later mention with coordinates wins over one without
+                    row = department_rows.get(department_key)
+                    if row is None or (row[2] == 0 and row[3] == 0):
+                        department_rows[department_key] = (department_name, department_key, latitude, longitude)
+                ties.append((article_id, author_key, department_key))
+            article_ids.append(article_id)
+            article_id += 1
+
+        cursor.executemany('''
+        INSERT INTO Articles (article_id, pmid, articleTitle, journalTitle, datePublished, publishedDate, abstract)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', article_rows)
+        # only names missing from the cache reach the database, existing rows are left alone except for
+        # departments that get their first coordinates
+        cursor.executemany('''
+        INSERT INTO Authors (authorName, authorKey)
+        VALUES (?, ?)
+        ON CONFLICT(authorKey) DO NOTHING
+        ''', list(author_rows.values()))
+        cursor.executemany(_UPSERT_DEPARTMENT, list(department_rows.values()))
+        _ids_for_keys('Authors', 'author_id', 'authorKey', author_rows, _author_ids)
+        _ids_for_keys('Departments', 'department_id', 'departmentKey', department_rows, _department_ids)
+        for _, department_key, latitude, longitude in department_rows.values():
+            _track_unlocated(department_key, latitude, longitude)
+        cursor.executemany('''
+        INSERT INTO ArticleAuthors (article_id, author_id, department_id)
+        VALUES (?, ?, ?)
+        ''', [(a, _author_ids[author_key], _department_ids[department_key]) for a, author_key, department_key in ties])
+        # marked stored in the same transaction, so a crash never leaves a stored article marked unfinished
+        _set_pmid_status(pmids, 'stored')
+        if refresh_rollups:
+            _refresh_rollups()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        # ids cached during the failed transaction may not exist
+        clear_caches()
+        raise
+    return article_ids
+
+# Bulk ingest: takes parsed articles (dicts as returned by fetchArticles.getByArticleID, any iterable)
+# and writes them batch_size articles per transaction instead of committing every row.
+# Articles that failed to parse (False) or whose PMID is already stored are skipped, so are invalid
+# ones (see validate_article), counted in ingest_stats. Returns the ids of the stored articles in input order.
+# Bulk loads pass refresh_rollups=False and call refresh_rollups() once at the end instead of every batch.
+def ingest_articles(articles, batch_size=INGEST_BATCH_SIZE, refresh_rollups=True):
+    article_ids = []
+    batch = []
+    for article in articles:
+        if not article:
+            continue
+        try:
+            validate_article(article)
+        except ValueError as e:
+            ingest_stats["invalid"] += 1
+            print(f"Skipping invalid article: {e}")
+            continue
+        batch.append(article)
+        if len(batch) >= batch_size:
+            article_ids += _ingest_batch(batch, refresh_rollups)
+            batch = []
+    if batch:
+        article_ids += _ingest_batch(batch, refresh_rollups)
+    return article_ids
+
+# Single article version of ingest_articles. Returns the new article id, or the id the article is already
+# stored under when its PMID is known.
+def ingest_article(article):
+    article_ids = _ingest_batch([article])
+    if article_ids:
+        return article_ids[0]
+    cursor.execute('SELECT article_id FROM Articles WHERE pmid = ?', (article.get('pmid'),))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+# Crawl state. A PMID moves through fetched -> parsed -> geocoded -> stored; everything short of
+# stored is redone by the next run.
+CRAWL_STATUSES = ('fetched', 'parsed', 'geocoded', 'stored')
+
+def _chunks(values, size=500):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def _stored_pmids(pmids):
+    stored = set()
+    for chunk in _chunks(pmids):
+        cursor.execute(f'''
+        SELECT pmid FROM Articles WHERE pmid IN ({','.join('?' for _ in chunk)})
+        ''', chunk)
+        stored.update(row[0] for row in cursor.fetchall())
+    return stored
+
+def _set_pmid_status(pmids, status, query=None):
+    assert status in CRAWL_STATUSES
+    cursor.executemany('''
+    INSERT INTO CrawlArticles (pmid, query, status, updated)
+    VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+    ON CONFLICT(pmid) DO UPDATE SET
+        status = excluded.status,
+        query = COALESCE(excluded.query, query),
+        updated = excluded.updated
+    ''', [(pmid, query, status) for pmid in pmids if pmid is not None])
+
+# Record the progress of a list of PMIDs, optionally tying them to the query that found them
+def set_pmid_status(pmids, status, query=None):
+    _set_pmid_status(pmids, status, query)
+    conn.commit()
+
+# Which of these PMIDs are already in Articles
+def stored_pmids(pmids):
+    return _stored_pmids(pmids)
+
+def pmids_with_status(status, query=None):
+    if query is None:
+        cursor.execute('SELECT pmid FROM CrawlArticles WHERE status = ?', (status,))
+    else:
+        cursor.execute('SELECT pmid FROM CrawlArticles WHERE query = ? AND status = ?', (query, status))
+    return [row[0] for row in cursor.fetchall()]
+
+# Last results page of a query that was completely stored, 0 if the query never finished a page
+def get_query_progress(query):
+    cursor.execute('SELECT last_page FROM CrawlQueries WHERE query = ?', (query,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def record_query_page(query, page):
+    cursor.execute('''
+    INSERT INTO CrawlQueries (query, last_page, updated)
+    VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+    ON CONFLICT(query) DO UPDATE SET
+        last_page = MAX(last_page, excluded.last_page),
+        updated = excluded.updated
+    ''', (query, page))
+    conn.commit()
+
+# Retrieve all articles. The retrieval functions return the original columns only, the key,
+# PMID and other bookkeeping columns added by migrations are left out.
 def retrieve_all_articles():
-    cursor.execute('SELECT * FROM Articles')
+    cursor.execute('SELECT article_id, articleTitle, journalTitle, datePublished, abstract FROM Articles')
     return cursor.fetchall()
 
 # Retrieve article by ID
 def retrieve_article_by_id(article_id):
-    cursor.execute('SELECT * FROM Articles WHERE article_id = ?', (article_id,))
+    cursor.execute('SELECT article_id, articleTitle, journalTitle, datePublished, abstract FROM Articles WHERE article_id = ?', (article_id,))
     return cursor.fetchone()
 
 # Retrieve all authors
 def retrieve_all_authors():
-    cursor.execute('SELECT * FROM Authors')
+    cursor.execute('SELECT author_id, authorName FROM Authors')
     return cursor.fetchall()
 
 # Retrieve author by ID
 def retrieve_author_by_id(author_id):
-    cursor.execute('SELECT * FROM Authors WHERE author_id = ?', (author_id,))
+    cursor.execute('SELECT author_id, authorName FROM Authors WHERE author_id = ?', (author_id,))
     return cursor.fetchone()
 
 # Retrieve all departments
 def retrieve_all_departments():
-    cursor.execute('SELECT * FROM Departments')
+    cursor.execute('SELECT department_id, departmentName, latitude, longitude FROM Departments')
     return cursor.fetchall()
 
 # Retrieve department by ID
 def retrieve_department_by_id(department_id):
-    cursor.execute('SELECT * FROM Departments WHERE department_id = ?', (department_id,))
+    cursor.execute('SELECT department_id, departmentName, latitude, longitude FROM Departments WHERE department_id = ?', (department_id,))
     return cursor.fetchone()
 
 # Retrieve all articles by a specific author
@@ -181,19 +766,61 @@ def haversine(lat1, lon1, lat2, lon2):
     distance = R * c
     return distance
 
+EARTH_RADIUS = 6371.0  # km, as in haversine
+
+# Latitude/longitude boxes that contain every point within radius km of the center. Near a pole the box
+# spans all longitudes, across the antimeridian it is split in two.
+def _bounding_boxes(center_lat, center_lon, radius):
+    angular = radius / EARTH_RADIUS
+    min_lat = center_lat - math.degrees(angular)
+    max_lat = center_lat + math.degrees(angular)
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        return [(max(min_lat, -90), min(max_lat, 90), -180, 180)]
+    dlon = math.degrees(math.asin(min(1.0, math.sin(angular) / math.cos(math.radians(center_lat)))))
+    min_lon, max_lon = center_lon - dlon, center_lon + dlon
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180), (min_lat, max_lat, -180, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180), (min_lat, max_lat, -180, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+# Departments in the R*Tree cells overlapping the bounding boxes of the radius, before the exact distance check
+def _departments_near(center_lat, center_lon, radius):
+    candidates = []
+    for min_lat, max_lat, min_lon, max_lon in _bounding_boxes(center_lat, center_lon, radius):
+        cursor.execute('''
+        SELECT d.department_id, d.departmentName, d.latitude, d.longitude
+        FROM DepartmentLocations r
+        JOIN Departments d ON d.department_id = r.department_id
+        WHERE r.maxLat >= ? AND r.minLat <= ? AND r.maxLon >= ? AND r.minLon <= ?
+        ''', (min_lat, max_lat, min_lon, max_lon))
+        candidates += cursor.fetchall()
+    return candidates
+
+# Candidates of _departments_near within radius km, as (department_id, departmentName, lat, lon, distance)
+def _departments_within(center_lat, center_lon, radius):
+    candidates = _departments_near(center_lat, center_lon, radius)
+    if not candidates:
+        return []
+    distances = geodistance.haversine_many(center_lat, center_lon,
+                                           [dept[2] for dept in candidates], [dept[3] for dept in candidates])
+    return [dept + (float(distance),) for dept, distance in zip(candidates, distances) if distance <= radius]
+
 # Function to retrieve all departments within a radius
 def get_departments_within_radius(center_lat, center_lon, radius):
-    cursor.execute('SELECT departmentName, latitude, longitude FROM Departments')
-    departments = cursor.fetchall()
-    
-    nearby_departments = {}
-    for dept in departments:
-        dept_name, lat, lon = dept
-        distance = haversine(center_lat, center_lon, lat, lon)
-        if distance <= radius:
-            nearby_departments[dept_name] = (lat, lon)
-    
-    return nearby_departments
+    return {dept_name: (lat, lon) for _, dept_name, lat, lon, _ in _departments_within(center_lat, center_lon, radius)}
+
+# The k departments closest to a point as (department_id, departmentName, latitude, longitude, distance),
+# nearest first. The search radius doubles until k departments lie within it, so only nearby cells are read.
+def get_nearest_departments(center_lat, center_lon, k, start_radius=10.0):
+    radius = start_radius
+    while True:
+        found = _departments_within(center_lat, center_lon, radius)
+        # beyond half the circumference the radius covers the whole globe
+        if len(found) >= k or radius >= math.pi * EARTH_RADIUS:
+            found.sort(key=lambda dept: dept[4])
+            return found[:k]
+        radius *= 2
 
 # Retrieve all shared articles between departments along with the journal title
 def get_article_department_links():
@@ -206,6 +833,674 @@ def get_article_department_links():
     ''')
     return cursor.fetchall()
 
+# Recompute the sites from scratch: every geolocated department gets the site_id of its proximity cluster,
+# named after the department nearest the centroid. Ungeolocated and (0, 0) departments get no site.
+# Returns the number of sites.
+def assign_sites(distance_threshold=SITE_DISTANCE):
+    cursor.execute('''
+    SELECT department_id, departmentName, latitude, longitude FROM Departments
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND NOT (latitude = 0 AND longitude = 0)
+    ORDER BY department_id
+    ''')
+    departments = cursor.fetchall()
+    lats = [dept[2] for dept in departments]
+    lons = [dept[3] for dept in departments]
+    labels = geodistance.cluster_by_proximity(lats, lons, distance_threshold)
+    site_lats, site_lons, representatives, counts = geodistance.cluster_sites(lats, lons, labels)
+
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('UPDATE Departments SET site_id = NULL WHERE site_id IS NOT NULL')
+        cursor.execute('DELETE FROM Sites')
+        cursor.executemany('INSERT INTO Sites (site_id, siteName, latitude, longitude, departmentCount) VALUES (?, ?, ?, ?, ?)',
+                           [(site + 1, departments[representative][1], float(site_lats[site]), float(site_lons[site]), int(counts[site]))
+                            for site, representative in enumerate(representatives)])
+        cursor.executemany('UPDATE Departments SET site_id = ? WHERE department_id = ?',
+                           [(int(label) + 1, dept[0]) for dept, label in zip(departments, labels)])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(site_lats)
+
+# Look up the country of the geolocated departments in the polygons of a country GeoJSON file, all in one
+# bulk STRtree query, and store it as Departments.country_code. Only departments without a country are
+# looked up unless refresh is set (another file or property). Returns the number of departments assigned.
+def assign_countries(path=None, country_property=None, refresh=False):
+    # point-in-country lookups, imported here so that shapely is only needed by this step
+    import countries
+    path = countries.COUNTRIES_PATH if path is None else path
+    country_property = countries.COUNTRY_PROPERTY if country_property is None else country_property
+    cursor.execute(f'''
+    SELECT department_id, latitude, longitude FROM Departments
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND NOT (latitude = 0 AND longitude = 0)
+    {'' if refresh else 'AND country_code IS NULL'}
+    ORDER BY department_id
+    ''')
+    departments = cursor.fetchall()
+    codes = countries.countries_of_points([dept[1] for dept in departments], [dept[2] for dept in departments],
+                                          path, country_property)
+
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        if refresh:
+            cursor.execute('UPDATE Departments SET country_code = NULL WHERE country_code IS NOT NULL')
+        cursor.executemany('UPDATE Departments SET country_code = ? WHERE department_id = ?',
+                           [(code, dept[0]) for dept, code in zip(departments, codes) if code is not None])
+        _rebuild_country_edges()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return sum(code is not None for code in codes)
+
+# Distinct articles with an author in each country as (country_code, articles), most first
+def count_articles_by_country():
+    cursor.execute('''
+    SELECT d.country_code, COUNT(DISTINCT aa.article_id) AS articles
+    FROM Departments d
+    JOIN ArticleAuthors aa ON aa.department_id = d.department_id
+    WHERE d.country_code IS NOT NULL
+    GROUP BY d.country_code
+    ORDER BY articles DESC, d.country_code
+    ''')
+    return cursor.fetchall()
+
+# International collaborations of each country as (country_code, articles): the distinct articles it
+# shares with a department in another country, most first
+def count_country_collaborations():
+    cursor.execute('''
+    SELECT d1.country_code, COUNT(DISTINCT aa1.article_id) AS articles
+    FROM ArticleAuthors aa1
+    JOIN ArticleAuthors aa2 ON aa1.article_id = aa2.article_id
+    JOIN Departments d1 ON aa1.department_id = d1.department_id
+    JOIN Departments d2 ON aa2.department_id = d2.department_id
+    WHERE d1.country_code != d2.country_code
+    GROUP BY d1.country_code
+    ORDER BY articles DESC, d1.country_code
+    ''')
+    return cursor.fetchall()
+
+# Retrieve all sites, shaped like retrieve_all_departments so analysis.create_graph takes either
+def retrieve_all_sites():
+    cursor.execute('SELECT site_id, siteName, latitude, longitude FROM Sites')
+    return cursor.fetchall()
+
+# Site of a department, or None before assign_sites has seen it
+def retrieve_site_by_department(department_id):
+    cursor.execute('''
+    SELECT s.site_id, s.siteName, s.latitude, s.longitude
+    FROM Sites s
+    JOIN Departments d ON s.site_id = d.site_id
+    WHERE d.department_id = ?
+    ''', (department_id,))
+    return cursor.fetchone()
+
+# get_article_department_links one level up: pairs of different sites sharing an article
+def get_article_site_links():
+    cursor.execute('''
+    SELECT DISTINCT d1.site_id, d2.site_id, aa1.article_id, a.journalTitle
+    FROM ArticleAuthors aa1
+    JOIN ArticleAuthors aa2 ON aa1.article_id = aa2.article_id
+    JOIN Departments d1 ON aa1.department_id = d1.department_id
+    JOIN Departments d2 ON aa2.department_id = d2.department_id
+    JOIN Articles a ON aa1.article_id = a.article_id
+    WHERE d1.site_id != d2.site_id
+    ''')
+    return cursor.fetchall()
+
+# Node columns of the co-authorship edges at each level: the department of each author, its site or its
+# country (get_edges('country') are the collaborations between countries, see assign_countries)
+_EDGE_LEVELS = {
+    'department': ('aa1.department_id', 'aa2.department_id', ''),
+    'site': ('d1.site_id', 'd2.site_id', '''
+    JOIN Departments d1 ON aa1.department_id = d1.department_id
+    JOIN Departments d2 ON aa2.department_id = d2.department_id'''),
+    'country': ('d1.country_code', 'd2.country_code', '''
+    JOIN Departments d1 ON aa1.department_id = d1.department_id
+    JOIN Departments d2 ON aa2.department_id = d2.department_id'''),
+}
+
+# (node_a, node_b, article_id) for every article shared by two nodes, once per pair with node_a < node_b
+def _edge_pairs_sql(level, condition):
+    node_a, node_b, joins = _EDGE_LEVELS[level]
+    return f'''
+    SELECT DISTINCT {node_a} AS node_a, {node_b} AS node_b, aa1.article_id AS article_id
+    FROM ArticleAuthors aa1
+    JOIN ArticleAuthors aa2 ON aa1.article_id = aa2.article_id{joins}
+    WHERE {node_a} < {node_b}{condition}
+    '''
+
+# Undirected co-authorship edges aggregated in SQL: one (node_a, node_b, weight, {journalTitle: articles})
+# row per pair of departments (or sites) with node_a < node_b, weight being the number of shared articles.
+# The article ids themselves are left in the database, see get_edge_articles.
+def get_edges(level='department'):
+    return _aggregate_edges(_edge_pairs_sql(level, ''), ())
+
+# Edges of get_edges rows grouped by pair and journal, folded into (node_a, node_b, weight, journals)
+def _aggregate_edges(pairs_sql, parameters):
+    cursor.execute(f'''
+    SELECT p.node_a, p.node_b, a.journalTitle, COUNT(*)
+    FROM ({pairs_sql}) p
+    JOIN Articles a ON p.article_id = a.article_id
+    GROUP BY p.node_a, p.node_b, a.journalTitle
+    ORDER BY p.node_a, p.node_b
+    ''', parameters)
+    return list(_fold_edges(cursor))
+
+# Fold (node_a, node_b, journalTitle, articles) rows ordered by pair into (node_a, node_b, weight, journals),
+# one edge at a time
+def _fold_edges(rows):
+    edge = None
+    for node_a, node_b, journal_title, articles in rows:
+        if edge is not None and edge[0] == node_a and edge[1] == node_b:
+            edge[2] += articles
+            edge[3][journal_title] = articles
+        else:
+            if edge is not None:
+                yield tuple(edge)
+            edge = [node_a, node_b, articles, {journal_title: articles}]
+    if edge is not None:
+        yield tuple(edge)
+
+# Articles published within start..end (publishedDate, both ends included, None leaves that end open).
+# Undated articles fall outside every window.
+def _window_condition(start, end):
+    return (' AND aa1.article_id IN (SELECT article_id FROM Articles WHERE publishedDate BETWEEN ? AND ?)',
+            (-1 if start is None else start, 99999999 if end is None else end))
+
+# get_edges of the articles published within start..end, streamed: edges are yielded as SQLite produces
+# them from a cursor of their own, so other queries can run while a caller consumes them
+def iter_edges_between(start=None, end=None, level='department'):
+    condition, parameters = _window_condition(start, end)
+    window_cursor = conn.cursor()
+    window_cursor.execute(f'''
+    SELECT p.node_a, p.node_b, a.journalTitle, COUNT(*)
+    FROM ({_edge_pairs_sql(level, condition)}) p
+    JOIN Articles a ON p.article_id = a.article_id
+    GROUP BY p.node_a, p.node_b, a.journalTitle
+    ORDER BY p.node_a, p.node_b
+    ''', parameters)
+    try:
+        yield from _fold_edges(window_cursor)
+    finally:
+        window_cursor.close()
+
+def get_edges_between(start=None, end=None, level='department'):
+    return list(iter_edges_between(start, end, level))
+
+# Every (publishedDate, node_a, node_b, journalTitle) contribution of one article to one edge within
+# start..end, oldest first and streamed like iter_edges_between. Undated articles are left out.
+def iter_edge_contributions(start=None, end=None, level='department'):
+    condition, parameters = _window_condition(start, end)
+    window_cursor = conn.cursor()
+    window_cursor.execute(f'''
+    SELECT a.publishedDate, p.node_a, p.node_b, a.journalTitle
+    FROM ({_edge_pairs_sql(level, condition)}) p
+    JOIN Articles a ON p.article_id = a.article_id
+    ORDER BY a.publishedDate, p.article_id
+    ''', parameters)
+    try:
+        yield from window_cursor
+    finally:
+        window_cursor.close()
+
+# Earliest and latest publishedDate, (None, None) without dated articles
+def published_date_range():
+    cursor.execute('SELECT MIN(publishedDate), MAX(publishedDate) FROM Articles')
+    return cursor.fetchone()
+
+# What the ArticleAuthors rows after rowid add to get_edges, in the same shape: the (pair, article)
+# combinations of the articles those rows belong to that the earlier rows did not already give
+def get_edges_since(rowid, level='department'):
+    return _aggregate_edges(_edge_pairs_since_sql(level), (rowid, rowid, rowid, rowid))
+
+# The (node_a, node_b, article_id) rows of _edge_pairs_sql that the ArticleAuthors rows after a rowid add,
+# with the rowid bound to all four parameters
+def _edge_pairs_since_sql(level):
+    touched = ' AND aa1.article_id IN (SELECT article_id FROM ArticleAuthors WHERE rowid > ?)'
+    return f'''
+    {_edge_pairs_sql(level, touched)}
+    EXCEPT
+    {_edge_pairs_sql(level, touched + ' AND aa1.rowid <= ? AND aa2.rowid <= ?')}
+    '''
+
+# Department (or site) rows of the nodes the ArticleAuthors rows after rowid belong to
+def get_nodes_since(rowid, level='department'):
+    if level == 'site':
+        cursor.execute('''
+        SELECT site_id, siteName, latitude, longitude FROM Sites
+        WHERE site_id IN (
+            SELECT d.site_id FROM ArticleAuthors aa
+            JOIN Departments d ON aa.department_id = d.department_id
+            WHERE aa.rowid > ?
+        )
+        ''', (rowid,))
+    else:
+        cursor.execute('''
+        SELECT department_id, departmentName, latitude, longitude FROM Departments
+        WHERE department_id IN (SELECT department_id FROM ArticleAuthors WHERE rowid > ?)
+        ''', (rowid,))
+    return cursor.fetchall()
+
+# Rowid of the newest ArticleAuthors row (0 when empty), and the number of rows up to a rowid.
+# A changed count means rows were deleted (remove_invalid_coordinates) rather than only added.
+def max_article_author_rowid():
+    cursor.execute('SELECT COALESCE(MAX(rowid), 0) FROM ArticleAuthors')
+    return cursor.fetchone()[0]
+
+def count_article_authors(rowid):
+    cursor.execute('SELECT COUNT(*) FROM ArticleAuthors WHERE rowid <= ?', (rowid,))
+    return cursor.fetchone()[0]
+
+# (department_id, site_id) of the departments up to department_id, to tell whether assign_sites moved any
+def get_site_assignments(max_department_id):
+    cursor.execute('SELECT department_id, site_id FROM Departments WHERE department_id <= ? ORDER BY department_id',
+                   (max_department_id,))
+    return cursor.fetchall()
+
+def max_department_id():
+    cursor.execute('SELECT COALESCE(MAX(department_id), 0) FROM Departments')
+    return cursor.fetchone()[0]
+
+# The (article_id, journalTitle) pairs behind one edge of get_edges, in either node order
+def get_edge_articles(node_a, node_b, level='department'):
+    node_a, node_b = min(node_a, node_b), max(node_a, node_b)
+    column_a, column_b, _ = _EDGE_LEVELS[level]
+    cursor.execute(f'''
+    SELECT p.article_id, a.journalTitle
+    FROM ({_edge_pairs_sql(level, f' AND {column_a} = ? AND {column_b} = ?')}) p
+    JOIN Articles a ON p.article_id = a.article_id
+    ORDER BY p.article_id
+    ''', (node_a, node_b))
+    return cursor.fetchall()
+
+# get_edge_articles of every edge with an article published within start..end, in one query streamed like
+# iter_edges_between: ((node_a, node_b), [(article_id, journalTitle), ...]) one edge at a time, in pair order
+def iter_edge_articles(start=None, end=None, level='department'):
+    condition, parameters = ('', ()) if start is None and end is None else _window_condition(start, end)
+    window_cursor = conn.cursor()
+    window_cursor.execute(f'''
+    SELECT p.node_a, p.node_b, p.article_id, a.journalTitle
+    FROM ({_edge_pairs_sql(level, condition)}) p
+    JOIN Articles a ON p.article_id = a.article_id
+    ORDER BY p.node_a, p.node_b, p.article_id
+    ''', parameters)
+    try:
+        edge, articles = None, []
+        for node_a, node_b, article_id, journal_title in window_cursor:
+            if (node_a, node_b) != edge:
+                if edge is not None:
+                    yield edge, articles
+                edge, articles = (node_a, node_b), []
+            articles.append((article_id, journal_title))
+        if edge is not None:
+            yield edge, articles
+    finally:
+        window_cursor.close()
+
+# Distinct (node, article_id) pairs of the department (or site) x article incidence matrix
+def get_incidence(level='department'):
+    if level == 'site':
+        cursor.execute('''
+        SELECT DISTINCT d.site_id, aa.article_id
+        FROM ArticleAuthors aa
+        JOIN Departments d ON aa.department_id = d.department_id
+        WHERE d.site_id IS NOT NULL
+        ''')
+    else:
+        cursor.execute('SELECT DISTINCT department_id, article_id FROM ArticleAuthors')
+    return cursor.fetchall()
+
+# Journal of every article as (article_id, journalTitle)
+def get_article_journals():
+    cursor.execute('SELECT article_id, journalTitle FROM Articles')
+    return cursor.fetchall()
+
+# Fingerprint of everything the graph of a level is built from: the articles, the departments (count,
+# newest id and how many have coordinates, which they only ever gain), every ArticleAuthors row (count,
+# newest rowid and a checksum of the article/department pairs) and at site level the site of every
+# department. Any ingest, purge or site reassignment changes it.
+def data_fingerprint(level='department'):
+    cursor.execute('SELECT COUNT(*), COALESCE(MAX(article_id), 0) FROM Articles')
+    parts = list(cursor.fetchone())
+    cursor.execute('''
+    SELECT COUNT(*), COALESCE(MAX(department_id), 0), COALESCE(SUM(latitude != 0 OR longitude != 0), 0)
+    FROM Departments
+    ''')
+    parts += cursor.fetchone()
+    cursor.execute('''
+    SELECT COUNT(*), COALESCE(MAX(rowid), 0), COALESCE(SUM((article_id * 1000003 + department_id) % 2147483647), 0)
+    FROM ArticleAuthors
+    ''')
+    parts += cursor.fetchone()
+    if level == 'site':
+        cursor.execute('''
+        SELECT COUNT(site_id), COALESCE(SUM((department_id * 1000003 + site_id) % 2147483647), 0)
+        FROM Departments
+        ''')
+        parts += cursor.fetchone()
+    return ":".join(str(part) for part in parts)
+
+# Cached metrics blob for a key, or None
+def get_graph_metrics(cache_key):
+    cursor.execute('SELECT metrics FROM GraphMetrics WHERE cacheKey = ?', (cache_key,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+# Store a metrics blob and drop the entries of the level computed on other data, which can never hit again
+def store_graph_metrics(cache_key, level, fingerprint, parameters, metrics, seconds):
+    cursor.execute('DELETE FROM GraphMetrics WHERE level = ? AND fingerprint != ?', (level, fingerprint))
+    cursor.execute('''
+    INSERT OR REPLACE INTO GraphMetrics (cacheKey, level, fingerprint, parameters, metrics, seconds, created)
+    VALUES (?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+    ''', (cache_key, level, fingerprint, parameters, metrics, seconds))
+    conn.commit()
+
+def clear_graph_metrics():
+    cursor.execute('DELETE FROM GraphMetrics')
+    conn.commit()
+
+# Rollups (migration 8). Every statement below runs inside the caller's transaction.
+ROLLUP_TABLES = ['DepartmentEdges', 'DepartmentDegrees', 'CountryEdges', 'JournalDepartments']
+
+def _rebuild_country_edges():
+    cursor.execute('DELETE FROM CountryEdges')
+    cursor.execute(f'''
+    INSERT INTO CountryEdges (country_a, country_b, articles)
+    SELECT node_a, node_b, COUNT(*) FROM ({_edge_pairs_sql('country', '')})
+    GROUP BY node_a, node_b
+    ''')
+
+def _rebuild_rollups():
+    for table in ROLLUP_TABLES:
+        cursor.execute(f'DELETE FROM {table}')
+    cursor.execute(f'''
+    INSERT INTO DepartmentEdges (department_a, department_b, articles)
+    SELECT node_a, node_b, COUNT(*) FROM ({_edge_pairs_sql('department', '')})
+    GROUP BY node_a, node_b
+    ''')
+    cursor.execute('''
+    INSERT INTO DepartmentDegrees (department_id, degree, collaborations, articles)
+    SELECT department_id, 0, 0, COUNT(DISTINCT article_id) FROM ArticleAuthors
+    GROUP BY department_id
+    ''')
+    cursor.execute('''
+    UPDATE DepartmentDegrees SET (degree, collaborations) = (
+        SELECT COUNT(*), COALESCE(SUM(articles), 0) FROM (
+            SELECT articles FROM DepartmentEdges WHERE department_a = DepartmentDegrees.department_id
+            UNION ALL
+            SELECT articles FROM DepartmentEdges WHERE department_b = DepartmentDegrees.department_id
+        )
+    )
+    ''')
+    _rebuild_country_edges()
+    cursor.execute('''
+    INSERT INTO JournalDepartments (journalTitle, department_id, articles)
+    SELECT a.journalTitle, m.department_id, COUNT(*)
+    FROM (SELECT DISTINCT department_id, article_id FROM ArticleAuthors) m
+    JOIN Articles a ON m.article_id = a.article_id
+    WHERE a.journalTitle IS NOT NULL
+    GROUP BY a.journalTitle, m.department_id
+    ''')
+
+# Add what the ArticleAuthors rows after rowid contribute: the department (and country) pairs and the
+# department/article memberships those rows create that the earlier rows did not already give
+def _apply_rollup_deltas(rowid):
+    cursor.execute('DROP TABLE IF EXISTS temp.new_pairs')
+    cursor.execute(f'''
+    CREATE TEMP TABLE new_pairs AS
+    SELECT node_a, node_b, COUNT(*) AS articles FROM ({_edge_pairs_since_sql('department')})
+    GROUP BY node_a, node_b
+    ''', (rowid, rowid, rowid, rowid))
+    cursor.execute('DROP TABLE IF EXISTS temp.new_memberships')
+    cursor.execute('''
+    CREATE TEMP TABLE new_memberships AS
+    SELECT department_id, article_id FROM ArticleAuthors WHERE rowid > ?
+    EXCEPT
+    SELECT department_id, article_id FROM ArticleAuthors
+    WHERE rowid <= ? AND article_id IN (SELECT article_id FROM ArticleAuthors WHERE rowid > ?)
+    ''', (rowid, rowid, rowid))
+
+    # degrees first, an edge adds to the degree of its ends only while DepartmentEdges does not have it yet
+    cursor.execute('''
+    INSERT INTO DepartmentDegrees (department_id, degree, collaborations, articles)
+    SELECT department_id, SUM(new_edge), SUM(articles), 0 FROM (
+        SELECT p.node_a AS department_id, p.articles, e.department_a IS NULL AS new_edge
+        FROM temp.new_pairs p
+        LEFT JOIN DepartmentEdges e ON e.department_a = p.node_a AND e.department_b = p.node_b
+        UNION ALL
+        SELECT p.node_b, p.articles, e.department_a IS NULL
+        FROM temp.new_pairs p
+        LEFT JOIN DepartmentEdges e ON e.department_a = p.node_a AND e.department_b = p.node_b
+    ) WHERE true
+    GROUP BY department_id
+    ON CONFLICT(department_id) DO UPDATE SET
+        degree = degree + excluded.degree,
+        collaborations = collaborations + excluded.collaborations
+    ''')
+    cursor.execute('''
+    INSERT INTO DepartmentEdges (department_a, department_b, articles)
+    SELECT node_a, node_b, articles FROM temp.new_pairs WHERE true
+    ON CONFLICT(department_a, department_b) DO UPDATE SET articles = articles + excluded.articles
+    ''')
+    cursor.execute('''
+    INSERT INTO DepartmentDegrees (department_id, degree, collaborations, articles)
+    SELECT department_id, 0, 0, COUNT(*) FROM temp.new_memberships WHERE true
+    GROUP BY department_id
+    ON CONFLICT(department_id) DO UPDATE SET articles = articles + excluded.articles
+    ''')
+    cursor.execute(f'''
+    INSERT INTO CountryEdges (country_a, country_b, articles)
+    SELECT node_a, node_b, COUNT(*) FROM ({_edge_pairs_since_sql('country')}) WHERE true
+    GROUP BY node_a, node_b
+    ON CONFLICT(country_a, country_b) DO UPDATE SET articles = articles + excluded.articles
+    ''', (rowid, rowid, rowid, rowid))
+    cursor.execute('''
+    INSERT INTO JournalDepartments (journalTitle, department_id, articles)
+    SELECT a.journalTitle, m.department_id, COUNT(*)
+    FROM temp.new_memberships m
+    JOIN Articles a ON m.article_id = a.article_id
+    WHERE a.journalTitle IS NOT NULL
+    GROUP BY a.journalTitle, m.department_id
+    ON CONFLICT(journalTitle, department_id) DO UPDATE SET articles = articles + excluded.articles
+    ''')
+    cursor.execute('DROP TABLE temp.new_pairs')
+    cursor.execute('DROP TABLE temp.new_memberships')
+
+# Bring the rollups up to date with ArticleAuthors: the deltas of the rows added since the last refresh,
+# or a rebuild when rows were deleted since (remove_invalid_coordinates) or the rollups were never built
+def _refresh_rollups():
+    cursor.execute('SELECT articleAuthorRowid, articleAuthorRows FROM RollupState')
+    state = cursor.fetchone()
+    rowid = max_article_author_rowid()
+    if state is None or count_article_authors(state[0]) != state[1]:
+        _rebuild_rollups()
+    elif rowid > state[0]:
+        _apply_rollup_deltas(state[0])
+    else:
+        return
+    cursor.execute('''
+    INSERT INTO RollupState (state_id, articleAuthorRowid, articleAuthorRows) VALUES (0, ?, ?)
+    ON CONFLICT(state_id) DO UPDATE SET
+        articleAuthorRowid = excluded.articleAuthorRowid,
+        articleAuthorRows = excluded.articleAuthorRows
+    ''', (rowid, count_article_authors(rowid)))
+
+# ingest_articles refreshes the rollups in its own transactions unless told not to; rows written that way
+# or any other way (tie_article_author_department) are picked up by the next refresh
+def refresh_rollups():
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        _refresh_rollups()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# Departments by prevalence as (department_id, departmentName, degree, collaborations, articles), most
+# collaborations first. collaborations counts every (other department, shared article) pair once, the
+# notebooks' rank_departments_by_prevalence counted each of them twice. The CROSS JOIN keeps DepartmentDegrees
+# outermost, so a LIMIT only walks the head of its collaborations index.
+def rank_departments_by_prevalence(limit=-1):
+    cursor.execute('''
+    SELECT d.department_id, d.departmentName, r.degree, r.collaborations, r.articles
+    FROM DepartmentDegrees r
+    CROSS JOIN Departments d ON r.department_id = d.department_id
+    ORDER BY r.collaborations DESC, r.department_id
+    LIMIT ?
+    ''', (limit,))
+    return cursor.fetchall()
+
+# Heatmap intensities: (latitude, longitude, collaborations) of every geolocated department with any.
+# Read from DepartmentDegrees, or counted over the articles of one journal and/or published within
+# start..end (publishedDate, both ends included) when any of them is given.
+def get_department_intensities(journal_title=None, start=None, end=None):
+    if journal_title is None and start is None and end is None:
+        cursor.execute('''
+        SELECT d.latitude, d.longitude, r.collaborations
+        FROM DepartmentDegrees r
+        JOIN Departments d ON r.department_id = d.department_id
+        WHERE r.collaborations > 0 AND d.latitude IS NOT NULL AND d.longitude IS NOT NULL
+          AND NOT (d.latitude = 0 AND d.longitude = 0)
+        ''')
+        return cursor.fetchall()
+    conditions, parameters = [], []
+    if journal_title is not None:
+        conditions.append('a.journalTitle = ?')
+        parameters.append(journal_title)
+    if start is not None:
+        conditions.append('a.publishedDate >= ?')
+        parameters.append(start)
+    if end is not None:
+        conditions.append('a.publishedDate <= ?')
+        parameters.append(end)
+    cursor.execute(f'''
+    SELECT d.latitude, d.longitude, COUNT(*)
+    FROM (
+        SELECT DISTINCT aa1.department_id AS department_id, aa2.department_id AS partner, aa1.article_id
+        FROM Articles a
+        JOIN ArticleAuthors aa1 ON aa1.article_id = a.article_id
+        JOIN ArticleAuthors aa2 ON aa2.article_id = a.article_id
+        WHERE aa1.department_id != aa2.department_id AND {' AND '.join(conditions)}
+    ) p
+    JOIN Departments d ON p.department_id = d.department_id
+    WHERE d.latitude IS NOT NULL AND d.longitude IS NOT NULL AND NOT (d.latitude = 0 AND d.longitude = 0)
+    GROUP BY p.department_id
+    ''', parameters)
+    return cursor.fetchall()
+
+# Country pairs as (country_a, country_b, articles) with country_a < country_b, most articles first
+def get_country_edge_counts(limit=-1):
+    cursor.execute('''
+    SELECT country_a, country_b, articles FROM CountryEdges
+    ORDER BY articles DESC, country_a, country_b
+    LIMIT ?
+    ''', (limit,))
+    return cursor.fetchall()
+
+# The departments of a journal layer as (department_id, departmentName, latitude, longitude, articles)
+def get_journal_departments(journal_title):
+    cursor.execute('''
+    SELECT d.department_id, d.departmentName, d.latitude, d.longitude, j.articles
+    FROM JournalDepartments j
+    JOIN Departments d ON j.department_id = d.department_id
+    WHERE j.journalTitle = ?
+    ORDER BY j.articles DESC, d.department_id
+    ''', (journal_title,))
+    return cursor.fetchall()
+
+# Journals with the number of departments that published in them, most first
+def get_journal_department_counts():
+    cursor.execute('''
+    SELECT journalTitle, COUNT(*) AS departments FROM JournalDepartments
+    GROUP BY journalTitle
+    ORDER BY departments DESC, journalTitle
+    ''')
+    return cursor.fetchall()
+
+# Compare the incrementally maintained rollups with a rebuild from scratch (rolled back afterwards)
+def check_rollups():
+    current = {}
+    for table in ROLLUP_TABLES:
+        cursor.execute(f'SELECT * FROM {table} ORDER BY 1, 2')
+        current[table] = cursor.fetchall()
+    cursor.execute('SAVEPOINT check_rollups')
+    try:
+        _rebuild_rollups()
+        differing = []
+        for table in ROLLUP_TABLES:
+            cursor.execute(f'SELECT * FROM {table} ORDER BY 1, 2')
+            if cursor.fetchall() != current[table]:
+                differing.append(table)
+    finally:
+        cursor.execute('ROLLBACK TO check_rollups')
+        cursor.execute('RELEASE check_rollups')
+    assert not differing, f"Rollups differ from a rebuild: {differing}"
+    return True
+
+# Query plan check for the ArticleAuthors lookups. Every statement a retrieval function executes is captured
+# (with its parameters bound) and run through EXPLAIN QUERY PLAN. A table SCAN that is not served by an index
+# means a full table scan; the self-join in get_article_department_links may only walk a covering index.
+# Scanning a subquery that was materialized first (get_edges) reads its result, not a table.
+def explain_retrievals():
+    retrievals = [
+        (retrieve_articles_by_author, (1,)),
+        (retrieve_authors_by_article, (1,)),
+        (retrieve_departments_by_article, (1,)),
+        (retrieve_articles_by_department, (1,)),
+        (get_article_department_links, ()),
+        (retrieve_site_by_department, (1,)),
+        (get_article_site_links, ()),
+        (get_edges, ()),
+        (get_edges, ('site',)),
+        (get_edge_articles, (1, 2)),
+        (get_edge_articles, (1, 2, 'site')),
+        (iter_edge_articles, ()),
+        (iter_edge_articles, (20240101, 20241231)),
+        (count_articles_by_country, ()),
+        (count_country_collaborations, ()),
+        (get_edges, ('country',)),
+        (get_edges_between, (20240101, 20241231)),
+        (get_edges_between, (20240101, 20241231, 'site')),
+        (iter_edge_contributions, (20240101, 20241231)),
+        (rank_departments_by_prevalence, (10,)),
+        (get_journal_departments, ('The Lancet',)),
+        (get_incidence, ()),
+        (get_incidence, ('site',)),
+        (get_edges_since, (1,)),
+        (get_edges_since, (1, 'site')),
+        (get_nodes_since, (1,)),
+        (get_nodes_since, (1, 'site')),
+    ]
+    plans = {}
+    for retrieval, args in retrievals:
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            result = retrieval(*args)
+            # streamed retrievals only run their query once consumed
+            if hasattr(result, '__next__'):
+                list(result)
+        finally:
+            conn.set_trace_callback(None)
+        details = []
+        for statement in statements:
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement)
+            details += [row[3] for row in cursor.fetchall()]
+        plans.setdefault(retrieval.__name__, []).extend(details)
+    return plans
+
+def _full_scans(details):
+    materialized = {detail.split()[1] for detail in details if detail.startswith('MATERIALIZE ')}
+    return [detail for detail in details
+            if detail.startswith('SCAN ') and ' USING ' not in detail and detail.split()[1] not in materialized]
+
+def check_query_plans():
+    full_scans = {name: _full_scans(details) for name, details in explain_retrievals().items()}
+    full_scans = {name: scans for name, scans in full_scans.items() if scans}
+    assert not full_scans, f"Full table scans in retrieval queries: {full_scans}"
+
 # Function to remove articles, departments, and authors associated with departments having coordinates (0.0, 0.0)
 def remove_invalid_coordinates():
     cursor.execute('''
@@ -250,9 +1545,12 @@ def remove_invalid_coordinates():
         )
         ''')
         conn.commit()
+        clear_caches()
+        refresh_rollups()
         
 def purge():
     remove_invalid_coordinates()
 
 if __name__ == "__main__":
     instantiate()
+    check_query_plans()
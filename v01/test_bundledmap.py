@@ -0,0 +1,54 @@
+import json
+import shutil
+import subprocess
+import folium
+import networkx as nx
+import pytest
+import bundledmap
+
+# Just enough of Leaflet for the layer script: L.geoJSON(...).addData styles every layer it creates the way
+# Leaflet does (pointToLayer for points, then setStyle(style(feature)) on every layer), and the final options
+# of the layers are printed as JSON
+LEAFLET_STUB = """
+var drawn = [];
+function Layer(options) { this.options = Object.assign({}, options); }
+Layer.prototype.setStyle = function(style) { Object.assign(this.options, style); };
+Layer.prototype.bindPopup = function() {};
+var L = {
+    circleMarker: function(latlng, options) { return new Layer(options); },
+    geoJSON: function(data, options) {
+        return {
+            clearLayers: function() { drawn = []; },
+            addData: function(features) {
+                features.forEach(function(feature) {
+                    var layer = feature.geometry.type === 'Point' ? options.pointToLayer(feature, null) : new Layer({});
+                    layer.setStyle(options.style(feature));
+                    options.onEachFeature(feature, layer);
+                    drawn.push({type: feature.geometry.type, options: layer.options});
+                });
+            }
+        };
+    }
+};
+var %(map)s = {getZoom: function() { return 10; }, on: function() {}};
+"""
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is needed to run the layer script")
+def test_points_keep_their_colours():
+    G = nx.Graph(level="department")
+    for node_id, (lat, lon) in enumerate([(10, 10), (20, 20), (30, 30), (40, 40)]):
+        G.add_node(node_id, name=f"Department {node_id}", lat=lat, lon=lon)
+    G.add_weighted_edges_from([(0, 1, 2), (1, 2, 1), (0, 2, 4), (2, 3, 1)])
+    metrics = {"Cliques": [[0, 1, 2]]}
+    m = folium.Map()
+    layer = bundledmap.BundledNetworkLayer(bundledmap.bundled_bands(G, metrics)).add_to(m)
+    script = LEAFLET_STUB % {"map": m.get_name()} + layer._template.module.script(layer, {})
+    script += "\nconsole.log(JSON.stringify(drawn));"
+    drawn = json.loads(subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True).stdout)
+
+    points = [layer["options"] for layer in drawn if layer["type"] == "Point"]
+    lines = [layer["options"] for layer in drawn if layer["type"] == "LineString"]
+    assert sorted(point["color"] for point in points) == ["blue", "orange", "orange", "orange"]
+    assert all(point["weight"] == 1 for point in points)
+    assert len(lines) == 4 and all(line["color"] == "green" for line in lines)
+    assert sorted(line["weight"] for line in lines) == [1, 1, 2, 3]
@@ -0,0 +1,77 @@
+import os
+import random
+import pytest
+import storage
+import network
+import sparsenetwork
+import incremental
+
+# The self-checks of the modules (storage.check_rollups, sparsenetwork.check_against_networkx,
+# incremental.check_consistency) and the metrics cache, run on a scratch database of a random network
+
+def make_network_articles(n_departments, n_articles, seed=0, start=0):
+    rng = random.Random(seed)
+    articles = []
+    for i in range(start, start + n_articles):
+        departments = rng.sample(range(n_departments), rng.randint(2, 5))
+        articles.append({
+            "articleTitle": f"Network article {i}",
+            "journalTitle": f"Journal {i % 3}",
+            "datePublished": f"{2020 + i % 5} Mar {1 + i % 28}",
+            "abstract": "",
+            "authorsList": [f"Author {d}" for d in departments],
+            # four departments to a site, the sites a degree apart
+            "departmentList": [[f"Department {d}, City {d // 4}.", [10.0 + d // 4, 20.0 + d % 4 * 0.0005]]
+                               for d in departments],
+        })
+    return articles
+
+@pytest.fixture
+def network_database(tmp_path):
+    storage.connect(os.path.join(tmp_path, "network.db"))
+    storage.instantiate()
+    storage.ingest_articles(make_network_articles(40, 120))
+    storage.assign_sites()
+    yield tmp_path
+    storage.conn.close()
+    storage.connect()
+
+def test_rollups_match_a_rebuild(network_database):
+    assert storage.check_rollups()
+    storage.ingest_articles(make_network_articles(40, 10, seed=1, start=120), refresh_rollups=False)
+    storage.refresh_rollups()
+    assert storage.check_rollups()
+
+@pytest.mark.parametrize("level, journals", [("department", None), ("department", ["Journal 1"]), ("site", None)])
+def test_sparse_metrics_match_networkx(network_database, level, journals):
+    assert sparsenetwork.check_against_networkx(level, journals)
+
+def test_incremental_update_matches_recompute(network_database):
+    path = os.path.join(network_database, "state.pickle")
+    G, results, report = incremental.update_graph_metrics(path=path)
+    assert report["mode"] == "full"
+    incremental.check_consistency(G, results)
+    storage.ingest_articles(make_network_articles(40, 5, seed=2, start=130))
+    G, results, report = incremental.update_graph_metrics(path=path)
+    assert report["mode"] == "incremental" and report["new_edges"] > 0
+    incremental.check_consistency(G, results)
+
+def test_sliding_windows_match_recompute(network_database):
+    names = ["degree", "betweenness", "closeness", "eigenvector", "clustering"]
+    windows = incremental.year_windows(2020, 2024, 2)
+    for window, ours in incremental.sliding_window_metrics(windows, metrics=names):
+        fresh = network.calculate_graph_metrics(network.load_graph(window=window), "exact", names)
+        for key in ("Degree centrality", "Betweenness centrality", "Closeness centrality", "Eigenvector centrality"):
+            assert max(abs(fresh[key][node] - ours[key][node]) for node in fresh[key]) < 1e-9, (window, key)
+
+def test_metrics_cache_hits_until_the_data_changes(network_database):
+    names = ["degree", "closeness"]
+    first = network.cached_graph_metrics(metrics=names)
+    second = network.cached_graph_metrics(metrics=names)
+    assert not first["Cached"] and second["Cached"]
+    assert second["Closeness centrality"] == first["Closeness centrality"]
+    assert not network.cached_graph_metrics(metrics=names, profile="fast")["Cached"]
+    storage.ingest_articles(make_network_articles(40, 1, seed=3, start=140))
+    third = network.cached_graph_metrics(metrics=names)
+    assert not third["Cached"]
+    assert third["Degree centrality"] == network.calculate_graph_metrics(network.load_graph(), "exact", names)["Degree centrality"]
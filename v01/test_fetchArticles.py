@@ -0,0 +1,102 @@
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pytest
+import medline
+import pubmedfetch
+import storage
+import fetchArticles
+
+# E-utilities responses in the format esearch (retmode=json) and efetch (rettype=medline) return them,
+# for a '"Cell"[jour]' search of three Cell articles of pubmed.db. The PMIDs are fixture ids.
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "eutils")
+QUERY = '?term="Cell"%5Bjour%5D&sort=date&sort_order=desc'
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+# Serves the fixtures: the esearch response for the Cell term, and for efetch the recorded records of
+# the requested PMIDs in the order asked for
+class RecordedEutils(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.requests_seen.append((url.path, params))
+        if url.path.endswith("esearch.fcgi") and params.get("term") == '"Cell"[jour]':
+            body = read_fixture("esearch_cell.json")
+        elif url.path.endswith("efetch.fcgi") and params.get("rettype") == "medline":
+            records = {record.split("\n", 1)[0][6:]: record for record in read_fixture("efetch_cell.txt").strip().split("\n\n")}
+            body = "\n\n".join(records[pmid] for pmid in params["id"].split(",")) + "\n"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def recorded_eutils(monkeypatch, tmp_path):
+    RecordedEutils.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RecordedEutils)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    monkeypatch.setattr(pubmedfetch, "EUTILS_URL", f"http://127.0.0.1:{server.server_port}/entrez/eutils/")
+    monkeypatch.setattr(pubmedfetch, "NCBI_API_KEY", None)
+    pubmedfetch.configure(rate=1000)
+    monkeypatch.setattr(fetchArticles, "BACKEND", "eutils")
+    monkeypatch.setattr(fetchArticles, "PIPELINE", False)
+    # departments the gazetteer does not know get a fixed location instead of a Mapbox request
+    monkeypatch.setattr(fetchArticles, "mapboxGeolocate", lambda fuzzloc: [1.0, 2.0])
+    storage.connect(os.path.join(tmp_path, "crawl.db"))
+    storage.instantiate()
+    yield RecordedEutils
+    storage.conn.close()
+    storage.connect()
+    server.shutdown()
+    server.server_close()
+    pubmedfetch.configure()
+
+def test_collect_serial_from_recorded_responses(recorded_eutils):
+    expected = list(medline.parse(read_fixture("efetch_cell.txt")))
+    pmids = [article["pmid"] for article in expected]
+    stored_ids, bad_count = fetchArticles.collectSerial(QUERY, pmids)
+    assert bad_count == 0 and len(stored_ids) == 3
+    efetches = [params for path, params in recorded_eutils.requests_seen if path.endswith("efetch.fcgi")]
+    assert [params["id"] for params in efetches] == [",".join(map(str, pmids))]
+
+    assert sorted(storage.pmids_with_status("stored", QUERY)) == pmids
+    for article_id, article in zip(stored_ids, expected):
+        assert storage.retrieve_article_by_id(article_id)[1] == article["articleTitle"]
+        assert len(storage.retrieve_departments_by_article(article_id)) == len(article["departmentList"])
+    # the affiliation under the group author belongs to nobody
+    assert not any("Consortium secretariat" in department for article in expected for department in article["departmentList"])
+
+def test_pipeline_stores_what_the_serial_collection_stores(recorded_eutils, monkeypatch):
+    pmids = [article["pmid"] for article in medline.parse(read_fixture("efetch_cell.txt"))]
+    stored_ids, _ = fetchArticles.collectSerial(QUERY, pmids)
+    serial = [storage.retrieve_article_by_id(article_id)[1:] for article_id in stored_ids]
+    storage.conn.execute("DELETE FROM ArticleAuthors")
+    storage.conn.execute("DELETE FROM Articles")
+    storage.conn.commit()
+    pipelined = [storage.retrieve_article_by_id(article_id)[1:] for article_id in fetchArticles.collectPipelined(pmids)]
+    assert len(serial) == 3 and sorted(pipelined) == sorted(serial)
+
+def test_aggregate_by_journalquery_resumes(recorded_eutils):
+    stored_ids = fetchArticles.aggregate_by_journalquery(QUERY, 1, 2)
+    assert len(stored_ids) == 3
+    assert storage.get_query_progress(QUERY) == 1
+    searches = [params for path, params in recorded_eutils.requests_seen if path.endswith("esearch.fcgi")]
+    assert searches[0]["retstart"] == "0" and searches[0]["retmax"] == "10"
+    # the page is recorded as done, a second run requests nothing
+    recorded_eutils.requests_seen.clear()
+    assert fetchArticles.aggregate_by_journalquery(QUERY, 1, 2) == []
+    assert recorded_eutils.requests_seen == []
@@ -0,0 +1,27 @@
+import threading
+import gazetteer
+
+AFFILIATIONS = ["Example Hospital", "Unknown Institute, Nowhere"] * 500
+
+def test_counters_are_exact_under_threads(monkeypatch):
+    monkeypatch.setattr(gazetteer, "stats", dict.fromkeys(gazetteer.stats, 0))
+    monkeypatch.setattr(gazetteer, "aliases", {"example hospital": [1.0, 2.0]})
+    threads = [threading.Thread(target=lambda: [gazetteer.lookup(a) for a in AFFILIATIONS]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = gazetteer.get_stats()
+    assert stats["lookups"] == 8000 and stats["alias"] == 4000 and stats["unresolved"] == 4000
+    assert stats["coverage"] == 0.5
+
+def test_batch_counts_only_its_own_lookups(monkeypatch):
+    monkeypatch.setattr(gazetteer, "stats", dict.fromkeys(gazetteer.stats, 0))
+    monkeypatch.setattr(gazetteer, "aliases", {"example hospital": [1.0, 2.0]})
+    thread = threading.Thread(target=lambda: [gazetteer.lookup("Example Hospital") for _ in range(5000)])
+    thread.start()
+    locations, batch = gazetteer.lookup_batch(AFFILIATIONS[:10])
+    thread.join()
+    assert locations[:2] == [[1.0, 2.0], None]
+    assert batch["affiliations"] == 10 and batch["alias"] == 5 and batch["resolved"] == 5
+    assert gazetteer.get_stats()["lookups"] == 5010
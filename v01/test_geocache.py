@@ -0,0 +1,67 @@
+import os
+import json
+import pytest
+import geocache
+import fetchArticles
+
+# Mapbox forward geocoding responses by query, anything else finds nothing
+MAPBOX = {"Department of Medicine, Example University, Springfield": [-89.65, 39.78]}
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+# Clock for the negative TTL, moved by the tests
+class Clock:
+    now = 1_000_000.0
+
+    @classmethod
+    def time(cls):
+        return cls.now
+
+# A scratch cache with zeroed counters, the Mapbox request replaced by a stub that counts its calls
+@pytest.fixture
+def geocoder(monkeypatch, tmp_path):
+    calls = []
+
+    def get(url, params=None):
+        calls.append(params["q"])
+        coordinates = MAPBOX.get(params["q"])
+        features = [{"geometry": {"coordinates": coordinates}}] if coordinates else []
+        return StubResponse(json.dumps({"type": "FeatureCollection", "features": features}))
+
+    monkeypatch.setattr(fetchArticles.requests, "get", get)
+    monkeypatch.setattr(geocache, "time", Clock)
+    monkeypatch.setattr(geocache, "stats", {key: 0 for key in geocache.stats})
+    geocache.connect(os.path.join(tmp_path, "geocache.db"))
+    yield calls
+    geocache.conn.close()
+    geocache.conn = None
+
+def test_hit_skips_the_geocoder(geocoder):
+    query = "Department of Medicine, Example University, Springfield"
+    assert fetchArticles.mapboxGeolocate(query) == [39.78, -89.65]
+    # case, spacing and trailing punctuation do not make a new address
+    assert fetchArticles.mapboxGeolocate("department of medicine,  Example University, Springfield.") == [39.78, -89.65]
+    assert geocoder == [query]
+    stats = geocache.get_stats()
+    assert (stats["misses"], stats["hits"], stats["stored"], stats["entries"]) == (1, 1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+def test_failed_lookup_expires(geocoder):
+    query = "Nowhere Institute"
+    assert fetchArticles.mapboxGeolocate(query) == []
+    Clock.now += geocache.NEGATIVE_TTL - 1
+    assert fetchArticles.mapboxGeolocate(query) == []
+    assert geocoder == [query]
+    Clock.now += 2
+    assert fetchArticles.mapboxGeolocate(query) == []
+    assert geocoder == [query, query]
+    stats = geocache.get_stats()
+    assert (stats["negative_hits"], stats["expired"], stats["misses"], stats["cached_failures"]) == (1, 1, 2, 1)
+
+def test_import_creates_no_file(tmp_path, monkeypatch):
+    import importlib
+    monkeypatch.chdir(tmp_path)
+    importlib.reload(geocache)
+    assert not os.path.exists(geocache.GEOCACHE_PATH)
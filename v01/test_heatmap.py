@@ -0,0 +1,17 @@
+import os
+import storage
+import heatmap
+from test_storage import make_article
+
+def test_window_as_list_or_tuple(tmp_path):
+    storage.connect(os.path.join(tmp_path, "heatmap.db"))
+    try:
+        storage.instantiate()
+        storage.ingest_articles([make_article(i) for i in range(4)])
+        cells = heatmap.heatmap_cells(window=[20240601, 20240602])
+        assert heatmap.heatmap_cells(window=(20240601, 20240602)) is cells
+        assert len(cells[0]) > 0
+        assert sum(cells[2]) < sum(heatmap.heatmap_cells()[2])
+    finally:
+        storage.conn.close()
+        storage.connect()
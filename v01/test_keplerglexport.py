@@ -0,0 +1,27 @@
+import os
+import json
+import storage
+import network
+import keplerglexport
+from test_storage import make_article
+
+def test_export_keeps_to_the_graph_window(tmp_path):
+    storage.connect(os.path.join(tmp_path, "export.db"))
+    try:
+        storage.instantiate()
+        article_ids = storage.ingest_articles([make_article(i) for i in range(6)])
+        published = dict(storage.conn.execute("SELECT article_id, publishedDate FROM Articles"))
+        window = (20240602, 20240604)
+        G = network.load_graph(window=window)
+        files = keplerglexport.export_graph_to_geojson_by_journal(G, {}, "ndjson", False, tmp_path)
+        with open(files["The Lancet"]) as f:
+            features = [json.loads(line) for line in f]
+    finally:
+        storage.conn.close()
+        storage.connect()
+
+    edges = [feature["properties"] for feature in features if feature["geometry"]["type"] == "LineString"]
+    assert len(edges) == G.number_of_edges() > 0
+    exported = {article_id for edge in edges for article_id, _ in edge["articles"]}
+    assert exported == {article_id for article_id in article_ids if window[0] <= published[article_id] <= window[1]}
+    assert all(len(edge["articles"]) == edge["weight"] for edge in edges)
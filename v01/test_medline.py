@@ -0,0 +1,72 @@
+import io
+import medline
+
+RECORDS = """PMID- 39000101
+OWN - NLM
+DP  - 2024 Aug 8
+TI  - A title long enough to wrap onto a continuation line, like most real
+      titles do.
+AB  - First paragraph of the abstract
+      continued here.
+AB  - Second paragraph.
+FAU - Smith, John
+AU  - Smith J
+AD  - Department of Medicine, University A, City A, Country A.
+AD  - Institute of Health, University B, City B,
+      Country B.
+FAU - Doe, Jane
+AU  - Doe J
+CN  - Example Study Group
+AD  - Study group office, City C, Country C.
+FAU - Roe, Richard
+AU  - Roe R
+AD  - School of Public Health, University D, City D, Country D.
+JT  - Journal of Examples
+
+PMID- 39000102
+DP  - 1998
+TI  - An older record with AU tags only.
+AU  - Old A
+AD  - Department One, City E.
+AU  - Older B
+AU  - Oldest C
+AD  - Department Two, City F.
+JT  - Journal of Examples
+"""
+
+def test_continuation_lines():
+    article = next(medline.parse(RECORDS))
+    assert article["pmid"] == 39000101
+    assert article["articleTitle"] == "A title long enough to wrap onto a continuation line, like most real titles do."
+    assert article["abstract"] == "First paragraph of the abstract continued here. Second paragraph."
+    assert article["departmentList"][1] == "Institute of Health, University B, City B, Country B."
+
+def test_multiple_affiliations_and_group_author():
+    article = next(medline.parse(RECORDS))
+    # two AD lines for Smith, none for Doe, and the AD under the group author belongs to nobody
+    assert article["authorsList"] == ["Smith, John", "Smith, John", "Roe, Richard"]
+    assert article["departmentList"] == ["Department of Medicine, University A, City A, Country A.",
+                                         "Institute of Health, University B, City B, Country B.",
+                                         "School of Public Health, University D, City D, Country D."]
+    assert [author["name"] for author in article["authors"]] == ["Smith, John", "Doe, Jane", "Roe, Richard"]
+    assert article["authors"][1]["affiliations"] == []
+
+def test_au_only_record():
+    article = list(medline.parse(RECORDS))[1]
+    assert [author["name"] for author in article["authors"]] == ["Old A", "Older B", "Oldest C"]
+    assert article["authorsList"] == ["Old A", "Oldest C"]
+    assert article["departmentList"] == ["Department One, City E.", "Department Two, City F."]
+    assert article["datePublished"] == "1998"
+
+def test_inputs():
+    expected = list(medline.parse(RECORDS))
+    assert len(expected) == 2
+    assert list(medline.parse(RECORDS.encode())) == expected
+    assert list(medline.parse(io.StringIO(RECORDS))) == expected
+    assert list(medline.parse(io.BytesIO(RECORDS.replace("\n", "\r\n").encode()))) == expected
+    assert list(medline.parse(RECORDS.splitlines())) == expected
+
+def test_page_furniture_is_skipped():
+    page = "<pre>\n" + RECORDS.split("\n\n")[1] + "</pre>\n"
+    articles = list(medline.parse(page))
+    assert [article["pmid"] for article in articles] == [39000102]
@@ -0,0 +1,30 @@
+import math
+import random
+import networkx as nx
+import network
+
+def weighted_graph():
+    rng = random.Random(0)
+    G = nx.gnm_random_graph(600, 3000, seed=0)
+    G.add_edges_from([(1000, 1001), (1001, 1002)])
+    G.add_node(2000)
+    for u, v in G.edges():
+        G[u][v]["weight"] = rng.randint(1, 5)
+    return G
+
+def test_fast_closeness_is_close_to_exact():
+    G = weighted_graph()
+    exact = nx.closeness_centrality(G)
+    fast, complete = network._closeness(G, True, float("inf"), {})
+    fast = fast["Closeness centrality"]
+    assert complete
+    # components no larger than the pivot count are exact
+    for node in (1000, 1001, 1002, 2000):
+        assert abs(fast[node] - exact[node]) < 1e-12
+    # the giant component is sampled: its mean distances are within D * sqrt(log(r) / k) of the true ones
+    giant = max(nx.connected_components(G), key=len)
+    r, k = len(giant), network.CLOSENESS_PIVOTS
+    assert k < r
+    bound = nx.diameter(G.subgraph(giant)) * math.sqrt(math.log(r) / k)
+    scale = (r - 1) / (len(G) - 1)
+    assert max(abs(scale / fast[node] - scale / exact[node]) for node in giant) <= bound
@@ -0,0 +1,43 @@
+import pytest
+import pipeline
+
+def test_every_item_reaches_the_writer():
+    written, flushed = [], []
+
+    def square(item):
+        yield item * item
+
+    def drop_odd(item):
+        if item % 2 == 0:
+            yield item
+
+    stages = [pipeline.Stage("square", square, workers=4),
+              pipeline.Stage("filter", drop_odd, workers=2, flush=lambda: [-1]),
+              pipeline.Stage("write", lambda item: written.append(item) or [], flush=lambda: flushed.append(len(written)))]
+    metrics = pipeline.run_pipeline(range(200), stages)
+    assert sorted(written) == [-1] + [i * i for i in range(0, 200, 2)]
+    assert flushed == [101]
+    assert metrics["stages"]["square"]["items_in"] == 200
+    assert metrics["stages"]["filter"]["items_out"] == 101
+    assert metrics["stages"]["write"]["items_in"] == 101
+
+def test_worker_errors_are_counted_and_skipped():
+    written = []
+
+    def invert(item):
+        yield 1 / item
+
+    stages = [pipeline.Stage("invert", invert, workers=3), pipeline.Stage("write", lambda item: written.append(item) or [])]
+    metrics = pipeline.run_pipeline(range(10), stages)
+    assert len(written) == 9
+    assert metrics["stages"]["invert"]["errors"] == 1
+
+def test_writer_error_stops_the_pipeline():
+    def write(item):
+        if item == 5:
+            raise RuntimeError("disk full")
+        return []
+
+    stages = [pipeline.Stage("pass", lambda item: [item], workers=2, queue_size=2), pipeline.Stage("write", write)]
+    with pytest.raises(RuntimeError):
+        pipeline.run_pipeline(range(10000), stages)
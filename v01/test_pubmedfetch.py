@@ -0,0 +1,113 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pytest
+import requests
+import medline
+import pubmedfetch
+
+PMIDS = list(range(40000001, 40000026))
+
+def medline_record(pmid):
+    return f"PMID- {pmid}\nTI  - Article {pmid}\nJT  - Fake Journal\nDP  - 2024 Jun 1\nFAU - Author, {pmid}\nAD  - Department {pmid}, City, Country.\n"
+
+# A local stand-in for E-utilities: esearch pages through PMIDS, efetch returns a MEDLINE record per id.
+# failures maps a path to the status codes its next requests answer with before it succeeds.
+class FakePubMed(BaseHTTPRequestHandler):
+    requests_seen = []
+    failures = {}
+    retry_after = None
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with self.lock:
+            self.requests_seen.append((time.monotonic(), url.path, params))
+            pending = self.failures.get(url.path)
+            status = pending.pop(0) if pending else 200
+        if status != 200:
+            self.send_response(status)
+            if self.retry_after is not None:
+                self.send_header("Retry-After", self.retry_after)
+            self.end_headers()
+            return
+        if url.path.endswith("esearch.fcgi"):
+            start, count = int(params["retstart"]), int(params["retmax"])
+            body = json.dumps({"esearchresult": {"idlist": [str(pmid) for pmid in PMIDS[start:start + count]]}})
+        else:
+            body = "\n".join(medline_record(pmid) for pmid in params["id"].split(","))
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# The fake server on a free port, pubmedfetch pointed at it with a fast rate limit and short backoff
+@pytest.fixture
+def fake_pubmed(monkeypatch):
+    FakePubMed.requests_seen = []
+    FakePubMed.failures = {}
+    FakePubMed.retry_after = None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakePubMed)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    monkeypatch.setattr(pubmedfetch, "EUTILS_URL", f"http://127.0.0.1:{server.server_port}/entrez/eutils/")
+    monkeypatch.setattr(pubmedfetch, "BACKOFF", 0.05)
+    monkeypatch.setattr(pubmedfetch, "NCBI_API_KEY", None)
+    pubmedfetch.configure(rate=1000, workers=4)
+    yield FakePubMed
+    server.shutdown()
+    server.server_close()
+    pubmedfetch.configure()
+
+def test_esearch_pages(fake_pubmed):
+    pages = [pubmedfetch.esearch("fake", retstart, 10) for retstart in (0, 10, 20)]
+    assert pages == [PMIDS[0:10], PMIDS[10:20], PMIDS[20:25]]
+    assert all(params["term"] == "fake" and params["db"] == "pubmed" for _, _, params in fake_pubmed.requests_seen)
+
+def test_efetch_batches(fake_pubmed):
+    fetched = dict(pubmedfetch.efetch_all(PMIDS, batch_size=10))
+    assert sorted(len(batch) for batch in fetched) == [5, 10, 10]
+    for batch, text in fetched.items():
+        assert [article["pmid"] for article in medline.parse(text)] == list(batch)
+
+def test_retries_with_backoff(fake_pubmed):
+    fake_pubmed.failures["/entrez/eutils/esearch.fcgi"] = [429, 503]
+    start = time.perf_counter()
+    assert pubmedfetch.esearch("fake", 0, 5) == PMIDS[:5]
+    # BACKOFF * 2**0 after the 429, BACKOFF * 2**1 after the 503
+    assert time.perf_counter() - start >= 0.05 + 0.1
+    assert len(fake_pubmed.requests_seen) == 3
+
+def test_retry_after_is_honoured(fake_pubmed):
+    fake_pubmed.failures["/entrez/eutils/esearch.fcgi"] = [429]
+    fake_pubmed.retry_after = "1"
+    start = time.perf_counter()
+    pubmedfetch.esearch("fake", 0, 5)
+    assert time.perf_counter() - start >= 1
+
+def test_gives_up_after_max_retries(fake_pubmed, monkeypatch):
+    monkeypatch.setattr(pubmedfetch, "MAX_RETRIES", 2)
+    fake_pubmed.failures["/entrez/eutils/efetch.fcgi"] = [500, 502, 504, 200]
+    with pytest.raises(requests.HTTPError):
+        pubmedfetch.efetch_medline(PMIDS[:3])
+    assert len(fake_pubmed.requests_seen) == 3
+    # fetch_all reports a request that failed for good as None instead of raising
+    fake_pubmed.failures["/entrez/eutils/efetch.fcgi"] = [500, 500, 500]
+    assert [text for _, text in pubmedfetch.efetch_all(PMIDS[:3])] == [None]
+
+def test_rate_limit_spaces_requests(fake_pubmed):
+    rate = 20
+    pubmedfetch.configure(rate=rate, workers=4)
+    list(pubmedfetch.efetch_all(PMIDS[:12], batch_size=1))
+    times = sorted(seen for seen, _, _ in fake_pubmed.requests_seen)
+    assert len(times) == 12
+    # the bucket holds one token, so 12 requests need at least 11 intervals of 1/rate
+    assert times[-1] - times[0] >= 11 / rate * 0.9
+    assert min(b - a for a, b in zip(times, times[1:])) >= 1 / rate * 0.5
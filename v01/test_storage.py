@@ -0,0 +1,106 @@
+import os
+import pytest
+import storage
+
+# Indexes the retrievals of storage are expected to use, by name of the retrieval
+EXPECTED_INDEXES = {
+    "retrieve_articles_by_author": "idx_articleauthors_author",
+    "retrieve_authors_by_article": "idx_articleauthors_article_department",
+    "retrieve_departments_by_article": "idx_articleauthors_article_department",
+    "retrieve_articles_by_department": "idx_articleauthors_department_article",
+    "get_edge_articles": "idx_articleauthors_department_article",
+    "count_articles_by_country": "idx_departments_country",
+    "get_edges_between": "idx_articles_published",
+    "rank_departments_by_prevalence": "idx_departmentdegrees_collaborations",
+}
+
+def make_article(i, n_authors=3):
+    return {
+        "articleTitle": f"Test article {i}",
+        "journalTitle": "The Lancet",
+        "datePublished": f"2024 Jun {i + 1}",
+        "abstract": "",
+        "authorsList": [f"Author {i}-{j}" for j in range(n_authors)],
+        "departmentList": [[f"Department {j}, University {i % 2}, City, Country.", [10.0 + j, 20.0 + i]]
+                           for j in range(n_authors)]
+    }
+
+# A migrated scratch database with a few articles, the module is pointed back at pubmed.db afterwards
+@pytest.fixture
+def database(tmp_path):
+    storage.connect(os.path.join(tmp_path, "test.db"))
+    storage.instantiate()
+    storage.ingest_articles([make_article(i) for i in range(4)])
+    yield storage.conn
+    storage.conn.close()
+    storage.connect()
+
+def test_migrations_create_indexes(database):
+    assert storage.schema_version() == len(storage.MIGRATIONS)
+    indexes = {row[0] for row in database.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert set(EXPECTED_INDEXES.values()) <= indexes
+
+def test_retrievals_use_indexes(database):
+    plans = storage.explain_retrievals()
+    for name, index in EXPECTED_INDEXES.items():
+        assert any(index in detail for detail in plans[name]), (name, plans[name])
+
+def test_no_full_scans(database):
+    storage.check_query_plans()
+
+def test_full_scans_detected():
+    assert storage._full_scans(["SCAN Articles", "SCAN aa USING COVERING INDEX idx_articleauthors_author",
+                                "MATERIALIZE p", "SCAN p"]) == ["SCAN Articles"]
+
+@pytest.mark.parametrize("date_published, expected", [
+    ("2024 Aug 8", 20240808),
+    ("2024 Aug", 20240801),
+    ("2024 Jul-Aug", 20240701),
+    ("2023 Dec-2024 Jan", 20231201),
+    ("1998-1999", 19980101),
+    ("2024 Aug 8-14", 20240808),
+    ("2023 Winter", 20231201),
+    ("2024", 20240101),
+    ("", None),
+])
+def test_publication_date(date_published, expected):
+    assert storage.publication_date(date_published) == expected
+
+def test_unlocated_department_takes_later_coordinates(database):
+    article = make_article(10, n_authors=1)
+    article["departmentList"] = [["Department of Nowhere, City, Country.", [0, 0]]]
+    storage.ingest_articles([article])
+    article = make_article(11, n_authors=1)
+    article["departmentList"] = [["Department of Nowhere, City, Country.", [1.5, 2.5]]]
+    storage.ingest_articles([article])
+    rows = database.execute("SELECT latitude, longitude FROM Departments WHERE departmentName LIKE 'Department of Nowhere%'").fetchall()
+    assert rows == [(1.5, 2.5)]
+
+def test_invalid_articles_are_skipped(database):
+    untitled = make_article(20)
+    untitled["articleTitle"] = None
+    mismatched = make_article(21)
+    mismatched["departmentList"] = mismatched["departmentList"][:-1]
+    invalid = storage.ingest_stats["invalid"]
+    article_ids = storage.ingest_articles([untitled, make_article(22), mismatched])
+    assert len(article_ids) == 1
+    assert storage.ingest_stats["invalid"] == invalid + 2
+    with pytest.raises(ValueError):
+        storage.ingest_article(mismatched)
+
+def test_reingest_returns_stored_id(database):
+    article = make_article(30)
+    article["pmid"] = 30000030
+    article_id = storage.ingest_article(article)
+    assert storage.ingest_article(article) == article_id
+    assert storage.ingest_articles([article]) == []
+    assert database.execute("SELECT COUNT(*) FROM Articles WHERE pmid = 30000030").fetchone()[0] == 1
+
+def test_deleted_article_author_rowid_is_not_reused(database):
+    newest, article_id, author_id, department_id = database.execute(
+        "SELECT rowid, article_id, author_id, department_id FROM ArticleAuthors ORDER BY rowid DESC LIMIT 1").fetchone()
+    database.execute("DELETE FROM ArticleAuthors WHERE rowid = ?", (newest,))
+    database.commit()
+    assert storage.tie_article_author_department(article_id + 1, author_id, department_id) > newest
+    storage.refresh_rollups()
+    assert storage.check_rollups()